@@ -0,0 +1,346 @@
+"""
+Reactive Reality Machine Learning Config System - benchmarks
+Copyright (C) 2022  Reactive Reality
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Usage (from the root of the repository) :
+    python benchmarks/benchmark_config.py               runs all benchmarks
+    python benchmarks/benchmark_config.py <name> ...    runs the benchmarks with the given names
+"""
+import contextlib
+import copy
+import importlib
+import inspect
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+config_module = importlib.import_module("rr-ml-config")
+make_config = config_module.user_utils.make_config
+
+
+class SweepConfiguration(config_module.config.Configuration):
+    def parameters_pre_processing(self):
+        pre_processing = {
+            "*_variations": self.register_as_config_variations,
+            "grid": self.register_as_grid,
+        }
+        if hasattr(self, "register_as_constraints"):
+            pre_processing["constraints"] = self.register_as_constraints
+        return pre_processing
+
+
+def make_sweep_config(number_of_params, grid_shape, constraints=None):
+    """Config with 'number_of_params' parameters and a grid of variations of the given shape."""
+    default = {f"sub{i % 20}.param{i}": float(i) for i in range(number_of_params)}
+    for dimension, size in enumerate(grid_shape):
+        default[f"dim{dimension}_variations"] = [
+            {f"sub{dimension}.param{dimension}": float(-i)} for i in range(size)
+        ]
+    default["grid"] = [f"dim{dimension}_variations" for dimension in range(len(grid_shape))]
+    if constraints is not None:
+        default["constraints"] = constraints
+    with contextlib.redirect_stdout(io.StringIO()):
+        return make_config(
+            default, config_class=SweepConfiguration, do_not_merge_command_line=True
+        )
+
+
+def timed(function, repeats=3):
+    """Returns the best wall-clock time of 'repeats' calls to 'function', with stdout silenced."""
+    best = float("inf")
+    for _ in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_post_processing_snapshots():
+    """Post-processing of multi-megabyte list parameters."""
+    size = 500_000
+    config_dict = {
+        "classes": [f"class_{i}" for i in range(size)],
+        "weights": [float(i) for i in range(size)],
+        "augmentations": {f"aug_{i}": [i, float(i), "crop"] for i in range(size // 10)},
+    }
+    post_processing = {
+        "classes": lambda x: x,  # validation-like function returning its input
+        "weights": tuple,  # conversion to a non-YAML type
+        "augmentations": lambda x: x,
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        config = make_config(
+            config_dict,
+            post_processing_dict=post_processing,
+            do_not_merge_command_line=True,
+        )
+    duration = timed(
+        lambda: [
+            config._process_parameter(name, value, "post")
+            for name, value in config_dict.items()
+        ]
+    )
+    print(f"post_processing_snapshots : {duration:.3f}s for {size} list items")
+
+
+def bench_large_merge():
+    """Merging a large dict into a config with as many parameters, each holding a list."""
+    size = 2000
+    default = {f"sub{i % 20}.param{i}": [float(j) for j in range(50)] for i in range(size)}
+    to_merge = {name: [float(-j) for j in range(50)] for name in default}
+    with contextlib.redirect_stdout(io.StringIO()):
+        config = make_config(default, do_not_merge_command_line=True)
+    duration = timed(lambda: config.merge(to_merge))
+    print(f"large_merge : {duration:.3f}s for {size} parameters")
+
+
+def bench_cli_overrides():
+    """Resolving many literal and wildcard command-line overrides in a large config."""
+    size = 5000
+    default = {f"sub{i % 50}.param{i}": i for i in range(size)}
+    overrides = [f"--sub{i % 50}.param{i}={-i}" for i in range(0, size, 50)]
+    overrides += [f"--sub{i}.*={i}" for i in range(0, 50, 5)]
+    overrides += [f"--*param{i}={i}" for i in range(10)]
+    command_line = " ".join(overrides)
+    with contextlib.redirect_stdout(io.StringIO()):
+        config = make_config(default, do_not_merge_command_line=True)
+    duration = timed(lambda: config._get_command_line_dict(command_line))
+    print(f"cli_overrides : {duration:.3f}s for {len(overrides)} overrides on {size} parameters")
+
+
+def bench_cli_value_parsing():
+    """Parsing long and nested list values given in the command line."""
+    size = 10_000
+    flat = str([float(i) for i in range(size)])
+    nested = "[" + ", ".join(f"[{i}, {i}.5, anchor\\ {i}!str]" for i in range(size)) + "]"
+    adapt_to_type = config_module.config_utils.adapt_to_type
+    duration = timed(
+        lambda: (
+            adapt_to_type([0.5], flat, None, "weights"),
+            adapt_to_type([[1, 0.5, "a"]], nested, None, "anchors"),
+        )
+    )
+    print(f"cli_value_parsing : {duration:.3f}s for a flat and a nested list of {size} items")
+
+
+def bench_sweep_command_lines():
+    """Exporting the command lines of the variations of a sweep over a config with 200 parameters."""
+    size = 500
+    default = {f"sub{i % 20}.param{i}": float(i) for i in range(200)}
+    with contextlib.redirect_stdout(io.StringIO()):
+        config = make_config(default, do_not_merge_command_line=True)
+        variations = []
+        for i in range(size):
+            variations.append(config.copy())
+            variations[-1].merge({"sub0.param0": i * 0.001, "sub1.param1": float(i % 40)})
+    if hasattr(config, "iter_command_line_arguments"):
+        duration = timed(lambda: list(config.iter_command_line_arguments(variations)))
+    else:
+        duration = timed(
+            lambda: [v.get_command_line_argument(do_return_string=True) for v in variations]
+        )
+    print(f"sweep_command_lines : {duration:.3f}s for {size} variations")
+
+
+def bench_variations_memory():
+    """Peak memory used while going through all variations of a grid search."""
+    config = make_sweep_config(100, (10, 10))
+
+    def go_through_variations():
+        for variation in getattr(config, "iter_variations", config.create_variations)():
+            variation.get_variation_name()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        go_through_variations()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    print(f"variations_memory : {peak / 2 ** 20:.1f}MB peak for 100 variations")
+
+
+def bench_single_variation():
+    """Creating only the last variation of a grid search, as done by each task of a job array."""
+    config = make_sweep_config(100, (10, 5))
+    if hasattr(config, "get_variation"):
+        duration = timed(lambda: config.get_variation(49))
+    else:
+        duration = timed(lambda: config.create_variations()[49], repeats=1)
+    print(f"single_variation : {duration:.3f}s for variation 49 of 50")
+
+
+def bench_derived_variations():
+    """Creating all the variations of a 1000-point grid search over a config with 50 parameters."""
+    config = make_sweep_config(50, (25, 40))
+    duration = timed(lambda: config.create_variations(), repeats=1)
+    print(f"derived_variations : {duration:.3f}s for 1000 rebuilt variations")
+    if hasattr(config, "iter_variations"):
+        duration = timed(lambda: config.create_variations(derive_from_base=True))
+        print(f"derived_variations : {duration:.3f}s for 1000 derived variations")
+
+
+def bench_parallel_variations():
+    """Rebuilding all the variations of a 200-point grid search over a config with 50 parameters."""
+    config = make_sweep_config(50, (10, 20))
+    duration = timed(lambda: config.create_variations(), repeats=1)
+    print(f"parallel_variations : {duration:.3f}s for 200 variations in 1 process")
+    workers = os.cpu_count()
+    if hasattr(config, "iter_variations"):
+        duration = timed(lambda: config.create_variations(workers=workers), repeats=1)
+        print(f"parallel_variations : {duration:.3f}s for 200 variations in {workers} processes")
+
+
+def bench_shard_selection():
+    """Listing the variations of one shard of a 1M-point grid split into 1000 shards."""
+    config = make_sweep_config(50, (10,) * 6)
+    if not hasattr(config, "variation_names"):
+        print("shard_selection : not supported")
+        return
+    duration = timed(lambda: config.variation_names(7, 1000))
+    print(f"shard_selection : {duration:.3f}s for 1000 of 1000000 variations")
+    duration = timed(lambda: next(config.iter_variations(shard=7, num_shards=1000)))
+    print(f"shard_selection : {duration:.3f}s to create the first variation of the shard")
+
+
+def bench_sample_selection():
+    """Drawing 100 variations of a 1M-point grid, compared to listing all variations first."""
+    config = make_sweep_config(50, (10,) * 6)
+    if not hasattr(config, "variation_names"):
+        print("sample_selection : not supported")
+        return
+    duration = timed(lambda: random.Random(0).sample(config.variation_names(), 100), repeats=1)
+    print(f"sample_selection : {duration:.3f}s for 100 of 1000000 variations after listing them all")
+    for sampling in ["first", "random", "latin_hypercube"]:
+        duration = timed(
+            lambda: config.variation_names(sampling=sampling, sample_size=100, seed=0)
+        )
+        print(f"sample_selection : {duration:.3f}s for 100 of 1000000 variations ({sampling})")
+
+
+def bench_constrained_grid():
+    """Counting and indexing the variations of a 1M-point grid where a constraint excludes a quarter of them."""
+    constraints = {"dim0_variations": list(range(5)), "dim1_variations": list(range(5))}
+    if not hasattr(config_module.config.Configuration, "register_as_constraints"):
+        print("constrained_grid : not supported")
+        return
+    config = make_sweep_config(50, (10,) * 6, constraints)
+    duration = timed(lambda: config.count_variations())
+    print(f"constrained_grid : {duration:.3f}s to count {config.count_variations()} valid variations")
+    duration = timed(lambda: config.variation_names(7, 1000))
+    print(f"constrained_grid : {duration:.3f}s to list the variations of one shard out of 1000")
+
+
+def bench_save():
+    """Saving a config with 2000 parameters, each holding a list, along with its hierarchy."""
+    size = 2000
+    default = {f"sub{i % 20}.param{i}": [float(j) for j in range(50)] for i in range(size)}
+    with contextlib.redirect_stdout(io.StringIO()):
+        config = make_config(default, do_not_merge_command_line=True)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "config.yaml")
+        duration = timed(lambda: config.save(path), repeats=5)
+        print(f"save : {duration:.3f}s for {size} parameters ({1 / duration:.1f} saves/s)")
+        if "fsync" in inspect.signature(config.save).parameters:
+            duration = timed(lambda: config.save(path, fsync=True), repeats=5)
+            print(f"save : {duration:.3f}s for {size} parameters with fsync")
+
+
+def bench_fingerprint():
+    """Fingerprinting and comparing configs with 2000 parameters spread over 20 sub-configs, each holding a list."""
+    size = 2000
+    default = {f"sub{i % 20}.param{i}": [float(j) for j in range(50)] for i in range(size)}
+    with contextlib.redirect_stdout(io.StringIO()):
+        config = make_config(default, do_not_merge_command_line=True)
+        other = make_config(default, do_not_merge_command_line=True)
+        other.merge({"sub0.param0": [0.0]})
+    duration = timed(lambda: hash(repr(config.get_dict(deep=True))))
+    print(f"fingerprint : {duration:.3f}s to hash the dict of the config")
+    if "_fingerprint" not in vars(config):
+        duration = timed(lambda: config.fingerprint())
+        print(f"fingerprint : {duration:.3f}s to fingerprint the config")
+        return
+
+    def fingerprint_from_scratch():
+        for sub_config in [config] + config.get_all_linked_sub_configs():
+            object.__setattr__(sub_config, "_fingerprint", None)
+        config.fingerprint()
+
+    duration = timed(fingerprint_from_scratch)
+    print(f"fingerprint : {duration:.3f}s to fingerprint the config from scratch")
+    duration = timed(lambda: (config._invalidate_fingerprints("sub0.param0"), config.fingerprint()))
+    print(f"fingerprint : {duration:.3f}s to fingerprint the config again after setting one parameter")
+    duration = timed(lambda: config == other, repeats=5)
+    print(f"fingerprint : {duration:.6f}s to compare two different configs")
+
+
+def bench_compare():
+    """Comparing two configs with 2000 parameters spread over 20 sub-configs, which differ by one parameter."""
+    size = 2000
+    default = {f"sub{i % 20}.param{i}": [float(j) for j in range(50)] for i in range(size)}
+    with contextlib.redirect_stdout(io.StringIO()):
+        config = make_config(default, do_not_merge_command_line=True)
+        other = make_config(default, do_not_merge_command_line=True)
+        other.merge({"sub0.param0": [0.0]})
+    duration = timed(lambda: config.compare(other))
+    print(f"compare : {duration:.3f}s")
+    duration = timed(lambda: config.compare(other, reduce=True))
+    print(f"compare : {duration:.3f}s with reduce=True")
+
+
+def bench_copy():
+    """Copying a config with 2000 parameters spread over 200 sub-configs nested four levels deep, merged 20 times."""
+    size = 2000
+    default = {
+        f"sub{i % 5}.sub{i % 4}.sub{i % 10}.param{i}": [float(j) for j in range(20)]
+        for i in range(size)
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        config = make_config(default, do_not_merge_command_line=True)
+        for i in range(20):
+            config.merge({f"sub{i % 5}.sub{i % 4}.sub{i % 10}.param{i}": [0.0]})
+    duration = timed(lambda: copy.deepcopy(config))
+    print(f"copy : {duration:.3f}s with deepcopy")
+    duration = timed(config.copy)
+    print(f"copy : {duration:.3f}s with Configuration.copy")
+
+
+BENCHMARKS = {
+    "post_processing_snapshots": bench_post_processing_snapshots,
+    "large_merge": bench_large_merge,
+    "cli_overrides": bench_cli_overrides,
+    "cli_value_parsing": bench_cli_value_parsing,
+    "sweep_command_lines": bench_sweep_command_lines,
+    "variations_memory": bench_variations_memory,
+    "single_variation": bench_single_variation,
+    "derived_variations": bench_derived_variations,
+    "parallel_variations": bench_parallel_variations,
+    "shard_selection": bench_shard_selection,
+    "sample_selection": bench_sample_selection,
+    "constrained_grid": bench_constrained_grid,
+    "save": bench_save,
+    "fingerprint": bench_fingerprint,
+    "compare": bench_compare,
+    "copy": bench_copy,
+}
+
+if __name__ == "__main__":
+    for benchmark_name in sys.argv[1:] or list(BENCHMARKS):
+        BENCHMARKS[benchmark_name]()
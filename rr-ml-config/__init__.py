@@ -17,5 +17,12 @@ Copyright (C) 2022  Reactive Reality
 """
 
 from .config import Configuration
+from .config_archive import ConfigArchive
+from .config_cache import ExperimentCache
 from .config_history import ConfigHistory
+from .config_queue import WorkQueue
+from .config_scheduler import SuccessiveHalving
+from .config_store import ConfigStore
+from .config_sweep import SweepExecutor
+from .config_variations import VariationBuildError
 from .user_utils import make_config, get_template_class
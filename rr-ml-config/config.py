@@ -16,7 +16,9 @@ Copyright (C) 2022  Reactive Reality
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import copy
+import contextlib
+import contextvars
+import hashlib
 import yaml
 import os
 import sys
@@ -34,33 +36,75 @@ from typing import (
     KeysView,
     ValuesView,
     Callable,
+    Iterable,
+    Iterator,
     Type,
 )
 
 from .config_utils import (
     adapt_to_type,
+    are_immutable,
     are_same_sub_configs,
     compare_string_pattern,
+    create_indexed_folder,
+    DeferredValue,
     dict_apply,
-    escape_symbols,
-    get_param_as_parsable_string,
+    encode_canonically,
+    has_exact_encoding,
+    hash_value,
+    freeze_value,
+    get_param_as_command_line_argument,
+    has_side_effects,
     is_type_valid,
+    ParameterIndex,
+    SuffixIndex,
     recursive_set_attribute,
+    StateFrame,
+    thaw_value,
     update_state,
 )
+from .config_archive import get_modification_time, path_exists, read_file, write_file
+from .config_cache import ExperimentCache
+from .config_store import ConfigStore
+from .config_variations import (
+    iter_variations_in_parallel,
+    VariationBuildError,
+    VariationSpace,
+)
 
 ConfigDeclarator = Union[str, dict]
 VariationDeclarator = Union[List[ConfigDeclarator], Dict[str, ConfigDeclarator]]
+_MISSING = object()
+_MAX_DEFAULT_SNAPSHOTS = 16
+# Whether the pre-processing functions with side effects are deferred, in the current thread only
+_DEFER_SIDE_EFFECTS = contextvars.ContextVar("defer_side_effects", default=False)
+# Protected attributes shared by a config and its copies : they are never modified in place, only replaced, so that a
+# copy only gets its own version of them once it registers variations, grids or constraints again
+_SHARED_ATTRIBUTES = frozenset(
+    [
+        "_configuration_variations",
+        "_configuration_variations_names",
+        "_constraints",
+        "_grids",
+        "_methods",
+        "_protected_attributes",
+        "_reference_folder",
+        "_variation_aliases",
+        "_variation_space",
+    ]
+)
 
 
 class Configuration:
+    _default_snapshots = {}
+
     def __init__(
         self,
         name: str = "main",
         overwriting_regime: str = "auto-save",
         config_path_or_dictionary: Optional[ConfigDeclarator] = None,
         nesting_hierarchy: Optional[List[str]] = None,
-        state: Optional[List[str]] = None,
+        state: Optional[List[StateFrame]] = None,
         main_config: Optional["Configuration"] = None,
         from_argv: bool = False,
         do_not_pre_process: bool = False,
@@ -100,8 +144,10 @@ class Configuration:
         self._pre_process_master_switch = not do_not_pre_process
         self._reference_folder = None
         self._was_last_saved_as = None
+        self._was_last_saved_in_store = None
         self._modified_buffer = []
         self._pre_postprocessing_values = {}
+        self._side_effect_inputs = {}
         self._variation_name = (
             None if main_config is None else main_config.get_variation_name()
         )
@@ -111,9 +157,13 @@ class Configuration:
         self._from_argv = from_argv
         self._configuration_variations = []
         self._configuration_variations_names = []
+        self._constraints = []
         self._grids = []
         self._sub_configs_list = []
+        self._variation_aliases = {}
+        self._variation_space = None
         self._former_saving_time = None
+        self._fingerprint = None
         self._protected_attributes = [i for i in self.__dict__] + [
             "_protected_attributes"
         ]
@@ -136,7 +186,9 @@ class Configuration:
             )
 
         # INITIALISATION
-        self._state.append(f"setup;{self._name}")
+        self._state.append(
+            StateFrame("setup", (self._name,), config_path_or_dictionary)
+        )
         self._init_from_config(config_path_or_dictionary)
         self.config_metadata["config_hierarchy"] = (
             []
@@ -162,6 +214,10 @@ class Configuration:
     def __eq__(self, other):
         if not isinstance(other, Configuration):
             return False
+        fingerprint, is_exact = self._get_fingerprint([])
+        other_fingerprint, other_is_exact = other._get_fingerprint([])
+        if is_exact and other_is_exact and fingerprint != other_fingerprint:
+            return False
         for param in self._get_user_defined_attributes():
             try:
                 if self[param] != other[param]:
@@ -176,7 +232,13 @@ class Configuration:
         return True
 
     def __hash__(self):
-        return hash(repr(self.get_dict(deep=True)))
+        # Hashes the values compared by __eq__, after post-processing, so that configs that are equal have the same hash
+        return hash(
+            frozenset(
+                (name, hash_value(self[name]))
+                for name in self._get_user_defined_attributes()
+            )
+        )
 
     def __getitem__(self, item):
         if "." in item and "*" not in item:
@@ -196,12 +258,11 @@ class Configuration:
             return getattr(self, "___" + item if item in self._methods else item)
 
     def __setattr__(self, key, value):
-        if (
-            self._operating_creation_or_merging
-            or self._main_config.is_in_operation()
-            or self.config_metadata["overwriting_regime"] == "unsafe"
-        ):
+        if self._operating_creation_or_merging or self._main_config.is_in_operation():
             object.__setattr__(self, key, value)
+        elif self.config_metadata["overwriting_regime"] == "unsafe":
+            object.__setattr__(self, key, value)
+            self._invalidate_fingerprints()
         elif self.config_metadata["overwriting_regime"] == "auto-save":
             self._manual_merge({key: value}, verbose=True, from_code=True)
         elif self.config_metadata["overwriting_regime"] == "locked":
@@ -366,6 +427,20 @@ class Configuration:
             **kwargs,
         )
 
+    def activate(self) -> None:
+        """
+        Runs the pre-processing functions with side effects that were deferred when this config was generated as a
+        variation with defer_side_effects, for the config and all its sub-configs, then post-processes the corresponding
+        parameters. Until then, these parameters hold a DeferredValue containing their value before pre-processing.
+        Configs are activated when they are saved. Does nothing for configs that are already active.
+        :return: none
+        """
+        for config in [self] + self.get_all_linked_sub_configs():
+            for name in config._get_user_defined_attributes():
+                attribute = "___" + name if name in config._methods else name
+                if type(object.__getattribute__(config, attribute)) is DeferredValue:
+                    config._resolve_deferred_value(attribute)
+
     def compare(
         self, other: "Configuration", reduce: bool = False
     ) -> List[Tuple[str, Optional[Any]]]:
@@ -374,44 +449,24 @@ class Configuration:
         configuration and the "other" configuration. Tuples are written in the form :
         (parameter_name, parameter_value_in_other). If parameter_name does not exist in other, (parameter_name, None)
         is given instead.
+        Sub-configs that are identical in both configs, as shown by their fingerprints, are skipped without comparing
+        their parameters.
         :param other: config to compare self with
         :param reduce: tries to reduce the size of the output text as much as possible
         :return: difference list
         """
-
-        def _investigate_parameter(parameter_name, object_to_check):
-            if reduce:
-                name_path = parameter_name.split(".")
-                to_display = name_path.pop(-1)
-                while (
-                    len(
-                        [
-                            p
-                            for p in object_to_check.get_parameter_names(deep=True)
-                            if compare_string_pattern(p, "*." + to_display)
-                        ]
-                    )
-                    != 1
-                    and name_path
-                ):
-                    to_display = name_path.pop(-1) + "." + to_display
-            else:
-                to_display = parameter_name
-            return (
-                self.get(parameter_name, None),
-                other.get(parameter_name, None),
-                to_display,
-            )
-
         differences = []
-        for name in self.get_parameter_names():
-            value_in_self, value_in_other, displayed_name = _investigate_parameter(
-                name, self
-            )
+        names_in_self = SuffixIndex(self.get_parameter_names()) if reduce else None
+        for name, value_in_self, value_in_other in self._iter_paired_values(other):
+            value_in_other = None if value_in_other is _MISSING else value_in_other
+            is_sub_config = isinstance(value_in_self, Configuration)
+            if is_sub_config and value_in_self._is_identical_to(value_in_other):
+                continue
             if value_in_other != value_in_self:
                 if not reduce:
-                    differences.append((displayed_name, value_in_other))
+                    differences.append((name, value_in_other))
                 else:
+                    displayed_name = names_in_self.get_shortest_name(name)
                     if not isinstance(value_in_self, Configuration):
                         if isinstance(value_in_self, dict) and isinstance(
                             value_in_other, dict
@@ -428,14 +483,16 @@ class Configuration:
                             differences.append((displayed_name, to_ret))
                         else:
                             differences.append((displayed_name, value_in_other))
-        for name in other.get_parameter_names():
-            _, value_in_other, displayed_name = _investigate_parameter(name, other)
-            if name not in self.get_parameter_names() and value_in_other is not None:
+        names_in_other = SuffixIndex(other.get_parameter_names()) if reduce else None
+        for name, value_in_other, value_in_self in other._iter_paired_values(self):
+            if value_in_self is _MISSING and value_in_other is not None:
                 if reduce:
                     if not isinstance(value_in_other, Configuration):
-                        differences.append((displayed_name, value_in_other))
+                        differences.append(
+                            (names_in_other.get_shortest_name(name), value_in_other)
+                        )
                 else:
-                    differences.append((displayed_name, value_in_other))
+                    differences.append((name, value_in_other))
         return differences
 
     def copy(self) -> "Configuration":
@@ -443,115 +500,53 @@ class Configuration:
         Returns a safe, independent copy of the config
         :return: instance of Configuration that is a deep copy of the config
         """
-        return deepcopy(self)
+        memo = {}
+        self._main_config._clone(memo)
+        if id(self) in memo:
+            return memo[id(self)]
+        return deepcopy(self, memo)
+
+    def count_variations(self) -> int:
+        """
+        Returns the number of configs that create_variations would create, without creating any of them.
+        :return: number of variations of the config
+        """
+        return len(self._get_variation_space())
 
-    def create_variations(self) -> List["Configuration"]:
+    def create_variations(
+        self,
+        derive_from_base: bool = False,
+        workers: Optional[int] = None,
+        drop_duplicates: bool = False,
+        defer_side_effects: bool = False,
+    ) -> List["Configuration"]:
         """
         Creates a list of configs that are derived from the current config using the internally tracked variations and
         grids registered via the corresponding functions (register_as_config_variations and register_as_grid).
+        :param derive_from_base: if False (default), each variation is rebuilt from its whole config hierarchy. If True,
+        each variation is derived from a copy of the current config where only the variation is merged, which is much
+        faster but requires the pre-processing and post-processing functions to have no side effects (see
+        iter_variations)
+        :param workers: if given, number of processes building the variations in parallel (see iter_variations)
+        :param drop_duplicates: if True, variations whose parameters are identical to a previous variation are dropped
+        (see iter_variations)
+        :param defer_side_effects: if True, the pre-processing functions with side effects are only called once a
+        variation is activated (see iter_variations)
         :return: the list of configs corresponding to the tracked variations
         """
-        variations_names_to_use = [i[0] for i in self._configuration_variations]
-        variations_names_to_use_changing = [
-            i[0] for i in self._configuration_variations
-        ]
-        variations_to_use = [i[1] for i in self._configuration_variations]
-        variations_to_use_changing = [i[1] for i in self._configuration_variations]
         variations = []
-        variations_names = []
-
-        # Adding grids
-        for grid in self._grids:
-            grid_to_add = []
-            names_to_add = []
-            for dimension in grid:
-                if dimension not in variations_names_to_use:
-                    raise TypeError(
-                        f"Grid element '{dimension}' is an empty list or not a registered variation configuration."
-                    )
-                if dimension in variations_names_to_use_changing:
-                    index = variations_names_to_use_changing.index(dimension)
-                    variations_names_to_use_changing.pop(index)
-                    variations_to_use_changing.pop(index)
-                if not grid_to_add:
-                    grid_to_add = [
-                        [i]
-                        for i in variations_to_use[
-                            variations_names_to_use.index(dimension)
-                        ]
-                    ]
-                    for var_name in self._configuration_variations_names:
-                        if var_name[0] == dimension:
-                            names_to_add = [var_name[0] + "_" + i for i in var_name[1]]
-                else:
-                    new_grid_to_add = []
-                    new_names_to_add = []
-                    for current_variation_index in range(len(grid_to_add)):
-                        for index in range(
-                            len(
-                                variations_to_use[
-                                    variations_names_to_use.index(dimension)
-                                ]
-                            )
-                        ):
-                            new_grid_to_add.append(
-                                grid_to_add[current_variation_index]
-                                + [
-                                    variations_to_use[
-                                        variations_names_to_use.index(dimension)
-                                    ][index]
-                                ]
-                            )
-                            for var_name in self._configuration_variations_names:
-                                if var_name[0] == dimension:
-                                    new_names_to_add.append(
-                                        names_to_add[current_variation_index]
-                                        + "*"
-                                        + var_name[0]
-                                        + "_"
-                                        + var_name[1][index]
-                                    )
-                    grid_to_add = [[c2 for c2 in c1] for c1 in new_grid_to_add]
-                    names_to_add = [c1 for c1 in new_names_to_add]
-            variations = variations + grid_to_add
-            variations_names = variations_names + names_to_add
-
-        # Adding remaining non-grid variations
-        for remaining_variation_index in range(len(variations_to_use_changing)):
-            for variation_index in range(
-                len(variations_to_use_changing[remaining_variation_index])
+        try:
+            for variation in self.iter_variations(
+                derive_from_base,
+                workers=workers,
+                drop_duplicates=drop_duplicates,
+                defer_side_effects=defer_side_effects,
             ):
-                variations.append(
-                    [
-                        variations_to_use_changing[remaining_variation_index][
-                            variation_index
-                        ]
-                    ]
-                )
-                name = variations_names_to_use_changing[remaining_variation_index]
-                for var_name in self._configuration_variations_names:
-                    if var_name[0] == name:
-                        variations_names.append(
-                            name + "_" + var_name[1][variation_index]
-                        )
-
-        # Creating configs
-        variation_configs = []
-        for variation_index in range(len(variations)):
-            variation_configs.append(
-                self.__class__.load_config(
-                    self.config_metadata["config_hierarchy"][1:]
-                    + variations[variation_index],
-                    default_config_path=self.config_metadata["config_hierarchy"][0],
-                    overwriting_regime=self.config_metadata["overwriting_regime"],
-                    do_not_merge_command_line=True,
-                    verbose=False,
-                )
-            )
-            variation_configs[-1].set_variation_name(
-                variations_names[variation_index], deep=True
-            )
-        return variation_configs
+                variations.append(variation)
+        except VariationBuildError as error:
+            error.configs = variations
+            raise
+        return variations
 
     def details(
         self,
@@ -642,6 +637,21 @@ class Configuration:
                 string_to_return += str(self[attribute]) + "\n"
         return string_to_return
 
+    def fingerprint(self, ignore: Optional[List[str]] = None) -> str:
+        """
+        Returns a fingerprint of the values of all parameters of the config before post-processing. Two configs have
+        the same fingerprint when their parameters have the same values, regardless of the order in which they were
+        defined or of how they were created, and the fingerprint is the same across processes and sessions.
+        The fingerprint of a config is a hash of the values of its parameters and of the fingerprints of its sub-configs.
+        Each sub-config keeps its fingerprint until one of its parameters is set, so that fingerprinting a config again
+        after a merge only goes through the modified sub-configs. Values modified in place, without any merge, are not
+        tracked.
+        :param ignore: names of parameters to leave out of the fingerprint, using the dot convention. They can contain
+        '*' wildcards
+        :return: hexadecimal fingerprint
+        """
+        return self._get_fingerprint([] if ignore is None else ignore)[0]
+
     def get(self, parameter_name: str, default_value: Any) -> Any:
         """
         Behaves similarly to dict.get(parameter_name, default_value)
@@ -663,7 +673,9 @@ class Configuration:
         """
         all_linked_configs = []
         for i in self._get_user_defined_attributes():
-            object_to_scan = getattr(self, "___" + i if i in self._methods else i)
+            object_to_scan = object.__getattribute__(
+                self, "___" + i if i in self._methods else i
+            )
             if isinstance(object_to_scan, Configuration):
                 all_linked_configs = (
                     all_linked_configs
@@ -700,32 +712,12 @@ class Configuration:
         are skipped when creating the list.
         :return: list or string containing the parameters
         """
-        to_return = []
-        for p in self.get_parameter_names(deep=deep):
-            if not isinstance(self[p], Configuration):
-                pair = get_param_as_parsable_string(
-                    self[p]
-                    if ".".join(self.get_nesting_hierarchy() + [p])
-                    not in self.get_main_config()._pre_postprocessing_values
-                    else self.get_main_config()._pre_postprocessing_values[
-                        ".".join(self.get_nesting_hierarchy() + [p])
-                    ],
-                    ignore_unknown_types=ignore_unknown_types,
-                )
-                if pair.count(" !"):
-                    pair_as_list = pair.split(" !")
-                    param_value, param_force = (
-                        " !".join(pair_as_list[:-1]),
-                        pair_as_list[-1],
-                    )
-                    to_return.append(
-                        escape_symbols(
-                            f"--{p} '{param_value}' !{param_force}", ["{", "}", "*"]
-                        )
-                    )
-                else:
-                    to_return.append(escape_symbols(f"--{p} {pair}", ["{", "}", "*"]))
-
+        to_return = [
+            get_param_as_command_line_argument(
+                name, value, ignore_unknown_types=ignore_unknown_types
+            )
+            for name, value in self._iter_values_before_post_processing(deep=deep)
+        ]
         return " ".join(to_return) if do_return_string else to_return
 
     @staticmethod
@@ -790,6 +782,55 @@ class Configuration:
                 ]
         return complete_list
 
+    def get_variation(
+        self,
+        index: int,
+        derive_from_base: bool = False,
+        defer_side_effects: bool = False,
+    ) -> "Configuration":
+        """
+        Creates only the config at the given index in the list returned by create_variations. This is useful when each
+        job of a job array runs a single variation.
+        :param index: index of the variation, negative indices counting from the end
+        :param derive_from_base: whether to derive the variation from a copy of the current config (see iter_variations)
+        :param defer_side_effects: whether to defer the pre-processing functions with side effects until the variation
+        is activated (see iter_variations)
+        :return: the config corresponding to this variation
+        """
+        return self._build_variation(
+            *self._get_variation_space()[index], derive_from_base, defer_side_effects
+        )
+
+    def get_variation_by_name(
+        self,
+        name: str,
+        derive_from_base: bool = False,
+        defer_side_effects: bool = False,
+    ) -> "Configuration":
+        """
+        Creates only the config with the given variation name among the configs returned by create_variations.
+        :param name: variation name of the config, as returned by variation_names
+        :param derive_from_base: whether to derive the variation from a copy of the current config (see iter_variations)
+        :param defer_side_effects: whether to defer the pre-processing functions with side effects until the variation
+        is activated (see iter_variations)
+        :return: the config corresponding to this variation
+        """
+        variation_space = self._get_variation_space()
+        return self._build_variation(
+            *variation_space[variation_space.index(name)],
+            derive_from_base,
+            defer_side_effects,
+        )
+
+    def get_variation_aliases(self) -> Dict[str, List[str]]:
+        """
+        Returns the duplicates dropped during the last iteration over the variations with drop_duplicates=True.
+        :return: dict mapping the name of each kept variation to the names of the dropped variations identical to it
+        """
+        return {
+            name: list(aliases) for name, aliases in self._variation_aliases.items()
+        }
+
     def get_variation_name(self) -> str:
         """
         Returns the variation name of the config
@@ -807,6 +848,123 @@ class Configuration:
         """
         return self.get_dict(deep).items()
 
+    def iter_variations(
+        self,
+        derive_from_base: bool = False,
+        workers: Optional[int] = None,
+        shard: Optional[int] = None,
+        num_shards: Optional[int] = None,
+        shard_by: str = "index",
+        sampling: Optional[str] = None,
+        sample_size: Optional[int] = None,
+        seed: Optional[int] = None,
+        drop_duplicates: bool = False,
+        cache: Optional[ExperimentCache] = None,
+        defer_side_effects: bool = False,
+    ) -> Iterator["Configuration"]:
+        """
+        Lazily creates the configs that are derived from the current config using the internally tracked variations and
+        grids, one at a time and in the same order and with the same names as create_variations. Only the variation
+        being used is kept in memory.
+        :param derive_from_base: if False (default), each variation is rebuilt from its whole config hierarchy, which
+        repeats the loading and processing of all parameters. If True, each variation is derived from a copy of the
+        current config where only the variation is merged, and only the parameters it changes are pre-processed and
+        post-processed again. This gives the same configs as rebuilding them as long as the pre-processing and
+        post-processing functions only depend on the value they process, and the functions with side effects are
+        marked with has_side_effects (as register_as_experiment_path is), so that they are called again for each
+        variation.
+        :param workers: if given, number of processes building the variations in parallel. The processes only receive
+        the class of the config and its hierarchy, so the class must be defined at the top level of a module. The
+        variations are still yielded in order. A variation that cannot be built does not stop the others : once all
+        others have been yielded, a VariationBuildError listing the failed variations and their errors is raised
+        :param shard: if given with num_shards, only creates the variations belonging to this shard, numbered from 0.
+        The shards are disjoint and together contain all variations, so that several nodes can each run one shard
+        :param num_shards: number of shards the variations are split into
+        :param shard_by: how variations are assigned to shards. With "index" (default), they are dealt to the shards in
+        turn, which balances the shards. With "name", they are assigned by a stable hash of their name, so adding or
+        removing other variations does not move them to another shard
+        :param sampling: if given with sample_size, only creates a sample of the variations, drawn without enumerating
+        the others. "first" takes the first variations, "random" a uniformly random subset, and "latin_hypercube" a
+        Latin hypercube sample of each grid, which covers every value of every grid dimension as evenly as possible.
+        The sampled variations keep their order and names, and can be split into shards
+        :param sample_size: number of variations in the sample
+        :param seed: seed of the random sampling, so that every node draws the same sample
+        :param drop_duplicates: if True, variations whose parameters have the same values as a previous variation
+        (compared through their fingerprint) are built but not yielded. For instance, this happens when two grids share
+        a dimension or when a variation sets a parameter to its default value. The names of the dropped variations are
+        recorded as aliases of the kept ones, see get_variation_aliases. Duplicates are only looked for among the
+        variations of the iteration, so not across shards
+        :param cache: if given, the variations whose experiment is completed according to this ExperimentCache are
+        built but not yielded, so that a relaunched sweep only runs the remaining ones
+        :param defer_side_effects: if True, the pre-processing functions with side effects (marked with
+        has_side_effects, as register_as_experiment_path is) are only called once a variation is activated (see
+        activate), so that building variations that are never run does not create experiment folders for instance.
+        In any case, they are not called for the variations dropped as duplicates or as completed
+        :return: iterator over the configs corresponding to the tracked variations
+        """
+        variation_space = self._get_variations_to_build(
+            shard, num_shards, shard_by, sampling, sample_size, seed
+        )
+        if workers is not None:
+            variations = iter_variations_in_parallel(
+                self.__class__,
+                self.config_metadata["config_hierarchy"],
+                self.config_metadata["overwriting_regime"],
+                variation_space,
+                derive_from_base,
+                workers,
+            )
+        else:
+            variations = (
+                self._build_variation(name, declarators, derive_from_base, True)
+                for name, declarators in variation_space
+            )
+        if drop_duplicates:
+            variations = self._drop_duplicate_variations(variations)
+        if cache is not None:
+            variations = (
+                variation
+                for variation in variations
+                if not cache.is_completed(variation)
+            )
+        if not defer_side_effects:
+            variations = self._activate_variations(variations)
+        return variations
+
+    def iter_command_line_arguments(
+        self,
+        variations: Optional[Iterable["Configuration"]] = None,
+        do_return_string: bool = True,
+        ignore_unknown_types: bool = False,
+    ) -> Iterator[Union[List[str], str]]:
+        """
+        Lazily yields, for each variation of the config, the command line parameters that re-create this variation from
+        the current config. Only the parameters whose value differs from the one in the current config are included.
+        The conversion of values to command line parameters is cached across variations, so exporting large sweeps only
+        converts each distinct value once.
+        :param variations: configs to export. Defaults to the variations created by iter_variations
+        :param do_return_string: whether to yield strings (True, default) or lists of strings (False)
+        :param ignore_unknown_types: if False (default), types that cannot be parsed in YAML raise an error. Else, they
+        are not type-forced in the command line
+        :return: iterator over the command line parameters of each variation
+        """
+        if variations is None:
+            variations = self.iter_variations()
+        base_values = dict(self._iter_values_before_post_processing())
+        cache = {}
+        for variation in variations:
+            to_return = []
+            for name, value in variation._iter_values_before_post_processing():
+                base_value = base_values.get(name, _MISSING)
+                if type(base_value) is type(value) and base_value == value:
+                    continue
+                to_return.append(
+                    get_param_as_command_line_argument(
+                        name, value, ignore_unknown_types, cache=cache
+                    )
+                )
+            yield " ".join(to_return) if do_return_string else to_return
+
     def keys(self) -> KeysView:
         """
         Behaves as dict.keys(), returning a _dict_keys instance containing the names of the params of the config.
@@ -964,37 +1122,45 @@ class Configuration:
         :param variation_to_register: list of configs
         :return: the same list of configs once the configs have been added to the internal variation tracker
         """
-        name = None
-        for state in self._state[::-1]:
-            if state.startswith("processing"):
-                if state.count(";arg0=") > 1:
-                    raise ValueError("How did you even manage to raise this ?")
-                name = state.split(";arg0=")[-1]
-                break
+        name = self._get_processed_parameter_name()
         if name is None:
             raise RuntimeError(
                 "register_as_config_variations was called outside _pre_process_parameter."
             )
+        object.__setattr__(self, "_variation_space", None)
 
         def _is_single_var(single):
             return isinstance(single, str) or (isinstance(single, dict))
 
         def _add_to_variations(variations, names=None):
+            # The trackers are replaced rather than modified, as copies of the config share them
+            configuration_variations = [
+                variation
+                for variation in self._configuration_variations
+                if variation[0] != name
+            ]
+            configuration_variations_names = [
+                variation
+                for variation in self._configuration_variations_names
+                if variation[0] != name
+            ]
             if variations:
-                for index, variation in enumerate(self._configuration_variations):
-                    if variation[0] == name:
-                        self._configuration_variations.pop(index)
-                        break
-                self._configuration_variations.append((name, variations))
+                configuration_variations.append((name, variations))
                 if names is None:
-                    self._configuration_variations_names.append(
+                    configuration_variations_names.append(
                         (
                             name,
                             [str(i) for i in list(range(len(variations)))],
                         )
                     )
                 else:
-                    self._configuration_variations_names.append((name, names))
+                    configuration_variations_names.append((name, names))
+            object.__setattr__(
+                self, "_configuration_variations", configuration_variations
+            )
+            object.__setattr__(
+                self, "_configuration_variations_names", configuration_variations_names
+            )
 
         if self._nesting_hierarchy:
             raise RuntimeError(
@@ -1022,7 +1188,9 @@ class Configuration:
             )
         ):
             _add_to_variations(variation_to_register)
-        elif variation_to_register is not None:
+        elif variation_to_register is None:
+            _add_to_variations(None)
+        else:
             raise TypeError(
                 f"Variations parsing failed : variations parameters must be a list of configs or a dict"
                 f"containing only configs. Instead, got : {variation_to_register}"
@@ -1030,26 +1198,81 @@ class Configuration:
 
         return variation_to_register
 
+    def register_as_constraints(
+        self,
+        constraints_to_register: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]],
+    ) -> Optional[Union[Dict[str, Any], List[Dict[str, Any]]]]:
+        """
+        Pre-processing function used to register the corresponding parameter as constraints on the grids of the current
+        config. Each constraint is a dict mapping names of parameters registered as variations to the name (or list of
+        names) of some of their variations, and excludes the grid combinations using one of these variations for every
+        parameter of the constraint. The parameters of a constraint must belong to the same grid. Excluded combinations
+        are removed before any variation is built and are not counted by count_variations.
+        :param constraints_to_register: constraint or list of constraints
+        :return: the same constraints once they have been added to the internal constraint tracker
+        """
+        name = self._get_processed_parameter_name()
+        object.__setattr__(self, "_variation_space", None)
+        # The tracker is replaced rather than modified, as copies of the config share it
+        object.__setattr__(
+            self,
+            "_constraints",
+            [
+                constraints
+                for constraints in self._constraints
+                if name is None or constraints[0] != name
+            ],
+        )
+        if constraints_to_register is None:
+            return constraints_to_register
+        constraints = (
+            constraints_to_register
+            if isinstance(constraints_to_register, list)
+            else [constraints_to_register]
+        )
+        if not all(
+            isinstance(constraint, dict)
+            and all(isinstance(param, str) for param in constraint)
+            for constraint in constraints
+        ):
+            raise TypeError(
+                f"Constraint parsing failed : unrecognized constraint declaration : {constraints_to_register}"
+            )
+        object.__setattr__(
+            self,
+            "_constraints",
+            self._constraints
+            + [
+                (
+                    name,
+                    [
+                        {
+                            param: labels if isinstance(labels, list) else [labels]
+                            for param, labels in constraint.items()
+                        }
+                        for constraint in constraints
+                    ],
+                )
+            ],
+        )
+        return constraints_to_register
+
     @staticmethod
+    @has_side_effects
     def register_as_experiment_path(path: str) -> str:
         """
         Pre-processing function used to register the corresponding parameter as the folder used for the current
         experiment. This will automatically create the relevant folder structure and append an experiment index at the
-        end of the folder name to avoid any overwriting. The path needs to be either None or an empty string (in which
+        end of the folder name to avoid any overwriting, even when many experiments start at the same time (see
+        create_indexed_folder). The path needs to be either None or an empty string (in which
         case the pre-processing does not happen), or an absolute path, or a path relative to the current working
-        directory.
+        directory. As it has side effects, it is deferred in generated variations until they are activated.
         :param path: None, '', absolute path or path relative to the current working directory
         :return: the actual created path with its appended index
         """
         if not path:
             return path
-        folder, experiment = os.path.dirname(path), os.path.basename(path)
-        os.makedirs(folder, exist_ok=True)
-        experiments = [i for i in os.listdir(folder) if i.startswith(experiment)]
-        experiment_id = max([int(i.split("_")[-1]) for i in experiments] + [-1]) + 1
-        path = os.path.join(folder, f"{experiment}_{experiment_id}")
-        os.makedirs(path, exist_ok=True)
-        return path
+        return create_indexed_folder(os.path.dirname(path), os.path.basename(path))
 
     def register_as_grid(
         self, list_to_register: Optional[List[str]]
@@ -1061,28 +1284,52 @@ class Configuration:
         :param list_to_register: list of parameters composing the grid
         :return: the same list of parameters once the grid has been added to the internal grid tracker
         """
+        name = self._get_processed_parameter_name()
+        object.__setattr__(self, "_variation_space", None)
+        # The tracker is replaced rather than modified, as copies of the config share it
+        grids = [grid for grid in self._grids if name is None or grid[0] != name]
         if isinstance(list_to_register, list) and all(
             [isinstance(param, str) for param in list_to_register]
         ):
-            self._grids.append(list_to_register)
+            grids.append((name, list_to_register))
         elif list_to_register is not None:
             raise TypeError(
                 f"Grid parsing failed : unrecognized grid declaration : {list_to_register}"
             )
+        object.__setattr__(self, "_grids", grids)
         return list_to_register
 
     def save(
-        self, filename: str = None, save_header: bool = True, save_hierarchy: str = True
+        self,
+        filename: str = None,
+        save_header: bool = True,
+        save_hierarchy: str = True,
+        fsync: bool = False,
+        verbose: bool = True,
+        store: Optional[str] = None,
+        compression: str = "deflate",
     ) -> None:
         """
         Saves the current config at the provided location. The saving format allows for a perfect recovery of the config
         by using : config = Configuration.load_config(filename). If no filename is given, overwrites the last save.
+        Files are written atomically : a reader never sees a partially written config, even if the saving is interrupted.
+        If the path goes through a zip archive, as in 'log/sweep.zip/run_3/config.yaml', the config is written in the
+        archive instead (see ConfigArchive).
         :param filename: path to the saving location of the config
         :param save_header: whether to save the config metadata as the fist parameter. This will tag the saved file as a
         saved config in the eye of the config system when it gets merged, which will deactivate pre-processing.
         :param save_hierarchy: whether to save config hierarchy as a '*_hierarchy.yaml' file
+        :param fsync: whether to flush the saved files to the disk before returning
+        :param verbose: whether to print the path to the saved config
+        :param store: if given, path to the folder of a ConfigStore. The values of the default config and the levels of
+        the hierarchy are then written in the store, only once for all the configs saved with the same store, and the
+        saved config only contains its differences with its default config. It is loaded as any other saved config.
+        Overwriting the last save uses the store of the last save by default
+        :param compression: compression of the saved files if the path goes through a zip archive : "none", "deflate"
+        (default), "bzip2" or "lzma"
         :return: none
         """
+        self.activate()
         if filename is None:
             if self._was_last_saved_as is None:
                 raise RuntimeError(
@@ -1091,37 +1338,97 @@ class Configuration:
                 )
             else:
                 filename = self._was_last_saved_as
+                store = self._was_last_saved_in_store if store is None else store
         self.config_metadata["creation_time"] = time.time()
         file_path, file_extension = os.path.splitext(filename)
         file_extension = file_extension if file_extension else ".yaml"
         config_dump_path = file_path + file_extension
-        to_dump = {
-            a: (
-                getattr(self, "___" + a if a in self._methods else a)
-                if (
-                    ".".join(self._nesting_hierarchy + [a])
-                    not in self.get_main_config()._pre_postprocessing_values
-                )
-                else self.get_main_config()._pre_postprocessing_values[
-                    ".".join(self._nesting_hierarchy + [a])
-                ]
-            )
-            if a != "config_metadata"
-            else self._format_metadata()
-            for a in (["config_metadata"] if save_header else [])
-            + self._get_user_defined_attributes()
-        }
-        with open(config_dump_path, "w") as f:
-            yaml.dump(to_dump, f, Dumper=self._get_yaml_dumper(), sort_keys=False)
+        to_dump = {"config_metadata": self._format_metadata()} if save_header else {}
+        if store is None:
+            to_dump.update(self._get_values_before_post_processing())
+        else:
+            store = ConfigStore(store)
+            to_dump.update(self._get_values_to_store(store, config_dump_path))
+        dumper = self._get_yaml_dumper()
+        write_file(
+            config_dump_path,
+            yaml.dump(to_dump, Dumper=dumper, sort_keys=False),
+            fsync=fsync,
+            compression=compression,
+        )
 
         if save_hierarchy:
             hierarchy_dump_path = f"{file_path}_hierarchy{file_extension}"
             to_dump = {"config_hierarchy": self.config_metadata["config_hierarchy"]}
-            with open(hierarchy_dump_path, "w") as f:
-                yaml.dump(to_dump, f, Dumper=self._get_yaml_dumper())
+            if store is not None:
+                to_dump = {"config_hierarchy": self._get_hierarchy_to_store(store)}
+            write_file(
+                hierarchy_dump_path,
+                yaml.dump(to_dump, Dumper=dumper),
+                fsync=fsync,
+                compression=compression,
+            )
 
         object.__setattr__(self, "_was_last_saved_as", config_dump_path)
-        print(f"Configuration saved in : {os.path.abspath(config_dump_path)}")
+        object.__setattr__(
+            self, "_was_last_saved_in_store", None if store is None else store.folder
+        )
+        if verbose:
+            print(f"Configuration saved in : {os.path.abspath(config_dump_path)}")
+
+    def save_command_line_arguments(
+        self,
+        filename: str,
+        variations: Optional[Iterable["Configuration"]] = None,
+        command: str = "",
+        ignore_unknown_types: bool = False,
+    ) -> int:
+        """
+        Saves a job-array file at the provided location, with one line per variation of the config containing the
+        command line parameters that re-create this variation from the current config (see iter_command_line_arguments).
+        :param filename: path to the saving location of the file
+        :param variations: configs to export. Defaults to the variations created by iter_variations
+        :param command: optional command to write at the start of each line, for example 'python main.py'
+        :param ignore_unknown_types: if False (default), types that cannot be parsed in YAML raise an error. Else, they
+        are not type-forced in the command line
+        :return: number of lines written in the file
+        """
+        number_of_lines = 0
+        with open(filename, "w") as f:
+            for arguments in self.iter_command_line_arguments(
+                variations, ignore_unknown_types=ignore_unknown_types
+            ):
+                f.write(f"{command} {arguments}".strip() + "\n")
+                number_of_lines += 1
+        print(f"Command lines saved in : {os.path.abspath(filename)}")
+        return number_of_lines
+
+    def save_shard_manifests(
+        self, folder: str, num_shards: int, shard_by: str = "index"
+    ) -> List[str]:
+        """
+        Splits the variations of the config into shards (see iter_variations) and saves, for each shard, a manifest
+        listing the names of its variations. Each manifest is a YAML file named 'shard_<index>.yaml' in the given
+        folder. The variations of a manifest can then be created with get_variation_by_name.
+        :param folder: path to the folder where the manifests are saved
+        :param num_shards: number of shards
+        :param shard_by: how variations are assigned to shards, "index" (default) or "name"
+        :return: list of the paths to the manifests
+        """
+        os.makedirs(folder, exist_ok=True)
+        paths = []
+        for shard in range(num_shards):
+            paths.append(os.path.join(folder, f"shard_{shard}.yaml"))
+            to_dump = {
+                "shard": shard,
+                "num_shards": num_shards,
+                "shard_by": shard_by,
+                "variations": self.variation_names(shard, num_shards, shard_by),
+            }
+            with open(paths[-1], "w") as f:
+                yaml.dump(to_dump, f, sort_keys=False)
+        print(f"Shard manifests saved in : {os.path.abspath(folder)}")
+        return paths
 
     def save_value_before_postprocessing(self, name: str, value: Any) -> None:
         """
@@ -1131,6 +1438,7 @@ class Configuration:
         :return: none
         """
         self._pre_postprocessing_values[name] = value
+        self._invalidate_fingerprints(name)
 
     def set_pre_processing(self, value: bool = True) -> None:
         """
@@ -1151,8 +1459,72 @@ class Configuration:
         """
         return self.get_dict(deep).values()
 
+    def variation_names(
+        self,
+        shard: Optional[int] = None,
+        num_shards: Optional[int] = None,
+        shard_by: str = "index",
+        sampling: Optional[str] = None,
+        sample_size: Optional[int] = None,
+        seed: Optional[int] = None,
+    ) -> List[str]:
+        """
+        Returns the variation names of the configs that create_variations would create, in the same order, without
+        creating any of them.
+        :param shard: if given with num_shards, only returns the names of the variations of this shard (see
+        iter_variations)
+        :param num_shards: number of shards the variations are split into
+        :param shard_by: how variations are assigned to shards, "index" (default) or "name"
+        :param sampling: if given with sample_size, only returns the names of a sample of the variations (see
+        iter_variations)
+        :param sample_size: number of variations in the sample
+        :param seed: seed of the random sampling
+        :return: list of variation names
+        """
+        return [
+            name
+            for name, _ in self._get_variations_to_build(
+                shard, num_shards, shard_by, sampling, sample_size, seed
+            )
+        ]
+
     # ||||| PRIVATE METHODS |||||
 
+    @staticmethod
+    def _activate_variations(
+        variations: Iterable["Configuration"],
+    ) -> Iterator["Configuration"]:
+        """Activates the variations one after the other, as they are yielded."""
+        for variation in variations:
+            variation.activate()
+            yield variation
+
+    def _build_variation(
+        self,
+        name: str,
+        declarators: List[ConfigDeclarator],
+        derive_from_base: bool = False,
+        defer_side_effects: bool = False,
+    ) -> "Configuration":
+        """Builds the variation of the config obtained by merging the given declarators at the end of its hierarchy. Its
+        pre-processing functions with side effects are called once it is built, or deferred until it is activated if
+        'defer_side_effects' is True."""
+        with self._deferring_side_effects():
+            if derive_from_base:
+                variation = self._derive_variation(declarators)
+            else:
+                variation = self.__class__.load_config(
+                    self.config_metadata["config_hierarchy"][1:] + declarators,
+                    default_config_path=self.config_metadata["config_hierarchy"][0],
+                    overwriting_regime=self.config_metadata["overwriting_regime"],
+                    do_not_merge_command_line=True,
+                    verbose=False,
+                )
+        variation.set_variation_name(name, deep=True)
+        if not defer_side_effects:
+            variation.activate()
+        return variation
+
     def _check_for_unlinked_sub_configs(self) -> None:
         """Used to raise an error when unlinked sub-configs are declared."""
         all_configs = self.get_all_sub_configs()
@@ -1168,6 +1540,114 @@ class Configuration:
                     f"Sub-config '{i.get_name()}' is unlinked. Unlinked sub-configs are not allowed."
                 )
 
+    def _clone(self, memo: Dict[int, Any]) -> "Configuration":
+        """Used by copy to rebuild the config and its sub-configs faster than deepcopy. The state and the main config
+        are rewired to their copies through 'memo', which maps the ids of the copied objects to their copies. The
+        bookkeeping that is replaced rather than modified (see _SHARED_ATTRIBUTES), the immutable values and the frozen
+        snapshots are shared with the copy, and only the containers are copied."""
+        clone = object.__new__(type(self))
+        memo[id(self)] = clone
+        attributes = clone.__dict__
+        for attribute, value in self.__dict__.items():
+            if attribute in _SHARED_ATTRIBUTES:
+                attributes[attribute] = value
+            elif attribute == "_state":
+                if id(value) not in memo:
+                    memo[id(value)] = list(value)
+                attributes[attribute] = memo[id(value)]
+            elif attribute == "_pre_postprocessing_values":
+                attributes[attribute] = dict(value)
+            elif attribute == "config_metadata":
+                attributes[attribute] = {
+                    **value,
+                    "config_hierarchy": list(value["config_hierarchy"]),
+                }
+            else:
+                attributes[attribute] = Configuration._clone_value(value, memo)
+        return clone
+
+    @staticmethod
+    def _clone_value(value: Any, memo: Dict[int, Any]) -> Any:
+        """Used by _clone to copy a value of the config. Lists and dicts are rebuilt, sharing their immutable items,
+        sub-configs of the same main config are cloned and any other mutable value is deep copied."""
+        if are_immutable((value,)):
+            return value
+        if id(value) in memo:
+            return memo[id(value)]
+        if type(value) is list:
+            if are_immutable(value):
+                memo[id(value)] = clone = list(value)
+                return clone
+            memo[id(value)] = clone = []
+            clone.extend([Configuration._clone_value(item, memo) for item in value])
+            return clone
+        if type(value) is dict:
+            if are_immutable(value.values()):
+                memo[id(value)] = clone = dict(value)
+                return clone
+            memo[id(value)] = clone = {}
+            clone.update(
+                {
+                    key: Configuration._clone_value(item, memo)
+                    for key, item in value.items()
+                }
+            )
+            return clone
+        if isinstance(value, Configuration) and id(value._main_config) in memo:
+            return value._clone(memo)
+        return deepcopy(value, memo)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _deferring_side_effects(defer: bool = True) -> Iterator[None]:
+        """Context in which the pre-processing functions with side effects are deferred (or, if 'defer' is False, not
+        deferred) in all configs processed by the current thread."""
+        token = _DEFER_SIDE_EFFECTS.set(defer)
+        try:
+            yield
+        finally:
+            _DEFER_SIDE_EFFECTS.reset(token)
+
+    def _derive_variation(
+        self, declarators: List[ConfigDeclarator]
+    ) -> "Configuration":
+        """Derives a variation from a copy of the config by merging the given declarators into it. The copy shares the
+        registered variations, the frozen snapshots and the immutable values of the config (see _clone). The
+        parameters get back their values before post-processing during the merge, as they would in a config being
+        built, then only the parameters changed by the merge are post-processed again."""
+        variation = self.copy()
+        object.__setattr__(variation, "_was_last_saved_as", None)
+        object.__setattr__(variation, "_was_last_saved_in_store", None)
+        object.__setattr__(variation, "_from_argv", False)
+        variation.config_metadata["saving_time"] = time.time()
+        variation.config_metadata.pop("creation_time", None)
+        # As in a rebuilt variation, the hierarchy refers to the declarators of the current config instead of copies
+        variation.config_metadata["config_hierarchy"] = list(
+            self.config_metadata["config_hierarchy"]
+        )
+        post_processed_values = {}
+        for name, value in list(variation._pre_postprocessing_values.items()):
+            post_processed_values[name] = variation[name]
+            variation._set_parameter_value(name, thaw_value(value))
+        for declarator in declarators:
+            variation._merge(declarator)
+        modified = {
+            ".".join(config.get_nesting_hierarchy() + [name])
+            for config in [variation] + variation.get_all_linked_sub_configs()
+            for name in config._modified_buffer
+        }
+        for name, value in post_processed_values.items():
+            if name not in modified:
+                variation._set_parameter_value(name, value)
+        # Unlike the other parameters, the ones processed with side effects cannot share the processed value of the
+        # current config : their processing is deferred again from the same input
+        for name, deferred in self._side_effect_inputs.items():
+            if name not in modified:
+                variation._pre_postprocessing_values.pop(name, None)
+                variation._set_parameter_value(name, deferred)
+        variation._post_process_modified_parameters()
+        return variation
+
     def _did_you_mean(
         self, name: str, filter_type: Optional[type] = None, suffix: str = ""
     ) -> str:
@@ -1192,12 +1672,28 @@ class Configuration:
             to_return += f"\n- {p}{suffix}"
         return to_return
 
+    def _drop_duplicate_variations(
+        self, variations: Iterable["Configuration"]
+    ) -> Iterator["Configuration"]:
+        """Yields the variations whose fingerprint was not seen before and records the others as aliases."""
+        object.__setattr__(self, "_variation_aliases", {})
+        kept_names = {}
+        for variation in variations:
+            fingerprint = variation.fingerprint()
+            if fingerprint in kept_names:
+                name = kept_names[fingerprint]
+                self._variation_aliases[name].append(variation.get_variation_name())
+            else:
+                kept_names[fingerprint] = variation.get_variation_name()
+                self._variation_aliases[kept_names[fingerprint]] = []
+                yield variation
+
     def _find_path(self, path: str) -> str:
         """Used to find a config from its (potentially relative) path, because it might be ambiguous relative to where
         it should be looked for. Probably very improvable."""
         # If the path is absolute, use it...
         if os.path.isabs(path):
-            if os.path.exists(path):
+            if path_exists(path):
                 self._reference_folder = Path(path).parents[0]
                 return path
 
@@ -1208,24 +1704,24 @@ class Configuration:
             for config in reversed(self.config_metadata["config_hierarchy"]):
                 if isinstance(config, str):
                     relative_path = os.path.join(Path(config).parents[0], path)
-                    if os.path.exists(relative_path):
+                    if path_exists(relative_path):
                         return os.path.abspath(relative_path)
 
             # ... then also check the current reference folder since the config hierarchy is not always up-to-date...
             if self._reference_folder is not None:
                 relative_path = os.path.join(self._reference_folder, path)
-                if os.path.exists(relative_path):
+                if path_exists(relative_path):
                     return os.path.abspath(relative_path)
             if (
                 self._main_config is not None
                 and self._main_config._reference_folder is not None
             ):
                 relative_path = os.path.join(self._main_config._reference_folder, path)
-                if os.path.exists(relative_path):
+                if path_exists(relative_path):
                     return os.path.abspath(relative_path)
 
             # ... and finally, check relatively to the current working directory.
-            if os.path.exists(path):
+            if path_exists(path):
                 path_to_return = os.path.abspath(path)
                 self._reference_folder = Path(path_to_return).parents[0]
                 return path_to_return
@@ -1239,6 +1735,76 @@ class Configuration:
             f"Regime : {self.config_metadata['overwriting_regime']}"
         )
 
+    def _format_state(self) -> str:
+        """Used to format the stack of ongoing operations for error messages and debugging."""
+        return "Operation stack :\n" + "\n".join(
+            f" > {frame}" for frame in self._state
+        )
+
+    def _get_values_to_store(
+        self, store: ConfigStore, config_dump_path: str
+    ) -> Dict[str, Any]:
+        """Used to write the values of the default config in a store, and return the values to save instead of the
+        values of the config : a reference to the stored default values, followed by the parameters whose values differ
+        from them."""
+        default_dump, default_values = self._get_default_snapshot()
+        folder = os.path.dirname(os.path.abspath(config_dump_path))
+        to_save = {
+            "config_default_reference": {
+                "store": os.path.relpath(os.path.abspath(store.folder), folder),
+                "fragment": store.put(default_dump),
+            }
+        }
+        for name, value in self._iter_values_before_post_processing():
+            if (
+                name not in default_values
+                or type(value) is not type(default_values[name])
+                or value != default_values[name]
+            ):
+                to_save[name] = value
+        return to_save
+
+    def _get_variation_space(self) -> VariationSpace:
+        """Describes the tracked variations and grids of the config, without building any config. The description is
+        cached until variations, grids or constraints are registered again."""
+        if self._variation_space is None:
+            variation_space = VariationSpace(
+                self._configuration_variations,
+                self._configuration_variations_names,
+                [grid for _, grid in self._grids],
+                [
+                    constraint
+                    for _, constraints in self._constraints
+                    for constraint in constraints
+                ],
+            )
+            object.__setattr__(self, "_variation_space", variation_space)
+        return self._variation_space
+
+    def _get_variations_to_build(
+        self,
+        shard: Optional[int],
+        num_shards: Optional[int],
+        shard_by: str,
+        sampling: Optional[str] = None,
+        sample_size: Optional[int] = None,
+        seed: Optional[int] = None,
+    ) -> Iterable[Tuple[str, List[ConfigDeclarator]]]:
+        """Returns the names and declarators of all variations, or only of those in the given sample and shard."""
+        variation_space = self._get_variation_space()
+        if (shard is None) != (num_shards is None):
+            raise ValueError("'shard' and 'num_shards' must be given together.")
+        if (sampling is None) != (sample_size is None):
+            raise ValueError("'sampling' and 'sample_size' must be given together.")
+        if shard is None and sampling is None:
+            return variation_space
+        indices = None
+        if sampling is not None:
+            indices = variation_space.sample(sampling, sample_size, seed)
+        if shard is not None:
+            indices = variation_space.shard(shard, num_shards, shard_by, indices)
+        return (variation_space[index] for index in indices)
+
     def _get_yaml_loader(self) -> Type[yaml.FullLoader]:
         """Used to get a custom YAML loader capable of parsing config tags."""
 
@@ -1289,67 +1855,273 @@ class Configuration:
         yaml.add_multi_constructor("", generic_constructor, Loader=loader)
         return loader
 
-    def _get_yaml_dumper(self) -> Type[yaml.Dumper]:
+    def _get_yaml_dumper(self) -> type:
         """Used to get a custom YAML dumper capable of writing config tags."""
 
         def config_representer(yaml_dumper, class_instance):
+            to_represent = class_instance._get_values_before_post_processing()
+            if not class_instance.get_nesting_hierarchy():
+                to_represent = {"config_metadata": self._format_metadata(), **to_represent}
             return yaml_dumper.represent_mapping(
-                "!" + class_instance.get_name(),
-                {
-                    a[3:]
-                    if a.startswith("___")
-                    else a: self._format_metadata()
-                    if a == "config_metadata"
-                    else (
-                        b
-                        if (
-                            ".".join(class_instance._nesting_hierarchy + [a])
-                            not in self.get_main_config()._pre_postprocessing_values
-                        )
-                        else (
-                            self.get_main_config()._pre_postprocessing_values[
-                                ".".join(class_instance._nesting_hierarchy + [a])
-                            ]
-                        )
-                    )
-                    for (a, b) in class_instance.__dict__.items()
-                    if a not in self._protected_attributes
-                    and not (
-                        class_instance.get_nesting_hierarchy()
-                        and a in ["config_metadata"]
-                    )
-                },
+                "!" + class_instance.get_name(), to_represent
             )
 
-        dumper = yaml.Dumper
-        dumper.add_representer(self.__class__, config_representer)
-        return dumper
+        # The C emitter of libyaml is used when PyYAML was built with it, the representers are the same
+        class ConfigDumper(getattr(yaml, "CDumper", yaml.Dumper)):
+            pass
+
+        ConfigDumper.add_representer(self.__class__, config_representer)
+        return ConfigDumper
+
+    def _get_default_snapshot(self) -> Tuple[str, Dict[str, Any]]:
+        """Used to build the config from its default config only, and return the dump of its values before
+        post-processing along with these values. The pre-processing functions with side effects are deferred, so that
+        building the snapshot does not create experiment folders for instance. The snapshots of the last few default
+        configs are cached, as long as these default configs do not change."""
+        default = self.config_metadata["config_hierarchy"][0]
+        if isinstance(default, str):
+            key = (self.__class__, default)
+            version = path_exists(default) and get_modification_time(default)
+        else:
+            key = (self.__class__, encode_canonically(default))
+            version = None
+        if key in self._default_snapshots and self._default_snapshots[key][0] == version:
+            # Moved to the end, so that the least recently used snapshot is the first one
+            self._default_snapshots[key] = self._default_snapshots.pop(key)
+            return self._default_snapshots[key][1]
+        with Configuration._deferring_side_effects():
+            snapshot = self.__class__.load_config(
+                default_config_path=default,
+                overwriting_regime=self.config_metadata["overwriting_regime"],
+                do_not_merge_command_line=True,
+                verbose=False,
+            )
+        self._default_snapshots.pop(key, None)
+        while len(self._default_snapshots) >= _MAX_DEFAULT_SNAPSHOTS:
+            self._default_snapshots.pop(next(iter(self._default_snapshots)))
+        self._default_snapshots[key] = (
+            version,
+            (
+                yaml.dump(
+                    snapshot._get_values_before_post_processing(),
+                    Dumper=snapshot._get_yaml_dumper(),
+                    sort_keys=False,
+                ),
+                dict(snapshot._iter_values_before_post_processing()),
+            ),
+        )
+        return self._default_snapshots[key][1]
+
+    def _get_fingerprint(
+        self, ignore: List[str], prefix: str = ""
+    ) -> Tuple[str, bool]:
+        """Used to compute the fingerprint of the config from the fingerprints of its sub-configs, along with whether all
+        its values have exact encodings (see has_exact_encoding) : only then do different fingerprints imply different
+        configs. Fingerprints computed without ignored parameters are cached until a parameter of the config is set."""
+        if not ignore and self._fingerprint is not None:
+            return self._fingerprint
+        pre_postprocessing_values = self._main_config._pre_postprocessing_values
+        nesting = ".".join(self._nesting_hierarchy + [""])
+        entries = []
+        is_exact = True
+        for name in self._get_user_defined_attributes():
+            value = object.__getattribute__(
+                self, "___" + name if name in self._methods else name
+            )
+            if isinstance(value, Configuration):
+                fingerprint, is_sub_config_exact = value._get_fingerprint(
+                    ignore, f"{prefix}{name}."
+                )
+                entries.append(f"{name}/{fingerprint}")
+                is_exact = is_exact and is_sub_config_exact
+                continue
+            if any(
+                compare_string_pattern(prefix + name, pattern) for pattern in ignore
+            ):
+                continue
+            if type(value) is DeferredValue:
+                value, is_exact = value.value, False
+            elif nesting + name in pre_postprocessing_values:
+                value, is_exact = pre_postprocessing_values[nesting + name], False
+            else:
+                is_exact = is_exact and has_exact_encoding(value)
+            entries.append(f"{name}={encode_canonically(value)}")
+        encoding = "\n".join(sorted(entries)).encode()
+        fingerprint = hashlib.blake2b(encoding, digest_size=16).hexdigest(), is_exact
+        if not ignore:
+            object.__setattr__(self, "_fingerprint", fingerprint)
+        return fingerprint
+
+    def _get_hierarchy_to_store(self, store: ConfigStore) -> List[Dict[str, str]]:
+        """Used to write the levels of the config hierarchy in a store, and return the references to write in the
+        hierarchy file instead of the levels. Config files are stored with the text they contain when saving, unless they
+        cannot be found anymore."""
+        hierarchy = []
+        for level in self.config_metadata["config_hierarchy"]:
+            if isinstance(level, str):
+                hierarchy.append({"path": level})
+                if path_exists(level):
+                    hierarchy[-1]["fragment"] = store.put(read_file(level))
+            else:
+                fragment = store.put(yaml.dump(level, Dumper=self._get_yaml_dumper()))
+                hierarchy.append({"fragment": fragment})
+        return hierarchy
 
     def _get_user_defined_attributes(self) -> List[str]:
         """Frequently used to get a list of the names of all the parameters that were in the user's config."""
+        excluded = set(self._protected_attributes)
+        excluded.add("config_metadata")
         return [
             i[3:] if i.startswith("___") else i
             for i in self.__dict__
-            if i not in self._protected_attributes + ["config_metadata"]
+            if i not in excluded
         ]
 
+    def _get_value_before_post_processing(self, name: str) -> Any:
+        """Used to get the value a parameter had before its post-processing, which is the value to use when saving the
+        config or exporting it to the command line. Parameters that were not changed by post-processing have no stored
+        value and their current value is returned instead."""
+        total_name = ".".join(self._nesting_hierarchy + [name])
+        if total_name in self._main_config._pre_postprocessing_values:
+            return thaw_value(self._main_config._pre_postprocessing_values[total_name])
+        return self[name]
+
+    def _get_processed_parameter_name(self) -> Optional[str]:
+        """Used by the registering pre-processing functions to get the name of the parameter being pre-processed, or
+        None if they were not called by the pre-processing."""
+        for frame in reversed(self._state):
+            if frame.operation == "processing":
+                return frame.argument
+        return None
+
+    def _get_values_before_post_processing(self) -> Dict[str, Any]:
+        """Same as _get_value_before_post_processing for all the parameters of the config at once, in a single pass over
+        its attributes. Sub-configs are not converted to dicts."""
+        prefix = "".join(f"{name}." for name in self._nesting_hierarchy)
+        stored_values = self._main_config._pre_postprocessing_values
+        excluded = set(self._protected_attributes)
+        excluded.add("config_metadata")
+        values = {}
+        for attribute, value in self.__dict__.items():
+            if attribute in excluded:
+                continue
+            name = attribute[3:] if attribute.startswith("___") else attribute
+            if prefix + name in stored_values:
+                value = thaw_value(stored_values[prefix + name])
+            elif type(value) is DeferredValue:
+                value = value.value
+            values[name] = value
+        return values
+
+    def _iter_values_before_post_processing(
+        self, deep: bool = True, prefix: str = ""
+    ) -> Iterator[Tuple[str, Any]]:
+        """Yields the names and values before post-processing of the parameters that are not sub-configs, in the order
+        of get_parameter_names. Sub-configs are walked directly rather than accessed through their dotted names."""
+        pre_postprocessing_values = self._main_config._pre_postprocessing_values
+        nesting = ".".join(self._nesting_hierarchy + [""])
+        sub_configs = []
+        for name in self._get_user_defined_attributes():
+            value = object.__getattribute__(
+                self, "___" + name if name in self._methods else name
+            )
+            if type(value) is DeferredValue:
+                value = value.value
+            if isinstance(value, Configuration):
+                sub_configs.append((name, value))
+            elif pre_postprocessing_values and nesting + name in pre_postprocessing_values:
+                yield prefix + name, thaw_value(pre_postprocessing_values[nesting + name])
+            else:
+                yield prefix + name, value
+        if deep:
+            for name, sub_config in sub_configs:
+                yield from sub_config._iter_values_before_post_processing(
+                    prefix=f"{prefix}{name}."
+                )
+
+    def _is_identical_to(self, other: Any) -> bool:
+        """Used to tell that two configs are identical from their fingerprints, which is only possible when all their
+        values have exact encodings (see has_exact_encoding)."""
+        if not isinstance(other, Configuration):
+            return False
+        fingerprint, is_exact = self._get_fingerprint([])
+        other_fingerprint, other_is_exact = other._get_fingerprint([])
+        return is_exact and other_is_exact and fingerprint == other_fingerprint
+
+    def _iter_paired_values(
+        self, other: Optional["Configuration"], prefix: str = ""
+    ) -> Iterator[Tuple[str, Any, Any]]:
+        """Yields the names of the parameters of the config in the order of get_parameter_names, along with their values
+        in the config and in 'other' (_MISSING if 'other' has no such parameter). Both configs are walked together, and
+        the sub-configs identical in both are not walked."""
+        sub_configs = []
+        for name in self._get_user_defined_attributes():
+            value = self[name]
+            other_value = _MISSING if other is None else other.get(name, _MISSING)
+            yield prefix + name, value, other_value
+            if isinstance(value, Configuration):
+                sub_configs.append((name, value, other_value))
+        for name, sub_config, other_sub_config in sub_configs:
+            if not isinstance(other_sub_config, Configuration):
+                other_sub_config = None
+            elif sub_config._is_identical_to(other_sub_config):
+                continue
+            yield from sub_config._iter_paired_values(
+                other_sub_config, f"{prefix}{name}."
+            )
+
+    def _invalidate_fingerprints(self, name: str = "") -> None:
+        """Used to drop the cached fingerprints of the sub-config holding a parameter, given by its name relative to the
+        config with the dot convention, and of all the configs containing this sub-config."""
+        object.__setattr__(self, "_fingerprint", None)
+        config = self._main_config
+        object.__setattr__(config, "_fingerprint", None)
+        for attribute in self._nesting_hierarchy + name.split(".")[:-1]:
+            config = config.__dict__.get(
+                attribute, config.__dict__.get("___" + attribute)
+            )
+            if not isinstance(config, Configuration):
+                return
+            object.__setattr__(config, "_fingerprint", None)
+
     @update_state("_init_from_config;_name")
     def _init_from_config(
-        self, config_path_or_dict: ConfigDeclarator, verbose: bool = False
+        self,
+        config_path_or_dict: ConfigDeclarator,
+        verbose: bool = False,
+        merge: bool = False,
     ) -> None:
         """Entrypoint for all methods trying to get any value from outside the config to inside the config. This
-        includes creating new parameters when creating the config or merging existing parameters after the creation."""
+        includes creating new parameters when creating the config or merging existing parameters after the creation.
+        If 'merge' is True, the values are merged even while the config is being created."""
         if config_path_or_dict is not None:
             if isinstance(config_path_or_dict, str):
-                with open(self._find_path(config_path_or_dict)) as yaml_file:
-                    for dictionary_to_add in yaml.load_all(
-                        yaml_file, Loader=self._get_yaml_loader()
-                    ):
-                        for item in dictionary_to_add.items():
-                            self._process_item_to_merge_or_add(item, verbose=verbose)
+                path = self._find_path(config_path_or_dict)
+                for dictionary_to_add in yaml.load_all(
+                    read_file(path), Loader=self._get_yaml_loader()
+                ):
+                    # Values following a reference to stored default values are differences with them : they are
+                    # merged, even when the config is being created
+                    after_reference = False
+                    for key, value in dictionary_to_add.items():
+                        if after_reference:
+                            self._process_item_to_merge_or_add(
+                                (key, value), verbose=verbose, merge=True
+                            )
+                            continue
+                        if key == "config_default_reference":
+                            # The path to the store is relative to the saved config
+                            store = os.path.join(os.path.dirname(path), value["store"])
+                            value = {**value, "store": store}
+                            after_reference = True
+                        self._process_item_to_merge_or_add(
+                            (key, value), verbose=verbose
+                        )
             else:
                 for item in config_path_or_dict.items():
-                    self._process_item_to_merge_or_add(item, verbose=verbose)
+                    self._process_item_to_merge_or_add(
+                        item, verbose=verbose, merge=merge
+                    )
 
     def _manual_merge(
         self,
@@ -1380,7 +2152,7 @@ class Configuration:
         verbose: bool = False,
     ) -> None:
         """Method handling all merging operations to call _init_from_config with the proper bookkeeping."""
-        if self._main_config == self:
+        if self._main_config is self:
             object.__setattr__(self, "_operating_creation_or_merging", True)
             if verbose:
                 to_print = str(config_path_or_dictionary)
@@ -1402,12 +2174,11 @@ class Configuration:
         else:
             dicts_to_merge = []
             if isinstance(config_path_or_dictionary, str):
-                with open(self._find_path(config_path_or_dictionary)) as yaml_file:
-                    for dictionary_to_add in yaml.load_all(
-                        yaml_file, Loader=self._get_yaml_loader()
-                    ):
-                        dicts_to_merge.append(dictionary_to_add)
-                    yaml_file.close()
+                for dictionary_to_add in yaml.load_all(
+                    read_file(self._find_path(config_path_or_dictionary)),
+                    Loader=self._get_yaml_loader(),
+                ):
+                    dicts_to_merge.append(dictionary_to_add)
             else:
                 dicts_to_merge.append(config_path_or_dictionary)
             for dictionary in dicts_to_merge:
@@ -1423,9 +2194,10 @@ class Configuration:
 
     @update_state("working_on;_name")
     def _process_item_to_merge_or_add(
-        self, item: Tuple[str, Any], verbose: bool = False
+        self, item: Tuple[str, Any], verbose: bool = False, merge: bool = False
     ) -> None:
-        """Method called by _init_from_config to merge or add a given key, value pair."""
+        """Method called by _init_from_config to merge or add a given key, value pair. If 'merge' is True, the value is
+        merged even while the config is being created."""
         key, value = item
 
         # Process metadata. If there is metadata, treat the rest of the merge as "loading a saved file"...
@@ -1454,6 +2226,12 @@ class Configuration:
             self.set_pre_processing(False)
             return
 
+        # ... merge the default values a config saved with a store refers to, before its own values...
+        if key == "config_default_reference":
+            store = ConfigStore(value["store"])
+            self._init_from_config(store.get_path(value["fragment"]))
+            return
+
         # ...do not accept other protected attributes to be merged...
         if key in self._protected_attributes:
             raise RuntimeError(
@@ -1464,7 +2242,7 @@ class Configuration:
         else:
 
             # If we are merging a parameter into a previously defined config...
-            if not any([state.startswith("setup") for state in self._state]):
+            if merge or not any([frame.operation == "setup" for frame in self._state]):
                 self._merge_item(key, value, verbose=verbose)
 
             # ... or if we are creating a config for the first time and are adding non-existing parameters to it
@@ -1488,7 +2266,7 @@ class Configuration:
                     f"Pattern parameter '{key}' will be merged into the following matched "
                     f"parameters : {list(to_merge.keys())}."
                 )
-            self._init_from_config(to_merge)
+            self._init_from_config(to_merge, merge=True)
         elif "." in key:
             name, new_key = key.split(".", 1)
             try:
@@ -1503,7 +2281,7 @@ class Configuration:
                 )
 
             if isinstance(sub_config, Configuration):
-                sub_config._init_from_config({new_key: value})
+                sub_config._init_from_config({new_key: value}, merge=True)
             else:
                 raise TypeError(
                     f"Failed to set parameter '{key}' : '{key.split('.')[0]}' is not a sub-config.\n"
@@ -1511,7 +2289,9 @@ class Configuration:
                 )
         else:
             try:
-                old_value = getattr(self, "___" + key if key in self._methods else key)
+                old_value = object.__getattribute__(
+                    self, "___" + key if key in self._methods else key
+                )
             except AttributeError:
                 raise AttributeError(
                     f"ERROR : parameter '{key}' cannot be merged : "
@@ -1520,9 +2300,11 @@ class Configuration:
                 )
             if isinstance(old_value, Configuration):
                 if isinstance(value, Configuration):
-                    old_value._init_from_config(value.get_dict(deep=False))
+                    old_value._init_from_config(
+                        value.get_dict(deep=False), merge=True
+                    )
                 elif isinstance(value, dict):
-                    old_value._init_from_config(value)
+                    old_value._init_from_config(value, merge=True)
                 else:
                     raise TypeError(
                         f"Trying to set sub-config '{old_value._name}'\nwith non-config element '{value}'.\n"
@@ -1536,13 +2318,15 @@ class Configuration:
                     "___" + key if key in self._methods else key,
                     self._process_parameter(key, value, "pre"),
                 )
+                self._invalidate_fingerprints()
                 if key not in self._modified_buffer:
                     self._modified_buffer.append(key)
 
     def _add_item(self, key: str, value: Any) -> None:
         """Method called by _process_item_to_merge_or_add if the value should be added and not merged. This method
         ultimately performs all additions to the config."""
-        if self._state[0].split(";")[0] == "setup" and "*" in key:
+        self._invalidate_fingerprints()
+        if self._state[0].operation == "setup" and "*" in key:
             raise ValueError(
                 f"The '*' character is not authorized in the default config ({key})."
             )
@@ -1622,8 +2406,9 @@ class Configuration:
                     self[key].config_metadata["config_hierarchy"] += [dict_to_add]
                 else:
                     if (
-                        self._state[0].split(";")[0] == "setup"
-                        and [i.split(";")[0] for i in self._state].count("setup") < 2
+                        self._state[0].operation == "setup"
+                        and [frame.operation for frame in self._state].count("setup")
+                        < 2
                     ):
                         preprocessed_parameter = self._process_parameter(
                             key, value, "pre"
@@ -1675,6 +2460,8 @@ class Configuration:
         to_merge = {}  # {param: [former_value, new_value, type_forcing], ...}
         found_config_path = not self._from_argv
         in_param = []
+        parameter_index = None
+        unknown_patterns = []
         for element in list_to_merge:
             if element.startswith("--") and (
                 found_config_path or element[2:] != "config"
@@ -1684,17 +2471,15 @@ class Configuration:
                     value = value if value != "" else None
                 else:
                     pattern, value = element[2:], None
-                in_param = []
-                for parameter in self.get_parameter_names(deep=True):
-                    if compare_string_pattern(parameter, pattern):
-                        in_param.append(parameter)
-                        to_merge[parameter] = [self[parameter], value, None]
-                if not in_param:
-                    print(
-                        f"WARNING: parameter '{pattern}', encountered while merging params from the command line, "
-                        f"does not match a param in the config. It will not be merged."
+                if parameter_index is None:
+                    parameter_index = ParameterIndex(
+                        self.get_parameter_names(deep=True)
                     )
-                    pass
+                in_param = parameter_index.match(pattern)
+                for parameter in in_param:
+                    to_merge[parameter] = [self[parameter], value, None]
+                if not in_param:
+                    unknown_patterns.append(pattern)
             elif element.startswith("--"):
                 in_param = []
                 found_config_path = True
@@ -1714,6 +2499,17 @@ class Configuration:
                 for parameter in in_param:
                     to_merge[parameter][1] += f" {element}"
 
+        if len(unknown_patterns) == 1:
+            print(
+                f"WARNING: parameter '{unknown_patterns[0]}', encountered while merging params from the command "
+                f"line, does not match a param in the config. It will not be merged."
+            )
+        elif unknown_patterns:
+            print(
+                f"WARNING: parameters {', '.join(repr(p) for p in unknown_patterns)}, encountered while merging "
+                f"params from the command line, do not match any param in the config. They will not be merged."
+            )
+
         # Infer types, then return
         return {k: adapt_to_type(v[0], v[1], v[2], k) for k, v in to_merge.items()}
 
@@ -1735,53 +2531,111 @@ class Configuration:
                     )
                 )
         for name in modified:
-            split = name.split(".")[len(self._nesting_hierarchy) :]
-            name = ".".join(split)
-            recursive_set_attribute(
-                self,
-                ".".join(split[:-1] + ["___" + split[-1]])
-                if split[-1] in self._methods
-                else name,
-                self._process_parameter(name, self[name], "post"),
-            )
+            name = ".".join(name.split(".")[len(self._nesting_hierarchy) :])
+            value = self._get_parameter_value(name)
+            # Deferred parameters are post-processed once their pre-processing has been resumed
+            if type(value) is not DeferredValue:
+                self._set_parameter_value(
+                    name, self._process_parameter(name, value, "post")
+                )
+
+    def _get_parameter_value(self, name: str) -> Any:
+        """Gets the value of an existing parameter, given by its name with the dot convention, without resuming its
+        deferred pre-processing if it has one."""
+        split = name.split(".")
+        config = self[".".join(split[:-1])] if len(split) > 1 else self
+        return object.__getattribute__(
+            config, "___" + split[-1] if split[-1] in config._methods else split[-1]
+        )
+
+    def _set_parameter_value(self, name: str, value: Any) -> None:
+        """Sets the value of an existing parameter, given by its name with the dot convention, without any processing."""
+        split = name.split(".")
+        self._invalidate_fingerprints(name)
+        recursive_set_attribute(
+            self,
+            ".".join(split[:-1] + ["___" + split[-1]])
+            if split[-1] in self._methods
+            else name,
+            value,
+        )
 
     @update_state("processing;_name")
     def _process_parameter(
-        self, name: str, parameter: Any, processing_type: str
+        self, name: str, parameter: Any, processing_type: str, first_function: int = 0
     ) -> Any:
         """This method checks if a processing function has been defined for given name, then returns the processed
-        value when that is the case."""
+        value when that is the case. The pre-processing functions with side effects are not called while variations
+        are generated : the value is then returned as a DeferredValue, to be processed from this function later."""
         if self._main_config._pre_process_master_switch:
             total_name = ".".join(self._nesting_hierarchy + [name])
-            old_value = None
             if processing_type == "pre":
                 transformation_dict = self.parameters_pre_processing()
             elif processing_type == "post":
-                old_value = copy.deepcopy(parameter)
                 transformation_dict = self.parameters_post_processing()
             else:
                 raise ValueError(
                     f"Unknown processing_type : '{processing_type}'. Valid types are 'pre', 'post', 'get'."
                 )
-            was_processed = False
-            for key, item in transformation_dict.items():
-                if compare_string_pattern(total_name, key):
-                    was_processed = True
-                    try:
-                        parameter = item(parameter)
-                    except Exception:
-                        print(
-                            f"ERROR while {processing_type}-processing param '{total_name}' :"
-                        )
-                        raise
+            processing_functions = [
+                item
+                for key, item in transformation_dict.items()
+                if compare_string_pattern(total_name, key)
+            ]
+            # The snapshot shares all immutable items with the original value instead of deep copying it
+            original_value = parameter
+            snapshot = (
+                freeze_value(parameter)
+                if processing_type == "post" and processing_functions
+                else None
+            )
+            side_effects_found = False
+            for index in range(first_function, len(processing_functions)):
+                item = processing_functions[index]
+                if (
+                    processing_type == "pre"
+                    and not side_effects_found
+                    and getattr(item, "has_side_effects", False)
+                ):
+                    side_effects_found = True
+                    deferred = DeferredValue(parameter, index)
+                    # Kept so that variations derived from this config can defer the same processing
+                    self._main_config._side_effect_inputs[total_name] = deferred
+                    if _DEFER_SIDE_EFFECTS.get():
+                        return deferred
+                try:
+                    parameter = item(parameter)
+                except Exception:
+                    print(
+                        f"ERROR while {processing_type}-processing param '{total_name}' :\n"
+                        f"{self._format_state()}"
+                    )
+                    raise
             if processing_type == "pre" and not is_type_valid(parameter, Configuration):
                 raise RuntimeError(
                     f"ERROR while pre-processing param '{total_name}' : pre-processing functions that change the type "
                     f"of a param to a non-native YAML type are forbidden because they cannot be saved. Please use a "
                     f"parameter post-processing instead."
                 )
-            elif processing_type == "post" and was_processed:
-                self.get_main_config().save_value_before_postprocessing(
-                    ".".join(self._nesting_hierarchy + [name]), old_value
-                )
+            elif processing_type == "post" and processing_functions:
+                if parameter is original_value and snapshot == parameter:
+                    # Post-processing left the value untouched : there is nothing to keep for saving purposes
+                    self.get_main_config()._pre_postprocessing_values.pop(
+                        total_name, None
+                    )
+                else:
+                    self.get_main_config().save_value_before_postprocessing(
+                        total_name, snapshot
+                    )
         return parameter
+
+    def _resolve_deferred_value(self, attribute: str) -> None:
+        """Resumes the deferred pre-processing of a parameter, given by the name of its attribute, then post-processes
+        it and stores the result in place of the DeferredValue."""
+        deferred = object.__getattribute__(self, attribute)
+        name = attribute[3:] if attribute.startswith("___") else attribute
+        with self._deferring_side_effects(False):
+            value = self._process_parameter(name, deferred.value, "pre", deferred.index)
+            value = self._process_parameter(name, value, "post")
+        object.__setattr__(self, attribute, value)
+        self._invalidate_fingerprints()
@@ -0,0 +1,220 @@
+"""
+Reactive Reality Machine Learning Config System - ConfigArchive object
+Copyright (C) 2022  Reactive Reality
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import contextlib
+import os
+import time
+import uuid
+import zipfile
+from typing import ContextManager, List, Optional, Tuple
+
+from .config_utils import atomic_open, file_lock
+
+ARCHIVE_EXTENSION = ".zip"
+COMPRESSIONS = {
+    "none": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+
+
+class ConfigArchive:
+    """
+    Zip archive containing many saved configs, to avoid creating two small files per run of a large sweep. A config
+    is saved in an archive, and loaded from it, with a path going through the archive as if it were a folder, for
+    example 'log/sweep.zip/run_3/config.yaml'. Writing a member builds a new archive next to the former one and then
+    replaces it, so that an interrupted writing leaves the former archive untouched, and a member written again
+    replaces its former version. Reading a member uses the central directory of the archive, which serves as its index,
+    without extracting anything. Processes reading and writing the same archive take a lock on a file next to it.
+    """
+
+    def __init__(self, path: str, compression: str = "deflate"):
+        """
+        :param path: path to the archive, created when the first member is written
+        :param compression: compression of the members written in the archive : "none", "deflate" (default), "bzip2"
+        or "lzma"
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError(
+                f"Unknown compression '{compression}' : expected one of {list(COMPRESSIONS)}."
+            )
+        self.path = path
+        self.compression = compression
+
+    def __contains__(self, member: str) -> bool:
+        return member in self.get_members()
+
+    def get_config_members(self) -> List[str]:
+        """
+        Returns the saved configs of the archive, which are the members saved along with a hierarchy member.
+        :return: list of member names
+        """
+        members = set(self.get_members())
+        return sorted(
+            member[: -len("_hierarchy.yaml")] + ".yaml"
+            for member in members
+            if member.endswith("_hierarchy.yaml")
+            and member[: -len("_hierarchy.yaml")] + ".yaml" in members
+        )
+
+    def get_members(self) -> List[str]:
+        """
+        Returns the names of the members of the archive.
+        :return: list of member names, empty if the archive does not exist
+        """
+        if not os.path.isfile(self.path):
+            return []
+        with self._lock(shared=True), zipfile.ZipFile(self.path) as archive:
+            return archive.namelist()
+
+    def get_modification_time(self, member: str) -> float:
+        """
+        Returns the time at which a member was written.
+        :param member: name of the member
+        :return: timestamp of the member, precise to two seconds as in any zip archive
+        """
+        with self._lock(shared=True), zipfile.ZipFile(self.path) as archive:
+            return time.mktime(archive.getinfo(member).date_time + (0, 0, -1))
+
+    def read(self, member: str) -> str:
+        """
+        Reads a member of the archive without extracting it.
+        :param member: name of the member
+        :return: content of the member
+        """
+        with self._lock(shared=True), zipfile.ZipFile(self.path) as archive:
+            try:
+                return archive.read(member).decode("utf-8")
+            except KeyError:
+                raise FileNotFoundError(
+                    f"ERROR : member '{member}' not found in archive '{self.path}'."
+                ) from None
+
+    def write(self, member: str, content: str, fsync: bool = False) -> None:
+        """
+        Writes a member in the archive, creating the archive if needed. Writing a member that already exists replaces
+        it. The other members are copied in a new archive written next to the former one, which is then replaced, so
+        that readers and interrupted writings never see a partially written archive.
+        :param member: name of the member
+        :param content: content of the member
+        :param fsync: whether to flush the new archive to the disk before replacing the former one
+        :return: none
+        """
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+        temporary_path = os.path.join(
+            folder, f".{os.path.basename(self.path)}.{uuid.uuid4().hex[:12]}.tmp"
+        )
+        with self._lock():
+            try:
+                with zipfile.ZipFile(
+                    temporary_path, "w", compression=COMPRESSIONS[self.compression]
+                ) as new_archive:
+                    if os.path.isfile(self.path):
+                        with zipfile.ZipFile(self.path) as archive:
+                            for info in archive.infolist():
+                                if info.filename != member:
+                                    new_archive.writestr(info, archive.read(info))
+                    new_archive.writestr(member, content)
+                if fsync:
+                    with open(temporary_path, "rb") as f:
+                        os.fsync(f.fileno())
+                os.replace(temporary_path, self.path)
+            except BaseException:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(temporary_path)
+                raise
+
+    def _lock(self, shared: bool = False) -> ContextManager[None]:
+        """Locks a file next to the archive, so that the archive is not replaced while it is read or written."""
+        return file_lock(f"{self.path}.lock", shared=shared)
+
+
+def split_archive_path(path: str) -> Optional[Tuple[str, str]]:
+    """
+    Splits a path going through an archive, such as 'log/sweep.zip/run_3/config.yaml', into the path to the archive
+    and the name of the member in the archive.
+    :param path: path to split
+    :return: tuple containing the path to the archive and the name of the member, or None if the path does not go
+    through an archive
+    """
+    parts = os.path.normpath(path).replace(os.sep, "/").split("/")
+    for index, part in enumerate(parts[:-1]):
+        if part.endswith(ARCHIVE_EXTENSION):
+            archive_path = os.sep.join(parts[: index + 1])
+            if not os.path.isdir(archive_path):
+                return archive_path, "/".join(parts[index + 1 :])
+    return None
+
+
+def get_modification_time(path: str) -> float:
+    """
+    Returns the modification time of a file, or of a member of an archive if the path goes through an archive.
+    :param path: path to the file or member
+    :return: timestamp of the last modification
+    """
+    archive_path = split_archive_path(path)
+    if archive_path is None:
+        return os.path.getmtime(path)
+    return ConfigArchive(archive_path[0]).get_modification_time(archive_path[1])
+
+
+def path_exists(path: str) -> bool:
+    """
+    Checks if a file exists, or a member of an archive if the path goes through an archive.
+    :param path: path to the file or member
+    :return: result of the check
+    """
+    archive_path = split_archive_path(path)
+    if archive_path is None:
+        return os.path.exists(path)
+    return archive_path[1] in ConfigArchive(archive_path[0])
+
+
+def read_file(path: str) -> str:
+    """
+    Reads a file, or a member of an archive if the path goes through an archive.
+    :param path: path to the file or member
+    :return: content of the file or member
+    """
+    archive_path = split_archive_path(path)
+    if archive_path is None:
+        with open(path) as f:
+            return f.read()
+    return ConfigArchive(archive_path[0]).read(archive_path[1])
+
+
+def write_file(
+    path: str, content: str, fsync: bool = False, compression: str = "deflate"
+) -> None:
+    """
+    Writes a file atomically (see atomic_open), or a member of an archive if the path goes through an archive.
+    :param path: path to the file or member
+    :param content: content to write
+    :param fsync: whether to flush the file to the disk before returning
+    :param compression: compression of the member if the path goes through an archive (see ConfigArchive)
+    :return: none
+    """
+    archive_path = split_archive_path(path)
+    if archive_path is None:
+        with atomic_open(path, fsync=fsync) as f:
+            f.write(content)
+    else:
+        ConfigArchive(archive_path[0], compression).write(
+            archive_path[1], content, fsync=fsync
+        )
@@ -0,0 +1,156 @@
+"""
+Reactive Reality Machine Learning Config System - ExperimentCache object
+Copyright (C) 2022  Reactive Reality
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import yaml
+
+from .config_utils import atomic_open, file_lock
+
+if TYPE_CHECKING:
+    from .config import Configuration
+
+
+class ExperimentCache:
+    """
+    On-disk index mapping the fingerprint of a config to the folder of the experiment that ran it. An experiment is
+    completed once a marker file exists in its folder, so that a relaunched sweep can skip the variations that already
+    ran. The parameters whose values change from one run to another without changing the experiment (output paths,
+    names, seeds of the logging tools...) must be declared as volatile so that they are ignored by the fingerprint.
+    """
+
+    def __init__(
+        self,
+        index_path: str,
+        volatile_keys: Optional[List[str]] = None,
+        completion_marker: str = "COMPLETED",
+    ):
+        """
+        :param index_path: path to the YAML file containing the index. It is created when the first experiment is
+        added
+        :param volatile_keys: names of the parameters ignored by the fingerprint, using the dot convention. They can
+        contain '*' wildcards
+        :param completion_marker: name of the file marking an experiment folder as completed
+        """
+        self.index_path = index_path
+        self.volatile_keys = [] if volatile_keys is None else list(volatile_keys)
+        self.completion_marker = completion_marker
+        self._entries = self._read_index()
+
+    def __contains__(self, config: "Configuration") -> bool:
+        return self.fingerprint(config) in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, config: "Configuration", folder: str) -> str:
+        """
+        Records that the experiment corresponding to the config runs in the given folder, and saves the index. The
+        index is read again and saved while holding a lock on a file next to it, so that several processes can add
+        experiments to the same index without losing any of them.
+        :param config: config of the experiment
+        :param folder: path to the folder of the experiment
+        :return: fingerprint of the config
+        """
+        fingerprint = self.fingerprint(config)
+        entry = {"folder": os.path.abspath(folder)}
+        if config.get_variation_name() is not None:
+            entry["variation_name"] = config.get_variation_name()
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        with file_lock(f"{self.index_path}.lock"):
+            self._entries = self._read_index()
+            self._entries[fingerprint] = entry
+            self._write_index()
+        return fingerprint
+
+    def fingerprint(self, config: "Configuration") -> str:
+        """
+        Returns the fingerprint of the config, ignoring the volatile keys.
+        :param config: config to fingerprint
+        :return: hexadecimal fingerprint
+        """
+        return config.fingerprint(ignore=self.volatile_keys)
+
+    def get_completed_folder(self, config: "Configuration") -> Optional[str]:
+        """
+        Returns the folder of the completed experiment corresponding to the config, if any.
+        :param config: config to look for
+        :return: path to the folder of the experiment, or None if the config never ran or its experiment is not
+        completed
+        """
+        folder = self.get_folder(config)
+        if folder is None or not os.path.isfile(
+            os.path.join(folder, self.completion_marker)
+        ):
+            return None
+        return folder
+
+    def get_folder(self, config: "Configuration") -> Optional[str]:
+        """
+        Returns the folder of the experiment corresponding to the config, whether it is completed or not.
+        :param config: config to look for
+        :return: path to the folder of the experiment, or None if the config was never added
+        """
+        entry = self._entries.get(self.fingerprint(config))
+        return None if entry is None else entry["folder"]
+
+    def is_completed(self, config: "Configuration") -> bool:
+        """
+        Checks whether the experiment corresponding to the config is completed.
+        :param config: config to look for
+        :return: whether the experiment is completed
+        """
+        return self.get_completed_folder(config) is not None
+
+    def mark_completed(
+        self, config: "Configuration", folder: Optional[str] = None
+    ) -> None:
+        """
+        Marks the experiment corresponding to the config as completed by creating the marker file in its folder.
+        :param config: config of the experiment
+        :param folder: folder of the experiment. If given, the experiment is added to the index first. Otherwise, the
+        config must have been added before
+        :return: none
+        """
+        if folder is not None:
+            self.add(config, folder)
+        folder = self.get_folder(config)
+        if folder is None:
+            raise ValueError(
+                "The experiment of this config was never added to the cache, so it has no folder to mark as completed."
+            )
+        with open(os.path.join(folder, self.completion_marker), "w"):
+            pass
+
+    def reload(self) -> None:
+        """
+        Reads the index again, to see the experiments added by other processes.
+        :return: none
+        """
+        self._entries = self._read_index()
+
+    def _read_index(self) -> Dict[str, Dict[str, str]]:
+        if not os.path.isfile(self.index_path):
+            return {}
+        with open(self.index_path) as f:
+            return yaml.safe_load(f) or {}
+
+    def _write_index(self) -> None:
+        """Writes the index atomically, so that it is never partially written. The lock of the index must be held."""
+        with atomic_open(self.index_path) as f:
+            yaml.safe_dump(self._entries, f, sort_keys=False)
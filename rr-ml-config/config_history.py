@@ -23,6 +23,7 @@ import io
 import sys
 from pathlib import Path
 from .config import Configuration
+from .config_archive import ARCHIVE_EXTENSION, ConfigArchive, get_modification_time
 import importlib
 
 
@@ -48,9 +49,7 @@ class ConfigHistory:
 
         print(f"Loading configs...")
         if not isinstance(folder_path, dict):
-            yaml_files = glob.glob(os.path.join(folder_path, "**/*.yaml"), recursive=True)
-            self.paths = [file[:-len("_hierarchy.yaml")] + ".yaml" for file in yaml_files
-                          if file.endswith("_hierarchy.yaml")]
+            self.paths = self.find_saved_configs(folder_path)
             self.names = [self.get_experiment_name_from_file(file, folder_path) for file in self.paths]
             self.folders = [("", folder_path)]*len(self.paths)
         else:
@@ -58,9 +57,7 @@ class ConfigHistory:
             self.names = []
             self.folders = []
             for i in folder_path:
-                yaml_files = glob.glob(os.path.join(folder_path[i], "**/*.yaml"), recursive=True)
-                to_add = [file[:-len("_hierarchy.yaml")] + ".yaml" for file in yaml_files if
-                          file.endswith("_hierarchy.yaml")]
+                to_add = self.find_saved_configs(folder_path[i])
                 self.paths += to_add
                 self.folders += [(i, folder_path[i])]*len(to_add)
                 self.names += [self.get_experiment_name_from_file(file, folder_path[i], name=i) for file in to_add]
@@ -74,7 +71,7 @@ class ConfigHistory:
                 self.names = [self.names[i] for i in range(len(self.names)) if ok[i]]
                 self.folders = [self.folders[i] for i in range(len(self.folders)) if ok[i]]
 
-        self.modification_times = [os.path.getmtime(file) for file in self.paths]
+        self.modification_times = [get_modification_time(file) for file in self.paths]
         self.configs = []
         for path in self.paths:
             try:
@@ -417,6 +414,13 @@ class ConfigHistory:
                   for i in range(len(matrix)) if i not in fuse]
         return matrix
 
+    @staticmethod
+    def find_saved_configs(folder_path):
+        if os.path.isfile(folder_path) and folder_path.endswith(ARCHIVE_EXTENSION):
+            return [os.path.join(folder_path, member) for member in ConfigArchive(folder_path).get_config_members()]
+        yaml_files = glob.glob(os.path.join(folder_path, "**/*.yaml"), recursive=True)
+        return [file[:-len("_hierarchy.yaml")] + ".yaml" for file in yaml_files if file.endswith("_hierarchy.yaml")]
+
     @staticmethod
     def get_experiment_name_from_file(file, folder, name=None):
         file_parent_minus_folder = os.path.relpath(Path(file).parents[0], os.path.commonpath([folder, file])).strip("/_")
@@ -0,0 +1,303 @@
+"""
+Reactive Reality Machine Learning Config System - WorkQueue object
+Copyright (C) 2022  Reactive Reality
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import contextlib
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional
+
+from .config_utils import atomic_open
+
+if TYPE_CHECKING:
+    from .config import Configuration
+
+
+class Lease:
+    """
+    Claim of a worker on a task of a WorkQueue. While the lease is held, a background thread refreshes its heartbeat so
+    that other workers do not consider it expired. Each claim of a task creates a new lease file, numbered after the
+    previous one, and containing a token unique to the claim : a worker whose lease expired and was claimed again by
+    another worker no longer holds it, and can neither refresh, release nor complete it.
+    """
+
+    def __init__(
+        self, queue: "WorkQueue", task: str, name: str, generation: int, token: str
+    ):
+        self.queue = queue
+        self.task = task
+        self.name = name
+        self.generation = generation
+        self.token = token
+        self.path = queue._get_lease_path(task, generation)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+        self._thread.start()
+
+    def complete(self) -> None:
+        """
+        Marks the task as done and releases the lease. Nothing is done if the lease is no longer held.
+        :return: none
+        """
+        self._stop_heartbeat()
+        if not self.is_held():
+            print(
+                f"WARNING : the lease of task '{self.name}' expired and was claimed by another worker : the task is "
+                f"not marked as done by this worker."
+            )
+            return
+        with open(os.path.join(self.queue.folder, "done", self.task), "w") as f:
+            f.write(self.name + "\n")
+        _remove(self.path)
+
+    def heartbeat(self) -> None:
+        """
+        Refreshes the timestamp of the lease, if it is still held. This is done automatically while the lease is held.
+        :return: none
+        """
+        if self.is_held():
+            with contextlib.suppress(FileNotFoundError):
+                os.utime(self.path)
+
+    def is_held(self) -> bool:
+        """
+        Checks that the lease was neither released nor claimed again by another worker after it expired.
+        :return: result of the check
+        """
+        if os.path.exists(self.queue._get_lease_path(self.task, self.generation + 1)):
+            return False
+        try:
+            with open(self.path) as f:
+                return f.read().split() == [self.queue.worker_id, self.token]
+        except FileNotFoundError:
+            return False
+
+    def release(self) -> None:
+        """
+        Releases the lease without completing the task, which goes back to the queue. Nothing is done if the lease is no
+        longer held.
+        :return: none
+        """
+        self._stop_heartbeat()
+        if self.is_held():
+            _remove(self.path)
+
+    def _beat(self) -> None:
+        while not self._stop.wait(self.queue.heartbeat_interval):
+            self.heartbeat()
+
+    def _stop_heartbeat(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+class WorkQueue:
+    """
+    Queue of variations stored in a folder of a shared filesystem, from which any number of workers on any number of
+    nodes can claim work. Each task is a file named after a variation. A worker claims a task by creating its lease
+    file exclusively, and keeps refreshing its timestamp while it runs. A lease that was not refreshed for longer than
+    lease_timeout belongs to a crashed worker : the task can then be claimed again by another worker, which creates the
+    next lease file of the task exclusively, so that only one worker claims it.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        lease_timeout: float = 600.0,
+        heartbeat_interval: Optional[float] = None,
+        worker_id: Optional[str] = None,
+    ):
+        """
+        :param folder: path to the folder of the queue, on a filesystem shared by all workers
+        :param lease_timeout: number of seconds after which a lease without heartbeat is considered expired
+        :param heartbeat_interval: number of seconds between two heartbeats of a lease. Defaults to a quarter of
+        lease_timeout
+        :param worker_id: identifier written in the leases of this worker, without spaces. Defaults to
+        '<hostname>:<pid>'
+        """
+        self.folder = folder
+        self.lease_timeout = lease_timeout
+        self.heartbeat_interval = (
+            lease_timeout / 4 if heartbeat_interval is None else heartbeat_interval
+        )
+        self.worker_id = (
+            f"{socket.gethostname()}:{os.getpid()}" if worker_id is None else worker_id
+        )
+
+    def claim(self) -> Optional[Lease]:
+        """
+        Claims a task that is neither done nor leased by a running worker.
+        :return: the lease of the claimed task, or None if no task is available
+        """
+        done = set(self._list("done"))
+        leases = self._get_last_leases()
+        for task in self._list("tasks"):
+            if task in done:
+                continue
+            generation = leases.get(task)
+            if generation is not None:
+                if not self._is_expired(self._get_lease_path(task, generation)):
+                    continue
+                generation += 1
+            else:
+                generation = 0
+            lease_path = self._get_lease_path(task, generation)
+            try:
+                descriptor = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            token = uuid.uuid4().hex
+            with os.fdopen(descriptor, "w") as f:
+                f.write(f"{self.worker_id} {token}\n")
+            for previous_generation in range(generation):
+                _remove(self._get_lease_path(task, previous_generation))
+            with open(os.path.join(self.folder, "tasks", task)) as f:
+                lease = Lease(self, task, f.read().strip(), generation, token)
+            if os.path.exists(os.path.join(self.folder, "done", task)):
+                # The task was completed between the listing and the claim
+                lease.release()
+                continue
+            return lease
+        return None
+
+    def get_config_path(self) -> str:
+        """
+        Returns the path to the config the variations of the queue are created from. It is saved without header, so
+        that loading it pre-processes its parameters and registers its variations again.
+        :return: path to the saved config
+        """
+        return os.path.join(self.folder, "config.yaml")
+
+    def iter_variations(
+        self, config: "Configuration", derive_from_base: bool = False
+    ) -> Iterator["Configuration"]:
+        """
+        Claims the tasks of the queue one after the other and yields the corresponding variations of the config. A task
+        is marked as done when the loop asks for the next variation, and released if the loop raises an error.
+        :param config: config the queue was populated from, usually loaded from get_config_path()
+        :param derive_from_base: whether to derive the variations from a copy of the config (see iter_variations)
+        :return: iterator over the claimed variations
+        """
+        while True:
+            lease = self.claim()
+            if lease is None:
+                return
+            try:
+                yield config.get_variation_by_name(lease.name, derive_from_base)
+            except BaseException:
+                lease.release()
+                raise
+            lease.complete()
+
+    def populate(
+        self, config: "Configuration", names: Optional[List[str]] = None
+    ) -> int:
+        """
+        Saves the config in the folder of the queue and adds a task for each of its variations. No variation is
+        created : only their names are stored. Tasks already in the queue are kept along with their progress, so the
+        queue can be populated again to resume a sweep or extend it.
+        :param config: config to create variations from
+        :param names: names of the variations to add. Defaults to all the names returned by config.variation_names()
+        :return: number of tasks added
+        """
+        for subfolder in ["tasks", "leases", "done"]:
+            os.makedirs(os.path.join(self.folder, subfolder), exist_ok=True)
+        config.save(
+            self.get_config_path(),
+            save_header=False,
+            save_hierarchy=False,
+            verbose=False,
+        )
+        existing = set(self._list("tasks"))
+        added = 0
+        for name in config.variation_names() if names is None else names:
+            task = _get_task(name)
+            if task in existing:
+                continue
+            with atomic_open(os.path.join(self.folder, "tasks", task)) as f:
+                f.write(name + "\n")
+            added += 1
+        return added
+
+    def status(self) -> Dict[str, int]:
+        """
+        Counts the tasks of the queue by state, using only the files of the queue : no config is loaded.
+        :return: dict with the number of 'queued', 'running', 'expired' and 'done' tasks. Expired tasks were leased by
+        workers that stopped sending heartbeats, and will be claimed again
+        """
+        tasks = set(self._list("tasks"))
+        done = tasks.intersection(self._list("done"))
+        running, expired = 0, 0
+        for task, generation in self._get_last_leases().items():
+            if task not in tasks or task in done:
+                continue
+            if self._is_expired(self._get_lease_path(task, generation)):
+                expired += 1
+            else:
+                running += 1
+        return {
+            "queued": len(tasks) - len(done) - running - expired,
+            "running": running,
+            "expired": expired,
+            "done": len(done),
+        }
+
+    def _get_last_leases(self) -> Dict[str, int]:
+        """Maps the leased tasks to the number of their last lease file."""
+        leases = {}
+        for lease in self._list("leases"):
+            task, _, generation = lease.rpartition(".")
+            if generation.isdigit():
+                leases[task] = max(leases.get(task, 0), int(generation))
+        return leases
+
+    def _get_lease_path(self, task: str, generation: int) -> str:
+        return os.path.join(self.folder, "leases", f"{task}.{generation}")
+
+    def _is_expired(self, lease_path: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(lease_path) > self.lease_timeout
+        except FileNotFoundError:
+            return False
+
+    def _list(self, subfolder: str) -> List[str]:
+        try:
+            return sorted(os.listdir(os.path.join(self.folder, subfolder)))
+        except FileNotFoundError:
+            return []
+
+
+def _get_task(name: str) -> str:
+    """Returns the name of the files of the task of a variation, where the characters that cannot be used in file names
+    are percent-encoded so that different variations never share a task."""
+    return urllib.parse.quote(name, safe="")
+
+
+def _remove(path: str) -> None:
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage : python -m rr.ml.config.config_queue <queue folder>")
+    counts = WorkQueue(sys.argv[1]).status()
+    print(", ".join(f"{count} {state}" for state, count in counts.items()))
@@ -0,0 +1,215 @@
+"""
+Reactive Reality Machine Learning Config System - SuccessiveHalving object
+Copyright (C) 2022  Reactive Reality
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import os
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Union,
+)
+
+import yaml
+
+from .config_sweep import EntryPoint, RunResult, SweepExecutor
+
+if TYPE_CHECKING:
+    from .config import Configuration
+
+Number = Union[int, float]
+
+
+class Rung(NamedTuple):
+    index: int
+    budget: Number
+    results: List[RunResult]
+    metrics: List[Any]
+    promoted: List[str]
+
+
+class SuccessiveHalving:
+    """
+    Runs the variations of a config with successive halving : all of them are first run with a small budget (number of
+    epochs, of training steps...), then only the best fraction of them is run again with a budget multiplied by eta,
+    and so on until the maximum budget is reached. Most of the compute thus goes to the most promising variations.
+    """
+
+    def __init__(
+        self,
+        entry_point: EntryPoint,
+        output_folder: str,
+        budget_key: str,
+        min_budget: Number,
+        max_budget: Number,
+        metric: Sequence[Any],
+        eta: int = 3,
+        mode: str = "min",
+        workers: Optional[int] = None,
+        timeout: Optional[float] = None,
+        retries: int = 0,
+        poll_interval: float = 0.1,
+    ):
+        """
+        :param entry_point: entry point running a variation, as in SweepExecutor
+        :param output_folder: folder containing one folder per rung, named 'rung_<index>', containing the run folders
+        :param budget_key: name of the parameter holding the budget of a run, using the dot convention
+        :param min_budget: budget of the runs of the first rung
+        :param max_budget: budget of the runs of the last rung
+        :param metric: metric used to rank the runs, in the format accepted by ConfigHistory : a tuple containing a
+        name and a function mapping a list of run folders to the list of their metric values, and optionally a unit.
+        Runs without a metric value (None) are ranked last
+        :param eta: factor by which the budget is multiplied, and the number of runs divided, between two rungs
+        :param mode: "min" if lower metric values are better, "max" otherwise
+        :param workers: maximum number of runs at the same time, as in SweepExecutor
+        :param timeout: if given, runs lasting longer than this number of seconds are killed
+        :param retries: number of times a failed or killed run is started again
+        :param poll_interval: number of seconds between two checks of the running subprocesses
+        """
+        if not isinstance(eta, int) or eta < 2:
+            raise ValueError(f"eta must be an integer greater than 1, got {eta}.")
+        if mode not in ["min", "max"]:
+            raise ValueError(f"mode must be 'min' or 'max', got '{mode}'.")
+        if not 0 < min_budget <= max_budget:
+            raise ValueError(
+                f"Budgets must satisfy 0 < min_budget <= max_budget, got {min_budget} and {max_budget}."
+            )
+        if not isinstance(metric, (list, tuple)) or len(metric) not in [2, 3]:
+            raise TypeError(
+                f"Unrecognized format for metric {metric} : expected (name, function) or (name, function, unit)."
+            )
+        self.entry_point = entry_point
+        self.output_folder = output_folder
+        self.budget_key = budget_key
+        self.min_budget = min_budget
+        self.max_budget = max_budget
+        self.metric = metric
+        self.eta = eta
+        self.mode = mode
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.poll_interval = poll_interval
+
+    def get_budgets(self) -> List[Number]:
+        """
+        Returns the budget of each rung.
+        :return: list of budgets, increasing by a factor eta up to max_budget
+        """
+        budgets = [self.min_budget]
+        while budgets[-1] < self.max_budget:
+            budgets.append(min(budgets[-1] * self.eta, self.max_budget))
+        return budgets
+
+    def run(
+        self,
+        config: "Configuration",
+        variations: Optional[Iterable["Configuration"]] = None,
+    ) -> List[Rung]:
+        """
+        Runs the successive halving and waits for its end. A summary of each rung is saved in 'rungs.yaml' in the output
+        folder.
+        :param config: base config, whose variations are registered with register_as_config_variations or
+        register_as_grid
+        :param variations: configs to run. Defaults to the variations of the config, which are created again from their
+        names at each rung so that they are not all kept in memory
+        :return: the rungs, in order. The promoted runs of the last rung are the best variations
+        """
+        if variations is None:
+            names = config.variation_names()
+            build = config.get_variation_by_name
+        else:
+            variations = {
+                variation.get_variation_name(): variation for variation in variations
+            }
+            names = list(variations)
+            build = variations.__getitem__
+        rungs = []
+        for index, budget in enumerate(self.get_budgets()):
+            executor = SweepExecutor(
+                self.entry_point,
+                os.path.join(self.output_folder, f"rung_{index}"),
+                self.workers,
+                self.timeout,
+                self.retries,
+                self.poll_interval,
+            )
+            results = executor.run(
+                config, (self._set_budget(build(name), budget) for name in names)
+            )
+            metrics = self._read_metrics(results)
+            is_last_rung = budget == self.max_budget
+            number_promoted = 1 if is_last_rung else max(1, len(names) // self.eta)
+            ranking = sorted(
+                range(len(names)),
+                key=lambda i: self._get_sort_key(results[i], metrics[i]),
+            )
+            names = [names[i] for i in sorted(ranking[:number_promoted])]
+            rungs.append(Rung(index, budget, results, list(metrics), names))
+            print(
+                f"Successive halving : rung {index} (budget {budget}) done, {len(names)} of {len(results)} runs "
+                f"promoted."
+            )
+        self._save_summary(rungs)
+        return rungs
+
+    def _get_sort_key(self, result: RunResult, metric: Any) -> tuple:
+        if result.status != "succeeded" or metric is None:
+            return (1, 0)
+        return (0, metric if self.mode == "min" else -metric)
+
+    def _read_metrics(self, results: List[RunResult]) -> List[Any]:
+        """Reads the metric of each run. A failed or killed run usually wrote no metric, so when the metric function
+        raises an error for the whole rung, it is called again for each run, with None for the runs it fails on."""
+        folders = [Path(result.folder) for result in results]
+        try:
+            return list(self.metric[1](folders))
+        except Exception as e:
+            print("There was an error parsing metrics : ", e)
+        metrics = []
+        for folder in folders:
+            try:
+                metrics.append(self.metric[1]([folder])[0])
+            except Exception:
+                metrics.append(None)
+        return metrics
+
+    def _save_summary(self, rungs: List[Rung]) -> None:
+        summary = [
+            {
+                "rung": rung.index,
+                "budget": rung.budget,
+                "runs": {
+                    result.name: {"status": result.status, self.metric[0]: metric}
+                    for result, metric in zip(rung.results, rung.metrics)
+                },
+                "promoted": rung.promoted,
+            }
+            for rung in rungs
+        ]
+        with open(os.path.join(self.output_folder, "rungs.yaml"), "w") as f:
+            yaml.dump(summary, f, sort_keys=False)
+
+    def _set_budget(
+        self, variation: "Configuration", budget: Number
+    ) -> "Configuration":
+        variation.merge({self.budget_key: budget})
+        return variation
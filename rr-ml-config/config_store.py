@@ -0,0 +1,90 @@
+"""
+Reactive Reality Machine Learning Config System - ConfigStore object
+Copyright (C) 2022  Reactive Reality
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import hashlib
+import os
+from typing import Any, List
+
+import yaml
+
+from .config_archive import path_exists, read_file, split_archive_path, write_file
+
+
+class ConfigStore:
+    """
+    Content-addressed store of the fragments of saved configs. A fragment is written once, in a file named after the
+    hash of its content, however many configs refer to it. Configs saved with a store (see Configuration.save) only
+    contain their differences with their default config, whose values are kept in the store, and their hierarchy file
+    only contains references to the fragments of the store.
+    """
+
+    def __init__(self, folder: str):
+        """
+        :param folder: path to the folder of the store. It can go through an archive (see ConfigArchive)
+        """
+        self.folder = folder
+
+    def __contains__(self, reference: str) -> bool:
+        return path_exists(self.get_path(reference))
+
+    def get_path(self, reference: str) -> str:
+        """
+        Returns the path to the file of a fragment.
+        :param reference: hash of the content of the fragment
+        :return: path to the file of the fragment
+        """
+        return os.path.join(self.folder, reference[:2], f"{reference}.yaml")
+
+    def put(self, content: str) -> str:
+        """
+        Writes a fragment in the store, unless a fragment with the same content is already stored.
+        :param content: content of the fragment, in YAML
+        :return: reference to the fragment, which is the hash of its content
+        """
+        reference = hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+        path = self.get_path(reference)
+        if not path_exists(path):
+            if split_archive_path(path) is None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_file(path, content)
+        return reference
+
+    def read(self, reference: str) -> str:
+        """
+        Reads a fragment of the store.
+        :param reference: hash of the content of the fragment
+        :return: content of the fragment, in YAML
+        """
+        return read_file(self.get_path(reference))
+
+    def read_hierarchy(self, hierarchy_path: str) -> List[Any]:
+        """
+        Reassembles the hierarchy of a config saved with a store.
+        :param hierarchy_path: path to the '*_hierarchy.yaml' file of the saved config
+        :return: config hierarchy, as in config.config_metadata["config_hierarchy"], except that paths to config files
+        are replaced with the text the files contained when the config was saved. Paths to files that could not be
+        found when saving are kept
+        """
+        hierarchy = []
+        for level in yaml.safe_load(read_file(hierarchy_path))["config_hierarchy"]:
+            if "fragment" not in level:
+                hierarchy.append(level["path"])
+            elif "path" in level:
+                hierarchy.append(self.read(level["fragment"]))
+            else:
+                hierarchy.append(yaml.full_load(self.read(level["fragment"])))
+        return hierarchy
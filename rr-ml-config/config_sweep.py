@@ -0,0 +1,287 @@
+"""
+Reactive Reality Machine Learning Config System - SweepExecutor object
+Copyright (C) 2022  Reactive Reality
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import multiprocessing
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import time
+import traceback
+import urllib.parse
+from collections import deque
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Union,
+)
+
+import yaml
+
+if TYPE_CHECKING:
+    from .config import Configuration
+
+EntryPoint = Union[str, Callable[["Configuration", str], Any]]
+
+
+class RunResult(NamedTuple):
+    name: str
+    folder: str
+    status: str
+    exit_code: Optional[int]
+    attempts: int
+    duration: float
+
+
+class SweepExecutor:
+    """
+    Runs the variations of a config in a bounded pool of subprocesses. Each variation runs in its own folder, where its
+    config is saved along with the log of the run and a 'run_status.yaml' file recording how the run ended.
+    """
+
+    def __init__(
+        self,
+        entry_point: EntryPoint,
+        output_folder: str,
+        workers: Optional[int] = None,
+        timeout: Optional[float] = None,
+        retries: int = 0,
+        poll_interval: float = 0.1,
+    ):
+        """
+        :param entry_point: either a callable taking the config of a variation and the path to its run folder, called
+        in a subprocess, or a command template run in a shell. The template can contain the fields {config} (path to
+        the saved config of the variation), {folder} (path to the run folder), {name} (variation name) and {args}
+        (command line parameters turning the base config into the variation, see iter_command_line_arguments)
+        :param output_folder: folder containing the run folders, named after the variations
+        :param workers: maximum number of runs at the same time. Defaults to the number of CPUs
+        :param timeout: if given, runs lasting longer than this number of seconds are killed
+        :param retries: number of times a failed or killed run is started again
+        :param poll_interval: number of seconds between two checks of the running subprocesses
+        """
+        self.entry_point = entry_point
+        self.output_folder = output_folder
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.timeout = timeout
+        self.retries = retries
+        self.poll_interval = poll_interval
+
+    def get_run_folder(self, name: str) -> str:
+        """
+        Returns the folder of the run of the variation with the given name. The characters of the name that cannot be
+        used in file names are percent-encoded, so that different variations never share a run folder.
+        :param name: variation name, or None for a config without variations
+        :return: path to the run folder
+        """
+        return os.path.join(
+            self.output_folder,
+            "main" if name is None else urllib.parse.quote(name, safe=""),
+        )
+
+    def run(
+        self,
+        config: "Configuration",
+        variations: Optional[Iterable["Configuration"]] = None,
+    ) -> List[RunResult]:
+        """
+        Runs variations of the config and waits for all of them to end. The variations are created lazily, only when a
+        worker becomes available. A summary of the progress is printed each time a run ends.
+        :param config: base config, used to compute the command line parameters of the variations
+        :param variations: configs to run. Defaults to the variations created by config.iter_variations, or to the
+        config itself if it has no variations
+        :return: result of each run, in the order of the variations
+        """
+        if variations is None:
+            variations = (
+                config.iter_variations() if config.count_variations() else [config]
+            )
+        variations = iter(variations)
+        retried, running, results = deque(), [], []
+        exhausted = False
+        while True:
+            while len(running) < self.workers and (retried or not exhausted):
+                if retried:
+                    running.append(retried.popleft().start())
+                    continue
+                variation = next(variations, None)
+                if variation is None:
+                    exhausted = True
+                    break
+                results.append(None)
+                run = _Run(self, config, variation, index=len(results) - 1)
+                running.append(run.start())
+            if not running:
+                break
+            time.sleep(self.poll_interval)
+            for run in list(running):
+                status = run.poll()
+                if status is None:
+                    continue
+                running.remove(run)
+                if status != "succeeded" and run.attempts <= self.retries:
+                    retried.append(run)
+                    continue
+                results[run.index] = run.finish(status)
+                finished = [result for result in results if result is not None]
+                failed = sum(result.status != "succeeded" for result in finished)
+                print(
+                    f"Sweep progress : run '{run.folder}' {status}. {len(finished)} finished ({failed} failed), "
+                    f"{len(running) + len(retried)} running."
+                )
+        return results
+
+
+class _Run:
+    """One variation being run by a SweepExecutor, possibly over several attempts."""
+
+    def __init__(
+        self,
+        executor: SweepExecutor,
+        config: "Configuration",
+        variation: "Configuration",
+        index: int,
+    ):
+        self.executor = executor
+        self.config = config
+        self.variation = variation
+        self.index = index
+        self.name = variation.get_variation_name()
+        self.folder = executor.get_run_folder(self.name)
+        self.attempts = 0
+        self.exit_code = None
+        self._process = None
+        self._start_time = None
+        self._first_start_time = None
+
+    def finish(self, status: str) -> RunResult:
+        """Records the end of the run next to its saved config and returns its result."""
+        result = RunResult(
+            self.name,
+            self.folder,
+            status,
+            self.exit_code,
+            self.attempts,
+            time.time() - self._first_start_time,
+        )
+        with open(os.path.join(self.folder, "run_status.yaml"), "w") as f:
+            yaml.safe_dump(dict(result._asdict()), f, sort_keys=False)
+        return result
+
+    def poll(self) -> Optional[str]:
+        """Returns how the run ended ('succeeded', 'failed' or 'timeout'), or None if it is still running."""
+        if isinstance(self._process, subprocess.Popen):
+            self.exit_code = self._process.poll()
+        else:
+            self.exit_code = self._process.exitcode
+        if self.exit_code is not None:
+            return "succeeded" if self.exit_code == 0 else "failed"
+        timeout = self.executor.timeout
+        if timeout is not None and time.time() - self._start_time > timeout:
+            self._kill()
+            return "timeout"
+        return None
+
+    def start(self) -> "_Run":
+        """Starts a new attempt of the run, appending its output to the log of the run."""
+        self.attempts += 1
+        self._start_time = time.time()
+        if self._first_start_time is None:
+            self._first_start_time = self._start_time
+        os.makedirs(self.folder, exist_ok=True)
+        config_path = os.path.join(self.folder, "config.yaml")
+        log_path = os.path.join(self.folder, "run.log")
+        if self.attempts == 1:
+            self.variation.save(config_path, verbose=False)
+        with open(log_path, "a") as log:
+            log.write(f"===== Attempt {self.attempts} =====\n")
+        entry_point = self.executor.entry_point
+        if isinstance(entry_point, str):
+            arguments = next(self.config.iter_command_line_arguments([self.variation]))
+            command = entry_point.format(
+                config=shlex.quote(config_path),
+                folder=shlex.quote(self.folder),
+                name=shlex.quote(str(self.name)),
+                args=arguments,
+            )
+            with open(log_path, "a") as log:
+                self._process = subprocess.Popen(
+                    command,
+                    shell=True,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                    start_new_session=True,
+                )
+        else:
+            self._process = multiprocessing.Process(
+                target=_run_entry_point,
+                args=(entry_point, self.variation, self.folder, log_path),
+            )
+            self._process.start()
+        return self
+
+    def _kill(self) -> None:
+        if isinstance(self._process, subprocess.Popen):
+            if hasattr(os, "killpg"):
+                # The command runs in a shell : the whole process group is killed, not only the shell
+                os.killpg(self._process.pid, signal.SIGKILL)
+            else:
+                self._process.kill()
+            self.exit_code = self._process.wait()
+        else:
+            self._process.kill()
+            self._process.join()
+            self.exit_code = self._process.exitcode
+
+
+def _run_entry_point(
+    entry_point: Callable[["Configuration", str], Any],
+    variation: "Configuration",
+    folder: str,
+    log_path: str,
+) -> None:
+    """Runs a callable entry point in a subprocess, with its standard output and error redirected to the log. The
+    subprocess exits with the code passed to sys.exit by the entry point, as a script would, or with 1 if the entry
+    point raises an error."""
+    with open(log_path, "a") as log:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        # The streams inherited from the parent may not write to the file descriptors (e.g. when they are captured)
+        sys.stdout = os.fdopen(1, "w", buffering=1, closefd=False)
+        sys.stderr = os.fdopen(2, "w", buffering=1, closefd=False)
+        exit_code = 0
+        try:
+            entry_point(variation, folder)
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                exit_code = 0 if e.code is None else e.code
+            else:
+                print(e.code, file=sys.stderr)
+                exit_code = 1
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
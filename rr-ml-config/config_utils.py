@@ -15,9 +15,221 @@ Copyright (C) 2022  Reactive Reality
     You should have received a copy of the GNU Lesser General Public License
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
+from bisect import bisect_left
 from collections.abc import Mapping
+import contextlib
+import copy
 import functools
-from typing import Callable, Any, List, Union
+import os
+import re
+import uuid
+from typing import (
+    Callable,
+    Any,
+    Dict,
+    IO,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+_ATOMIC_TYPES = frozenset([int, float, str, bool, bytes, complex, type(None)])
+_EXACT_TYPES = frozenset([int, float, str, bool, type(None)])
+_CONTAINER_TOKENS = re.compile(r"\\(.?)|[,\[\]{}]", re.DOTALL)
+_FORCEABLE_TYPES = ("int", "float", "str", "bool", "list", "dict")
+_OPENING_BRACKETS = {"]": "[", "}": "{"}
+
+
+class FrozenList(tuple):
+    """
+    Immutable snapshot of a list. Its items are shared with the snapshotted list when they are immutable, so taking a
+    snapshot only copies the skeleton of the list. Compares equal to lists with the same content.
+    """
+
+    def __eq__(self, other):
+        if isinstance(other, list):
+            other = tuple(other)
+        return tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = tuple.__hash__
+
+
+class FrozenDict(Mapping):
+    """
+    Immutable snapshot of a dict. Its values are shared with the snapshotted dict when they are immutable, so taking a
+    snapshot only copies the skeleton of the dict. Compares equal to dicts with the same content.
+    """
+
+    __slots__ = ("_items",)
+
+    def __init__(self, items: dict):
+        self._items = items
+
+    def __getitem__(self, key: Any) -> Any:
+        return self._items[key]
+
+    def __iter__(self) -> Iterator:
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __repr__(self) -> str:
+        return f"FrozenDict({self._items!r})"
+
+
+class DeferredValue(NamedTuple):
+    """
+    Value stored in place of a parameter whose pre-processing was deferred because it has side effects. The
+    pre-processing resumes from the function at position 'index' among the pre-processing functions of the parameter,
+    applied to 'value', when its config is activated.
+    """
+
+    value: Any
+    index: int
+
+
+class ParameterIndex:
+    """
+    Index over a list of parameter names, used to match many patterns against many names at once. Patterns without '*'
+    are looked up in a hash table, and patterns containing '*' are only compared to the names sharing their literal
+    prefix, found by bisection in the sorted names.
+    """
+
+    def __init__(self, names: List[str]):
+        self._positions = {name: position for position, name in enumerate(names)}
+        self._sorted_names = sorted(self._positions)
+
+    def match(self, pattern: str) -> List[str]:
+        """
+        Returns all indexed names matching 'pattern', in the order in which they were given to the index.
+        :param pattern: pattern to match, where the '*' character matches any number of characters
+        :return: list of the matching names
+        """
+        if "*" not in pattern:
+            return [pattern] if pattern in self._positions else []
+        prefix = pattern.split("*", 1)[0]
+        matches = []
+        for index in range(
+            bisect_left(self._sorted_names, prefix), len(self._sorted_names)
+        ):
+            name = self._sorted_names[index]
+            if not name.startswith(prefix):
+                break
+            if compare_string_pattern(name, pattern):
+                matches.append(name)
+        return sorted(matches, key=self._positions.__getitem__)
+
+
+class StateFrame(NamedTuple):
+    """
+    Frame of the operation stack stored in Configuration._state. The argument of the operation is only kept as a
+    reference : it is formatted when the frame is printed, never when the frame is created.
+    """
+
+    operation: str
+    details: Tuple[Any, ...]
+    argument: Any
+
+    def __str__(self) -> str:
+        argument = str(self.argument)
+        if len(argument) >= 200:
+            argument = f"{argument[:97]} [...] {argument[-97:]}"
+        return ";".join([self.operation, *map(str, self.details), f"arg0={argument}"])
+
+
+class SuffixIndex:
+    """
+    Index over a list of parameter names, used to find the shortest suffix identifying each name. The suffixes of all
+    names are counted once, so that each lookup only goes through the suffixes of one name.
+    """
+
+    def __init__(self, names: List[str]):
+        self._counts = {}
+        for name in names:
+            parts = name.split(".")
+            for index in range(1, len(parts)):
+                suffix = ".".join(parts[index:])
+                self._counts[suffix] = self._counts.get(suffix, 0) + 1
+
+    def get_shortest_name(self, name: str) -> str:
+        """
+        Returns the shortest suffix of 'name', made of full parts of the dot convention, that only one indexed name ends
+        with (after a '.'). The whole name is returned if there is no such suffix.
+        :param name: name to shorten
+        :return: shortened name
+        """
+        parts = name.split(".")
+        shortest_name = parts.pop(-1)
+        while self._counts.get(shortest_name, 0) != 1 and parts:
+            shortest_name = parts.pop(-1) + "." + shortest_name
+        return shortest_name
+
+
+def _split_container(container_string: str) -> List[str]:
+    """
+    Splits the content of a list or dict given in the command line into its top-level elements, in a single pass over
+    the tokens of the string. Escape characters are consumed, except in front of spaces, and spaces at the start of
+    elements are skipped.
+    :param container_string: content of the container, without its enclosing brackets
+    :return: list of the raw strings of the elements
+    """
+    if "\\" not in container_string and "[" not in container_string and "{" not in container_string:
+        return [element.lstrip(" ") for element in container_string.split(",")]
+    elements, current, in_brackets, position = [], [], [], 0
+    for token in _CONTAINER_TOKENS.finditer(container_string):
+        literal = container_string[position : token.start()]
+        if not current:
+            literal = literal.lstrip(" ")
+        if literal:
+            current.append(literal)
+        position = token.end()
+        symbol = token.group()
+        if symbol[0] == "\\":
+            escaped = token.group(1)
+            if escaped:
+                current.append("\\ " if escaped == " " else escaped)
+        elif symbol == "," and not in_brackets:
+            elements.append("".join(current))
+            current = []
+        else:
+            current.append(symbol)
+            if symbol in "[{":
+                in_brackets.append(symbol)
+            elif symbol in "]}" and in_brackets[-1:] == [_OPENING_BRACKETS[symbol]]:
+                in_brackets.pop(-1)
+    literal = container_string[position:]
+    if not current:
+        literal = literal.lstrip(" ")
+    if literal:
+        current.append(literal)
+    elements.append("".join(current))
+    return elements
+
+
+def _strip_trailing_spaces(string: str) -> str:
+    """
+    Removes the spaces at the end of a string, except for a space escaped with a backslash.
+    :param string: string to strip
+    :return: stripped string
+    """
+    stripped = string.rstrip(" ")
+    if len(stripped) < len(string) and stripped.endswith("\\"):
+        return stripped + " "
+    return stripped
 
 
 def adapt_to_type(
@@ -34,71 +246,30 @@ def adapt_to_type(
     """
 
     def _parse_scalar(raw_string, force_):
-        if force_ is None:
-            for forced_type in ["int", "float", "str", "bool", "list", "dict"]:
+        if force_ is None and "!" in raw_string:
+            for forced_type in _FORCEABLE_TYPES:
                 if (
                     raw_string.endswith(f"!{forced_type}")
                     and raw_string[raw_string.rindex("!") - 1] != "\\"
                 ):
                     force_ = forced_type
                     raw_string = raw_string[: -1 - len(forced_type)]
-        raw_string.lstrip(" ")
-        while raw_string[-1] == " " and raw_string[-2] != "\\":
-            raw_string = raw_string[:-1]
-        to_return = ""
-        esc = False
-        for character in raw_string:
-            if esc or character != "\\":
-                esc = False
-                to_return += character
-            else:
-                esc = True
-        return raw_string, force_
+        return _strip_trailing_spaces(raw_string), force_
 
     def _parse_container(container_string):
-        new_list = [""]
-        in_brackets = []
-        esc = False
-        for character in container_string:
-            if esc:
-                esc = False
-                if character == " ":
-                    new_list[-1] += "\\" + character
-                else:
-                    new_list[-1] += character
-            else:
-                if character == "\\":
-                    esc = True
-                elif character == "," and not in_brackets:
-                    new_list.append("")
-                elif character != " " or new_list[-1]:
-                    new_list[-1] += character
-                    if character in ["[", "{"]:
-                        in_brackets.append(character)
-                    if character == "]" and in_brackets[-1] == "[":
-                        in_brackets.pop(-1)
-                    if character == "}" and in_brackets[-1] == "{":
-                        in_brackets.pop(-1)
-        for i in range(len(new_list)):
-            while new_list[i][-1] == " " and new_list[i][-2] != "\\":
-                new_list[i] = new_list[i][:-1]
-            new_list[i] = new_list[i].replace("\\ ", " ")
-            forced = False
-            for forced_type in ["int", "float", "str", "bool", "list", "dict"]:
+        new_list = []
+        for element in _split_container(container_string):
+            element = _strip_trailing_spaces(element).replace("\\ ", " ")
+            forced = None
+            for forced_type in _FORCEABLE_TYPES if "!" in element else ():
                 if (
-                    not forced
-                    and new_list[i].endswith(f"!{forced_type}")
-                    and new_list[i][-2 - len(forced_type)] != "\\"
+                    element.endswith(f"!{forced_type}")
+                    and element[-2 - len(forced_type) : -1 - len(forced_type)] != "\\"
                 ):
-                    forced = True
-                    new_list[i] = [
-                        new_list[i][: new_list[i].rindex("!")],
-                        forced_type,
-                    ]
-                    while new_list[i][0][-1] == " " and new_list[0][-2] != "\\":
-                        new_list[i][0] = new_list[i][0][:-1]
-            if not forced:
-                new_list[i] = [new_list[i], None]
+                    forced = forced_type
+                    element = element[: -1 - len(forced_type)].rstrip(" ")
+                    break
+            new_list.append((element, forced))
         return new_list
 
     if value_to_adapt is None:
@@ -248,19 +419,64 @@ def adapt_to_type(
             )
 
 
+def are_immutable(values: Iterable[Any]) -> bool:
+    """
+    Checks if values are all of immutable built-in types, such that copies of a config can share them.
+    :param values: values to check
+    :return: result of the check
+    """
+    return _ATOMIC_TYPES.issuperset(map(type, values))
+
+
 def are_same_sub_configs(first, second) -> bool:
     """
-    Checks if two sub-configs have identical nesting hierarchies.
+    Checks if two sub-configs have identical nesting hierarchies. The variation names are ignored : they are only set
+    on some of the objects representing a sub-config of a variation.
     :param first: first sub-config to check
     :param second: second sub-config to check
     :return: result of the check
     """
-    if first.get_name() != second.get_name():
+    if first._name != second._name:
         return False
     nh1, nh2 = first.get_nesting_hierarchy(), second.get_nesting_hierarchy()
     return len(nh1) == len(nh2) and all([nh1[i] == nh2[i] for i in range(len(nh1))])
 
 
+@contextlib.contextmanager
+def atomic_open(path: str, fsync: bool = False) -> Iterator[IO[str]]:
+    """
+    Opens a temporary file next to 'path' for writing, and replaces the file at 'path' with it once it is written and
+    closed. Readers thus see either the former file or the new one, never a partially written file. If an error is
+    raised while writing, the former file is left untouched.
+    :param path: path to the file to write
+    :param fsync: whether to flush the file and its folder to the disk before returning, so that the new file also
+    survives a crash of the machine
+    :return: context manager yielding the temporary file opened in text mode
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    temporary_path = os.path.join(
+        folder, f".{os.path.basename(path)}.{uuid.uuid4().hex[:12]}.tmp"
+    )
+    descriptor = os.open(temporary_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+    try:
+        with os.fdopen(descriptor, "w") as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary_path)
+        raise
+    if fsync and hasattr(os, "O_DIRECTORY"):
+        descriptor = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+
 def compare_string_pattern(name: str, pattern: str) -> bool:
     """
     Returns True when string 'name' matches string 'pattern', with the '*' character matching any number of characters.
@@ -282,6 +498,38 @@ def compare_string_pattern(name: str, pattern: str) -> bool:
     return True
 
 
+def create_indexed_folder(folder: str, name: str) -> str:
+    """
+    Creates a new folder '<name>_<index>' in the given folder, with an index greater than the ones of the folders created
+    before. Indices are claimed by creating the folder exclusively, so concurrent processes never share a folder. The
+    next index is stored in a hidden counter file, so that the folder is only listed the first time : later calls only
+    retry when other processes claimed the same index in the meantime.
+    :param folder: parent folder, created if needed
+    :param name: name of the new folder, without index
+    :return: path to the created folder
+    """
+    os.makedirs(folder, exist_ok=True)
+    counter_path = os.path.join(folder, f".{name}_next_index")
+    try:
+        with open(counter_path) as f:
+            index = int(f.read())
+    except (FileNotFoundError, ValueError):
+        pattern = re.compile(re.escape(name) + r"_(\d+)")
+        indices = [pattern.fullmatch(i) for i in os.listdir(folder)]
+        index = max([int(i.group(1)) for i in indices if i is not None] + [-1]) + 1
+    while True:
+        path = os.path.join(folder, f"{name}_{index}")
+        try:
+            os.mkdir(path)
+            break
+        except FileExistsError:
+            index += 1
+    # The counter only saves retries : an outdated value written by a concurrent process is harmless
+    with atomic_open(counter_path) as f:
+        f.write(str(index + 1))
+    return path
+
+
 def dict_apply(dictionary: dict, function: Callable) -> dict:
     """
     Returns a copy of dict 'dictionary' where function 'function' was applied to all values.
@@ -292,6 +540,30 @@ def dict_apply(dictionary: dict, function: Callable) -> dict:
     return {k: function(v) for k, v in dictionary.items()}
 
 
+def encode_canonically(value: Any) -> str:
+    """
+    Encodes 'value' as a string that only depends on its content and not on how it was built. Dict keys are sorted,
+    lists and tuples are encoded alike, and numbers that compare equal (e.g. 1, 1.0 and True) share the same
+    encoding. Other types are encoded using their type name and repr.
+    :param value: value to encode
+    :return: canonical encoding of the value
+    """
+    if isinstance(value, float):
+        return repr(int(value)) if value.is_integer() else repr(value)
+    if isinstance(value, int):
+        return repr(int(value))
+    if value is None or isinstance(value, str):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(map(encode_canonically, value)) + "]"
+    if isinstance(value, Mapping):
+        items = sorted(
+            (encode_canonically(k), encode_canonically(v)) for k, v in value.items()
+        )
+        return "{" + ",".join(f"{k}:{v}" for k, v in items) + "}"
+    return f"<{type(value).__qualname__}>{value!r}"
+
+
 def escape_symbols(string_to_escape: str, symbols: Union[List[str], str]) -> str:
     """
     Take a string 'string_to_escape' as input and escapes characters as defined in 'symbols'.
@@ -299,11 +571,130 @@ def escape_symbols(string_to_escape: str, symbols: Union[List[str], str]) -> str
     :param symbols: list of strings to escape or string containing the characters to escape
     :return: escaped string
     """
+    escaping_table = _get_escaping_table(tuple(symbols))
+    if escaping_table is not None:
+        return string_to_escape.translate(escaping_table)
     for symbol in symbols:
         string_to_escape = string_to_escape.replace(symbol, f"\\{symbol}")
     return string_to_escape
 
 
+@functools.lru_cache(maxsize=None)
+def _get_escaping_table(symbols: Tuple[str, ...]) -> Optional[dict]:
+    """
+    Returns a translation table escaping all symbols in a single pass, or None when a single pass would not escape the
+    string the same way as escaping the symbols one after the other (symbols longer than one character or repeated,
+    backslash escaped after other symbols).
+    """
+    if any(len(symbol) != 1 for symbol in symbols) or len(set(symbols)) != len(symbols):
+        return None
+    if "\\" in symbols[1:]:
+        return None
+    return str.maketrans({symbol: f"\\{symbol}" for symbol in symbols})
+
+
+@contextlib.contextmanager
+def file_lock(path: str, shared: bool = False) -> Iterator[None]:
+    """
+    Locks the file at 'path', created if needed, for as long as the context lasts. Processes taking an exclusive lock
+    wait for all the other locks on the file to be released, while processes taking a shared lock only wait for the
+    exclusive ones. The lock is advisory : it only excludes the processes taking it too. It does nothing on systems
+    without fcntl.
+    :param path: path to the lock file
+    :param shared: whether to take a shared lock instead of an exclusive one
+    :return: context manager holding the lock
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def freeze_value(value: Any) -> Any:
+    """
+    Returns an immutable snapshot of 'value'. Immutable values are returned as they are, lists and dicts are turned
+    into FrozenList and FrozenDict objects sharing all their immutable items with 'value', and any other type is deep
+    copied. Snapshots are immutable, so freezing a snapshot returns it as it is. Mutable containers are not memoized :
+    they can be modified in place after being frozen (for instance by a post-processing function), which would make a
+    memoized snapshot stale, so their skeleton is copied on each call.
+    :param value: value to take a snapshot of
+    :return: immutable snapshot of the value
+    """
+    if type(value) in _ATOMIC_TYPES or isinstance(value, (FrozenList, FrozenDict)):
+        return value
+    if isinstance(value, list):
+        if _ATOMIC_TYPES.issuperset(map(type, value)):
+            return FrozenList(value)
+        return FrozenList(
+            [v if type(v) in _ATOMIC_TYPES else freeze_value(v) for v in value]
+        )
+    if isinstance(value, dict):
+        if _ATOMIC_TYPES.issuperset(map(type, value.values())):
+            return FrozenDict(dict(value))
+        return FrozenDict(
+            {
+                k: v if type(v) in _ATOMIC_TYPES else freeze_value(v)
+                for k, v in value.items()
+            }
+        )
+    return copy.deepcopy(value)
+
+
+def has_exact_encoding(value: Any) -> bool:
+    """
+    Checks whether the values that compare equal to 'value' are exactly the values with the same canonical encoding
+    (see encode_canonically), which is the case for the native YAML types except NaN. Two values with exact encodings
+    can then be compared through their encodings.
+    :param value: value to check
+    :return: result of the check
+    """
+    if type(value) is float:
+        return value == value
+    if type(value) in _EXACT_TYPES:
+        return True
+    if type(value) is list:
+        return all(map(has_exact_encoding, value))
+    if type(value) is dict:
+        return all(
+            has_exact_encoding(k) and has_exact_encoding(v) for k, v in value.items()
+        )
+    return False
+
+
+def has_side_effects(function: Callable) -> Callable:
+    """
+    Decorator marking a processing function as having side effects, for instance creating a folder. When variations
+    are generated with defer_side_effects, such functions are not called : they are deferred until the variation is
+    activated.
+    :param function: processing function to mark
+    :return: the same function, marked
+    """
+    function.has_side_effects = True
+    return function
+
+
+def hash_value(value: Any) -> int:
+    """
+    Hashes 'value' so that values that compare equal have the same hash, even when they are not hashable : lists,
+    tuples and mappings are hashed through their items, and the other unhashable values all share the same hash.
+    :param value: value to hash
+    :return: hash of the value
+    """
+    if isinstance(value, (list, tuple)):
+        return hash(tuple(map(hash_value, value)))
+    if isinstance(value, Mapping):
+        return hash(frozenset((k, hash_value(v)) for k, v in value.items()))
+    try:
+        return hash(value)
+    except TypeError:
+        return 0
+
+
 def is_type_valid(value: Any, config_class: type) -> bool:
     """
     Checks whether input 'value' can be saved in a YAML file by Configuration's YAML Dumper.
@@ -324,6 +715,38 @@ def is_type_valid(value: Any, config_class: type) -> bool:
         )
 
 
+def get_param_as_command_line_argument(
+    name: str,
+    param: Any,
+    ignore_unknown_types: bool = False,
+    cache: Optional[Dict[tuple, str]] = None,
+) -> str:
+    """
+    Gets the command line argument setting parameter 'name' to the given value.
+    :param name: name of the parameter
+    :param param: value of the parameter
+    :param ignore_unknown_types: how to treat types that cannot be parsed by the Configuration
+    :param cache: optional dict shared between calls, where the arguments of immutable values are stored so that
+    values repeated across many configs are only converted once
+    :return: string usable in the command line to set the parameter to its value
+    """
+    key = None
+    if cache is not None and type(param) in _ATOMIC_TYPES:
+        key = (name, type(param), param, ignore_unknown_types)
+        if key in cache:
+            return cache[key]
+    pair = get_param_as_parsable_string(param, ignore_unknown_types=ignore_unknown_types)
+    if " !" in pair:
+        param_value, param_force = pair.rsplit(" !", 1)
+        argument = f"--{name} '{param_value}' !{param_force}"
+    else:
+        argument = f"--{name} {pair}"
+    argument = escape_symbols(argument, "{}*")
+    if key is not None:
+        cache[key] = argument
+    return argument
+
+
 def get_param_as_parsable_string(
     param: Any, in_iterable: bool = False, ignore_unknown_types: bool = False
 ) -> str:
@@ -396,28 +819,45 @@ def recursive_set_attribute(obj, key: str, value: Any) -> None:
         object.__setattr__(obj, key, value)
 
 
+def thaw_value(value: Any) -> Any:
+    """
+    Reverts freeze_value : returns a mutable version of a snapshot, where FrozenList and FrozenDict objects are turned
+    back into lists and dicts.
+    :param value: snapshot to thaw
+    :return: mutable value
+    """
+    if isinstance(value, FrozenList):
+        return [thaw_value(v) for v in value]
+    if isinstance(value, FrozenDict):
+        return {k: thaw_value(v) for k, v in value.items()}
+    return value
+
+
 def update_state(state_descriptor: str) -> Callable:
     """
     Decorator used to store useful information in Configuration._state when using some recursive functions. Kind of a
     hack, but very useful to keep track of the loading state and also to debug.
-    :param state_descriptor: string indicating what to store in Configuration._state
+    :param state_descriptor: string indicating what to store in Configuration._state : the name of the operation,
+    followed by the names of the attributes of the config to store, separated by ';'
     :return: decorated function
     """
+    operation, *attribute_names = state_descriptor.split(";")
 
     def decorator_update_state(func: Callable) -> Callable:
         @functools.wraps(func)
         def wrapper_update_state(self, *args, **kwargs):
-            state_to_append = state_descriptor.split(";")[0]  # state name
-            for i in state_descriptor.split(";")[1:]:
-                state_to_append += f";{getattr(self, i)}"  # additional information
             first_arg = (
                 args[0]
-                if len(args)
-                else (kwargs[list(kwargs.keys())[0]] if len(kwargs) else None)
+                if args
+                else (next(iter(kwargs.values())) if kwargs else None)
             )
             self._state.append(
-                state_to_append + f";arg0={first_arg}"
-            )  # first arg of function call
+                StateFrame(
+                    operation,
+                    tuple([getattr(self, name) for name in attribute_names]),
+                    first_arg,
+                )
+            )
             value = func(self, *args, **kwargs)
             self._state.pop(-1)
             return value
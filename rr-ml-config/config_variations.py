@@ -0,0 +1,528 @@
+"""
+Reactive Reality Machine Learning Config System - VariationSpace object
+Copyright (C) 2022  Reactive Reality
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import itertools
+import pickle
+import random
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+_worker_state = {}
+
+
+class VariationDimension(NamedTuple):
+    name: str
+    labels: List[str]
+    declarators: List[Any]
+
+
+class VariationBlock:
+    """
+    Variations given by the cartesian product of some dimensions, the last dimension changing the fastest, without the
+    combinations excluded by constraints. The combinations are checked on their choices only : the dimensions up to the
+    last constrained one form a prefix whose valid choices are listed once, and the remaining dimensions are free.
+    """
+
+    def __init__(
+        self,
+        dimensions: List[VariationDimension],
+        constraints: Iterable[Dict[str, List[str]]] = (),
+    ):
+        """
+        :param dimensions: dimensions of the block
+        :param constraints: for each constraint, the labels of the excluded choices for some dimensions of the block. A
+        combination is excluded when its choices are among the excluded ones for all dimensions of a constraint
+        """
+        self.dimensions = dimensions
+        self._radices = [len(dimension.declarators) for dimension in dimensions]
+        positions = {dimension.name: i for i, dimension in enumerate(dimensions)}
+        self._exclusions = [
+            [
+                (
+                    positions[name],
+                    frozenset(map(dimensions[positions[name]].labels.index, labels)),
+                )
+                for name, labels in constraint.items()
+            ]
+            for constraint in constraints
+        ]
+        self._prefix_length = 1 + max(
+            (position for exclusion in self._exclusions for position, _ in exclusion),
+            default=-1,
+        )
+        self._suffix_size = _product(self._radices[self._prefix_length :])
+        self._valid_prefixes = None
+        if self._exclusions:
+            self._valid_prefixes = [
+                prefix
+                for prefix, choices in enumerate(
+                    itertools.product(*map(range, self._radices[: self._prefix_length]))
+                )
+                if not self._is_excluded(choices)
+            ]
+
+    def __iter__(self) -> Iterator[Tuple[int, ...]]:
+        """
+        Lazily yields the choices of each variation of the block, in order.
+        """
+        if self._valid_prefixes is None:
+            yield from itertools.product(*map(range, self._radices))
+            return
+        radices = self._radices[: self._prefix_length]
+        for prefix in self._valid_prefixes:
+            prefix_choices = _decode(prefix, radices)
+            for choices in itertools.product(
+                *map(range, self._radices[self._prefix_length :])
+            ):
+                yield prefix_choices + choices
+
+    def __len__(self) -> int:
+        if self._valid_prefixes is None:
+            return self._suffix_size
+        return len(self._valid_prefixes) * self._suffix_size
+
+    def decode(self, index: int) -> Tuple[int, ...]:
+        """
+        Returns the choices of the variation at the given index of the block.
+        """
+        prefix, suffix = divmod(index, self._suffix_size)
+        if self._valid_prefixes is not None:
+            prefix = self._valid_prefixes[prefix]
+        return _decode(prefix, self._radices[: self._prefix_length]) + _decode(
+            suffix, self._radices[self._prefix_length :]
+        )
+
+    def encode(self, choices: Tuple[int, ...]) -> Optional[int]:
+        """
+        Returns the index in the block of the variation with the given choices, or None if it is excluded.
+        """
+        index = 0
+        for radix, choice in zip(self._radices, choices):
+            index = index * radix + choice
+        if self._valid_prefixes is None:
+            return index
+        prefix, suffix = divmod(index, self._suffix_size)
+        rank = bisect_left(self._valid_prefixes, prefix)
+        if rank == len(self._valid_prefixes) or self._valid_prefixes[rank] != prefix:
+            return None
+        return rank * self._suffix_size + suffix
+
+    def get_variation(self, choices: Tuple[int, ...]) -> Tuple[str, List[Any]]:
+        """
+        Returns the name and the list of variation declarators of the variation with the given choices.
+        """
+        name = "*".join(
+            f"{dimension.name}_{dimension.labels[choice]}"
+            for dimension, choice in zip(self.dimensions, choices)
+        )
+        declarators = [
+            dimension.declarators[choice]
+            for dimension, choice in zip(self.dimensions, choices)
+        ]
+        return name, declarators
+
+    def parse_name(
+        self, name: str, choices: Tuple[int, ...] = ()
+    ) -> Optional[Tuple[int, ...]]:
+        """
+        Finds the first choices in the block whose variation has the given name, or None if there is none.
+        """
+        dimension = self.dimensions[len(choices)]
+        if not name.startswith(f"{dimension.name}_"):
+            return None
+        name = name[len(dimension.name) + 1 :]
+        is_last_dimension = len(choices) == len(self.dimensions) - 1
+        for choice, label in enumerate(dimension.labels):
+            if is_last_dimension:
+                if name == label:
+                    return choices + (choice,)
+            elif name.startswith(f"{label}*"):
+                found = self.parse_name(name[len(label) + 1 :], choices + (choice,))
+                if found is not None:
+                    return found
+        return None
+
+    def _is_excluded(self, choices: Tuple[int, ...]) -> bool:
+        return any(
+            all(choices[position] in excluded for position, excluded in exclusion)
+            for exclusion in self._exclusions
+        )
+
+
+class VariationSpace:
+    """
+    Describes the variations of a config without building them. The variations are organised in blocks : first one
+    block per grid, whose variations are the cartesian product of its dimensions (the last dimension changing the
+    fastest), then one block per variation parameter that is not part of any grid. This is the order in which
+    Configuration.create_variations has always listed them. Constraints remove combinations from the blocks before any
+    variation is built.
+    """
+
+    def __init__(
+        self,
+        variations: List[Tuple[str, List[Any]]],
+        variations_names: List[Tuple[str, List[str]]],
+        grids: List[List[str]],
+        constraints: Optional[List[Dict[str, List[str]]]] = None,
+    ):
+        """
+        :param variations: (name, list of variation declarators) for each variation parameter, in registration order
+        :param variations_names: (name, list of labels) for each variation parameter
+        :param grids: list of the names of the variation parameters composing each grid
+        :param constraints: for each constraint, the labels of the excluded choices for some variation parameters. A
+        constraint applies to every block containing all its parameters
+        """
+        labels = dict(variations_names)
+        dimensions = {
+            name: VariationDimension(name, labels.get(name, []), declarators)
+            for name, declarators in variations
+        }
+        blocks = []
+        in_grids = set()
+        for grid in filter(None, grids):
+            for dimension in grid:
+                if dimension not in dimensions:
+                    raise TypeError(
+                        f"Grid element '{dimension}' is an empty list or not a registered variation configuration."
+                    )
+            blocks.append([dimensions[dimension] for dimension in grid])
+            in_grids.update(grid)
+        for name, _ in variations:
+            if name not in in_grids:
+                blocks.append([dimensions[name]])
+        constraints = [
+            {name: [str(label) for label in labels] for name, labels in constraint.items()}
+            for constraint in ([] if constraints is None else constraints)
+        ]
+        for constraint in constraints:
+            self._check_constraint(constraint, dimensions, blocks)
+        self._blocks = [
+            VariationBlock(
+                block,
+                [
+                    constraint
+                    for constraint in constraints
+                    if set(constraint).issubset(dimension.name for dimension in block)
+                ],
+            )
+            for block in blocks
+        ]
+
+    def __getitem__(self, index: int) -> Tuple[str, List[Any]]:
+        """
+        Returns the name and the list of variation declarators of the variation at the given index. The index is decoded
+        arithmetically into one choice per dimension of its block, without going through the other variations.
+        """
+        if index < 0:
+            index += len(self)
+        if index >= 0:
+            for block in self._blocks:
+                if index < len(block):
+                    return block.get_variation(block.decode(index))
+                index -= len(block)
+        raise IndexError("Variation index out of range.")
+
+    def __iter__(self) -> Iterator[Tuple[str, List[Any]]]:
+        """
+        Lazily yields the name and the list of variation declarators to merge for each variation, in order.
+        """
+        for block in self._blocks:
+            for choices in block:
+                yield block.get_variation(choices)
+
+    def __len__(self) -> int:
+        return sum(len(block) for block in self._blocks)
+
+    def index(self, name: str) -> int:
+        """
+        Returns the index of the first variation with the given name. The name is parsed into one choice per dimension
+        of a block, without going through the other variations.
+        """
+        offset = 0
+        for block in self._blocks:
+            choices = block.parse_name(name)
+            if choices is not None and block.encode(choices) is not None:
+                return offset + block.encode(choices)
+            offset += len(block)
+        raise ValueError(f"No variation is named '{name}'.")
+
+    def names(self) -> Iterator[str]:
+        """
+        Lazily yields the name of each variation, in order.
+        """
+        for name, _ in self:
+            yield name
+
+    def sample(
+        self, sampling: str, size: int, seed: Optional[int] = None
+    ) -> Sequence[int]:
+        """
+        Returns the indices of a sample of the variations, in increasing order. The indices are drawn directly, without
+        going through the other variations.
+        :param sampling: "first" for the first variations, "random" for a uniformly random subset, or
+        "latin_hypercube" for a Latin hypercube sample of each grid, where each dimension is split into as many strata
+        as there are samples and each stratum is used once. The sample is split between the grids and the remaining
+        variations proportionally to their sizes. Latin hypercube samples that fall on the same variation or on a
+        combination excluded by a constraint are dropped, so they can contain fewer variations than requested
+        :param size: number of variations in the sample
+        :param seed: seed of the random generator used by the "random" and "latin_hypercube" samplings
+        :return: indices of the sampled variations
+        """
+        size = min(size, len(self))
+        rng = random.Random(seed)
+        if sampling == "first":
+            return range(size)
+        if sampling == "random":
+            return sorted(rng.sample(range(len(self)), size))
+        if sampling == "latin_hypercube":
+            indices, offset = set(), 0
+            block_sizes = [len(block) for block in self._blocks]
+            for block, block_size, block_samples in zip(
+                self._blocks, block_sizes, _split_proportionally(size, block_sizes)
+            ):
+                columns = []
+                for dimension in block.dimensions:
+                    num_choices = len(dimension.declarators)
+                    choices = [
+                        int((stratum + rng.random()) / block_samples * num_choices)
+                        for stratum in range(block_samples)
+                    ]
+                    rng.shuffle(choices)
+                    columns.append(choices)
+                block_indices = map(block.encode, zip(*columns))
+                indices.update(
+                    offset + index for index in block_indices if index is not None
+                )
+                offset += block_size
+            return sorted(indices)
+        raise ValueError(
+            f"Unknown sampling : '{sampling}'. Valid values are 'first', 'random' and 'latin_hypercube'."
+        )
+
+    def shard(
+        self,
+        shard: int,
+        num_shards: int,
+        shard_by: str = "index",
+        indices: Optional[Sequence[int]] = None,
+    ) -> Iterable[int]:
+        """
+        Returns the indices of the variations belonging to the given shard, in increasing order. The shards are disjoint
+        and together contain all variations. With shard_by="index", the variations are dealt to the shards in turn, so
+        the shards differ in size by at most one and the other shards are never decoded. With shard_by="name", a
+        variation belongs to the shard given by a stable hash of its name, so its shard does not depend on the other
+        variations.
+        :param shard: index of the shard, from 0 to num_shards - 1
+        :param num_shards: number of shards
+        :param shard_by: how variations are assigned to shards, "index" (default) or "name"
+        :param indices: indices of the variations to split into shards, for instance a sample. Defaults to all
+        :return: indices of the variations of the shard
+        """
+        if not 0 <= shard < num_shards:
+            raise ValueError(
+                f"Shard index {shard} is invalid : it must be in [0, num_shards - 1] = [0, {num_shards - 1}]."
+            )
+        indices = range(len(self)) if indices is None else indices
+        if shard_by == "index":
+            return indices[shard::num_shards]
+        if shard_by == "name":
+            return (
+                index
+                for index in indices
+                if _stable_hash(self[index][0]) % num_shards == shard
+            )
+        raise ValueError(
+            f"Unknown shard_by : '{shard_by}'. Valid values are 'index' and 'name'."
+        )
+
+    @staticmethod
+    def _check_constraint(
+        constraint: Dict[str, List[str]],
+        dimensions: Dict[str, VariationDimension],
+        blocks: List[List[VariationDimension]],
+    ) -> None:
+        for name, labels in constraint.items():
+            if name not in dimensions:
+                raise TypeError(
+                    f"Constraint element '{name}' is an empty list or not a registered variation configuration."
+                )
+            unknown_labels = set(labels).difference(dimensions[name].labels)
+            if unknown_labels:
+                raise ValueError(
+                    f"Constraint on '{name}' uses unknown variation names {sorted(unknown_labels)}. Valid names are "
+                    f"{dimensions[name].labels}."
+                )
+        if not any(
+            set(constraint).issubset(dimension.name for dimension in block)
+            for block in blocks
+        ):
+            raise ValueError(
+                f"Constraint {constraint} does not apply to any grid : all its parameters must be part of the same "
+                f"grid."
+            )
+
+
+def _decode(index: int, radices: List[int]) -> Tuple[int, ...]:
+    """Decodes a mixed-radix index into one choice per radix, the last radix changing the fastest."""
+    choices = []
+    for radix in reversed(radices):
+        index, choice = divmod(index, radix)
+        choices.append(choice)
+    return tuple(reversed(choices))
+
+
+def _product(numbers: List[int]) -> int:
+    result = 1
+    for number in numbers:
+        result *= number
+    return result
+
+
+def _split_proportionally(total: int, weights: List[int]) -> List[int]:
+    """Splits an integer into integer parts proportional to the weights, using the largest remainder method."""
+    if not weights or not sum(weights):
+        return [0] * len(weights)
+    quotas = [total * weight / sum(weights) for weight in weights]
+    parts = [int(quota) for quota in quotas]
+    by_remainder = sorted(
+        range(len(weights)), key=lambda i: parts[i] - quotas[i]
+    )
+    for i in by_remainder[: total - sum(parts)]:
+        parts[i] += 1
+    return parts
+
+
+def _stable_hash(string: str) -> int:
+    """Hash of a string that, unlike hash, does not change between Python processes."""
+    return int.from_bytes(hashlib.blake2b(string.encode(), digest_size=8).digest(), "big")
+
+
+class VariationBuildError(RuntimeError):
+    """
+    Raised after creating variations in parallel when some of them could not be built. The other variations were
+    built normally.
+    """
+
+    def __init__(
+        self, errors: List[Tuple[str, BaseException]], configs: Optional[list] = None
+    ):
+        """
+        :param errors: (variation name, exception raised while building it) for each variation that could not be built
+        :param configs: variations that were built successfully, when they were collected in a list
+        """
+        self.errors = errors
+        self.configs = configs
+        details = "\n".join(f" - {name} : {error!r}" for name, error in errors)
+        super().__init__(f"{len(errors)} variation(s) could not be built :\n{details}")
+
+
+def iter_variations_in_parallel(
+    config_class: type,
+    config_hierarchy: List[Any],
+    overwriting_regime: str,
+    variations: Iterable[Tuple[str, List[Any]]],
+    derive_from_base: bool,
+    workers: int,
+) -> Iterator[Any]:
+    """
+    Builds variations in a pool of processes and yields them in order. Only the class, the config hierarchy and the
+    variation declarators are sent to the processes, which build their own copy of the base config once. At most
+    twice as many variations as processes are being built or waiting to be yielded at any time. Variations that
+    cannot be built are skipped, and a VariationBuildError listing them is raised once all others have been yielded.
+    """
+    try:
+        pickle.dumps((config_class, config_hierarchy))
+    except Exception as error:
+        raise TypeError(
+            f"Variations cannot be created in parallel : the config class and its hierarchy must be picklable, which "
+            f"requires the class to be defined at the top level of a module and the hierarchy to contain only paths "
+            f"and YAML-compatible values ({error!r})."
+        ) from error
+    errors = []
+    variations = iter(variations)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_initialize_worker,
+        initargs=(config_class, config_hierarchy, overwriting_regime),
+    ) as executor:
+        in_flight = deque()
+
+        def _submit(number_of_variations):
+            for name, declarators in itertools.islice(variations, number_of_variations):
+                future = executor.submit(
+                    _build_in_worker, name, declarators, derive_from_base
+                )
+                in_flight.append((name, future))
+
+        _submit(2 * workers)
+        while in_flight:
+            name, future = in_flight.popleft()
+            _submit(1)
+            try:
+                variation = future.result()
+            except Exception as error:
+                errors.append((name, error))
+            else:
+                yield variation
+    if errors:
+        raise VariationBuildError(errors)
+
+
+def _initialize_worker(
+    config_class: type, config_hierarchy: List[Any], overwriting_regime: str
+) -> None:
+    _worker_state["class"] = config_class
+    _worker_state["hierarchy"] = config_hierarchy
+    _worker_state["overwriting_regime"] = overwriting_regime
+    _worker_state["base"] = None
+
+
+def _build_in_worker(name: str, declarators: List[Any], derive_from_base: bool) -> Any:
+    if derive_from_base:
+        # The base config is only built once per process, then all variations are derived from it
+        if _worker_state["base"] is None:
+            _worker_state["base"] = _load_in_worker([])
+        return _worker_state["base"]._build_variation(name, declarators, True, True)
+    variation = _load_in_worker(declarators)
+    variation.set_variation_name(name, deep=True)
+    return variation
+
+
+def _load_in_worker(declarators: List[Any]) -> Any:
+    hierarchy = _worker_state["hierarchy"]
+    # Pre-processing functions with side effects are deferred until the variation is activated by the main process
+    with _worker_state["class"]._deferring_side_effects():
+        return _worker_state["class"].load_config(
+            hierarchy[1:] + declarators,
+            default_config_path=hierarchy[0],
+            overwriting_regime=_worker_state["overwriting_regime"],
+            do_not_merge_command_line=True,
+            verbose=False,
+        )
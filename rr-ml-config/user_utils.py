@@ -29,6 +29,8 @@ def get_template_class(
     variations_prefix: Optional[str] = None,
     grids_suffix: Optional[str] = None,
     grids_prefix: Optional[str] = None,
+    constraints_suffix: Optional[str] = None,
+    constraints_prefix: Optional[str] = None,
 ) -> Type[Configuration]:
     """
     Creates a template Configuration subclass to use in a small project where little customisation is needed.
@@ -49,6 +51,10 @@ def get_template_class(
     ending with 'grids_suffix' as grids
     :param grids_prefix: automatically adds relevant pre-processing rules to consider parameter names
     starting with 'grids_prefix' as grids
+    :param constraints_suffix: automatically adds relevant pre-processing rules to consider parameter names
+    ending with 'constraints_suffix' as constraints on the grids
+    :param constraints_prefix: automatically adds relevant pre-processing rules to consider parameter names
+    starting with 'constraints_prefix' as constraints on the grids
     :return: a template Configuration subclass
     """
 
@@ -92,6 +98,14 @@ def get_template_class(
                 to_ret[
                     f"{grids_prefix}*"
                 ] = self.register_as_grid
+            if constraints_suffix is not None:
+                to_ret[
+                    f"*{constraints_suffix}"
+                ] = self.register_as_constraints
+            if constraints_prefix is not None:
+                to_ret[
+                    f"{constraints_prefix}*"
+                ] = self.register_as_constraints
             return to_ret
 
         def parameters_post_processing(self):
@@ -111,6 +125,8 @@ def make_config(
     variations_prefix: Optional[str] = None,
     grids_suffix: Optional[str] = None,
     grids_prefix: Optional[str] = None,
+    constraints_suffix: Optional[str] = None,
+    constraints_prefix: Optional[str] = None,
     **class_building_kwargs,
 ) -> Configuration:
     """
@@ -135,6 +151,10 @@ def make_config(
     ending with 'grids_suffix' as grids
     :param grids_prefix: automatically adds relevant pre-processing rules to consider parameter names
     starting with 'grids_prefix' as grids
+    :param constraints_suffix: automatically adds relevant pre-processing rules to consider parameter names
+    ending with 'constraints_suffix' as constraints on the grids
+    :param constraints_prefix: automatically adds relevant pre-processing rules to consider parameter names
+    starting with 'constraints_prefix' as constraints on the grids
     :param class_building_kwargs: same kwargs as those used in all Configuration constructors
     :return: config object
     """
@@ -148,6 +168,8 @@ def make_config(
             variations_prefix=variations_prefix,
             grids_suffix=grids_suffix,
             grids_prefix=grids_prefix,
+            constraints_suffix=constraints_suffix,
+            constraints_prefix=constraints_prefix,
         )
     elif pre_processing_dict is not None or additional_configs_suffix is not None:
         print(
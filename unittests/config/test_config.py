@@ -17,6 +17,13 @@ Copyright (C) 2022  Reactive Reality
 """
 import sys
 import os
+import random
+import multiprocessing
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+import yaml
 import pytest
 from typing import Any
 
@@ -29,15 +36,73 @@ from fixtures import tmp_file_name, yaml_default, yaml_experiment, yaml_default_
 IS_REMOTE = "--junitxml" in sys.argv
 
 if IS_REMOTE:
-    from rr.ml.config import Configuration
+    from rr.ml.config import Configuration, ConfigArchive, ConfigHistory, ConfigStore, ExperimentCache, SweepExecutor, VariationBuildError, \
+        SuccessiveHalving, WorkQueue
     from rr.ml.config.user_utils import make_config
-    from rr.ml.config.config_utils import compare_string_pattern
+    from rr.ml.config.config_utils import adapt_to_type, compare_string_pattern, create_indexed_folder, freeze_value
 else:
     import importlib
     config_module = importlib.import_module("rr-ml-config")
     Configuration = config_module.config.Configuration
+    ExperimentCache = config_module.config_cache.ExperimentCache
+    ConfigArchive = config_module.config_archive.ConfigArchive
+    ConfigHistory = config_module.config_history.ConfigHistory
+    ConfigStore = config_module.config_store.ConfigStore
+    SweepExecutor = config_module.config_sweep.SweepExecutor
+    WorkQueue = config_module.config_queue.WorkQueue
+    SuccessiveHalving = config_module.config_scheduler.SuccessiveHalving
+    VariationBuildError = config_module.config_variations.VariationBuildError
     make_config = config_module.user_utils.make_config
+    adapt_to_type = config_module.config_utils.adapt_to_type
     compare_string_pattern = config_module.config_utils.compare_string_pattern
+    create_indexed_folder = config_module.config_utils.create_indexed_folder
+    freeze_value = config_module.config_utils.freeze_value
+
+
+class VariationsConfiguration(Configuration):
+    def parameters_pre_processing(self):
+        return {"var*": self.register_as_config_variations, "grid": self.register_as_grid}
+
+
+def run_sweep_variation(config, folder):
+    print(f"p1 = {config.p1}")
+    if config.p1 > 0.2:
+        raise ValueError("p1 is too large")
+
+
+def exit_sweep_variation(config, folder):
+    sys.exit(None if config.p1 < 0.2 else int(config.p1 * 10))
+
+
+def train_sweep_variation(config, folder):
+    with open(os.path.join(folder, "loss.txt"), "w") as f:
+        f.write(str(abs(config.lr - 0.3) / config.train.epochs))
+
+
+def train_sweep_variation_failing(config, folder):
+    if config.lr == 1:
+        raise ValueError("diverged")
+    train_sweep_variation(config, folder)
+
+
+def read_losses(folders):
+    losses = []
+    for folder in folders:
+        with open(folder / "loss.txt") as f:
+            losses.append(float(f.read()))
+    return losses
+
+
+def add_to_experiment_cache(index_path, worker):
+    cache = ExperimentCache(index_path)
+    for index in range(10):
+        cache.add(make_config({"worker": worker, "index": index}, do_not_merge_command_line=True), f"run_{worker}_{index}")
+
+
+def make_variations_config(grid=None):
+    return make_config({"p1": 0.1, "p2": 1.0, "var1": [{"p1": 0.1}, {"p1": 0.2}],
+                        "var2": [{"p2": 1.0}, {"p2": 2.0}, {"p2": 3.0}], "grid": grid},
+                       config_class=template(yaml_default), do_not_merge_command_line=True)
 
 
 def check_integrity(config, p1: Any = 0.1, p2: Any = 2.0, p3: Any = 30.0, p4: Any = "string"):
@@ -76,6 +141,27 @@ def test_load_default(capsys, yaml_default):
         template(default_config=yaml_default).get_default_config_path(), do_not_merge_command_line=True)
 
 
+def test_copy(capsys):
+    config = load_config(default_config={"subconfig2.param3": 20.0,
+                                         "subconfig2.subconfig3.list_param": [[1, 2], {"a": 3}]})
+    config2 = config.copy()
+    assert config2 == config and config2.config_metadata == config.config_metadata
+    assert config2.get_main_config() is config2
+    assert config2.subconfig2.subconfig3.get_main_config() is config2
+    assert config2._state is config2.subconfig2._state and config2._state is not config._state
+    config2.subconfig2.subconfig3.list_param[0].append(3)
+    config2.subconfig2.subconfig3.list_param[1]["a"] = 4
+    assert config.subconfig2.subconfig3.list_param == [[1, 2], {"a": 3}]
+    config2.merge({"subconfig2.param3": 0.0})
+    assert config.subconfig2.param3 == 20.0
+    assert len(config2.config_metadata["config_hierarchy"]) == 2
+    assert len(config.config_metadata["config_hierarchy"]) == 1
+    sub_config = config.subconfig2.copy()
+    assert sub_config == config.subconfig2 and sub_config.get_main_config() is not config
+    assert sub_config.get_main_config().subconfig2 is sub_config
+    capsys.readouterr()
+
+
 def test_load_experiment(capsys, yaml_default, yaml_experiment, yaml_experiment_sub_dot, yaml_experiment_sub_star):
     config = load_config(yaml_experiment, default_config=yaml_default)
     captured = capsys.readouterr()
@@ -234,6 +320,12 @@ def test_merge_from_command_line(capsys, yaml_default, yaml_experiment):
     assert "WARNING" not in captured.out
     with pytest.raises(Exception, match="could not convert string to float: 'False'"):
         mcl(config, "--param1=False")
+    mcl(config, "--lr=0.5 --subconfig2.p*3=b --wd=1 --param1=3")
+    captured = capsys.readouterr()
+    assert captured.out.count("WARNING") == 1
+    assert "WARNING: parameters 'lr', 'wd', encountered while merging params from the command line, do not match" \
+           in captured.out
+    check_integrity(config, 3, True, "b", p4=[1, 0.5, {"string": "'[as"}])
 
 
 def test_method_name(capsys):
@@ -266,6 +358,21 @@ def test_details(capsys, yaml_default, yaml_experiment):
     assert s == config.details(no_expand=["subconfig2"], no_show="*_path")
 
 
+def test_compare(capsys, yaml_default, yaml_experiment):
+    default = load_config(default_config=yaml_default)
+    config = load_config(yaml_experiment, default_config=yaml_default)
+    assert default.compare(config) == [
+        ("subconfig1", config.subconfig1), ("subconfig2", config.subconfig2), ("exp_second_path", config.exp_second_path),
+        ("subconfig1.param2", 2.0), ("subconfig2.param3", 30.0)]  # subconfig2.subconfig3 is identical and skipped
+    assert default.compare(config, reduce=True) == [
+        ("exp_second_path", config.exp_second_path), ("param2", 2.0), ("param3", 30.0)]
+    assert config.compare(default, reduce=True) == [("exp_second_path", None), ("param2", 3.0), ("param3", 20.0)]
+    config = make_config({"a": 1, "b.c": {"x": 1, "y": 2}, "b.d.a": 2}, do_not_merge_command_line=True)
+    other = make_config({"a": 1, "b.c": {"x": 1, "y": 3}, "b.d.a": 2, "b.e": 4}, do_not_merge_command_line=True)
+    assert config.compare(other, reduce=True) == [("c", {"y": 3}), ("e", 4)]
+    assert other.compare(config) == [("b", config.b), ("b.c", {"x": 1, "y": 2}), ("b.e", None)]
+
+
 def test_variations(capsys):
     config = make_config({"p1": 0.1, "p2": 1.0, "var1": [{"p1": 0.1}, {"p1": 0.2}],
                           "var2": [{"p2": 1.0}, {"p2": 2.0}, {"p2": 3.0}],
@@ -289,6 +396,335 @@ def test_variations(capsys):
     assert variations[1].p2 == variations[4].p2 == 2.0 and variations[2].p2 == variations[5].p2 == 3.0
 
 
+def test_lazy_variations(capsys):
+    config = make_variations_config(["var1", "var2"])
+    assert config.count_variations() == 6
+    assert [v.get_variation_name() for v in config.iter_variations()] == \
+        [v.get_variation_name() for v in config.create_variations()] == \
+        [f"var1_{i}*var2_{j}" for i in range(2) for j in range(3)] == config.variation_names()
+    config.merge({"grid": None, "var2": [{"p2": 4.0}]})
+    assert config.count_variations() == 3
+    assert [v.get_variation_name() for v in config.iter_variations()] == ["var1_0", "var1_1", "var2_0"]
+
+
+def test_single_variations(capsys):
+    config = make_variations_config(["var1", "var2"])
+    variations = config.create_variations()
+    assert config.get_variation(4) == variations[4] and config.get_variation(-1).get_variation_name() == "var1_1*var2_2"
+    assert config.get_variation_by_name("var1_1*var2_0") == variations[3]
+    with pytest.raises(IndexError):
+        config.get_variation(6)
+    with pytest.raises(ValueError):
+        config.get_variation_by_name("var1_2*var2_0")
+
+
+def test_sharded_variations(capsys, tmp_file_name):
+    config = make_variations_config(["var1", "var2"])
+    for shard_by in ["index", "name"]:
+        shards = [config.variation_names(shard, 4, shard_by) for shard in range(4)]
+        assert sorted(sum(shards, [])) == sorted(config.variation_names())
+    assert [v.get_variation_name() for v in config.iter_variations(shard=1, num_shards=4)] == \
+        config.variation_names(1, 4) == ["var1_0*var2_1", "var1_1*var2_2"]
+    manifests = config.save_shard_manifests(os.path.join(os.path.dirname(tmp_file_name), "manifests"), 4, "name")
+    with open(manifests[2]) as f:
+        assert yaml.safe_load(f)["variations"] == config.variation_names(2, 4, "name")
+
+
+def test_sampled_variations(capsys):
+    config = make_variations_config(["var1", "var2"])
+    assert config.variation_names(sampling="first", sample_size=2) == ["var1_0*var2_0", "var1_0*var2_1"]
+    sample = config.variation_names(sampling="random", sample_size=4, seed=0)
+    assert len(sample) == 4 and sample == config.variation_names(sampling="random", sample_size=4, seed=0)
+    assert [v.get_variation_name() for v in config.iter_variations(sampling="random", sample_size=4, seed=0)] == \
+        sample == [name for name in config.variation_names() if name in sample]
+    assert config.variation_names(0, 2, sampling="random", sample_size=4, seed=0) == sample[::2]
+    for seed in range(10):
+        sample = config.variation_names(sampling="latin_hypercube", sample_size=2, seed=seed)
+        assert sorted(name.split("*")[0] for name in sample) == ["var1_0", "var1_1"]
+    with pytest.raises(ValueError):
+        config.variation_names(sampling="sobol", sample_size=2)
+    with pytest.raises(ValueError):
+        config.variation_names(sampling="random")
+
+
+def test_variation_command_lines(capsys, tmp_file_name):
+    config = make_variations_config(["var1", "var2"])
+    variations = config.create_variations()
+    command_lines = list(config.iter_command_line_arguments(variations))
+    assert command_lines[0] == "" and command_lines[5] == "--p1 '0.2' !float --p2 '3.0' !float"
+    for variation, command_line in zip(variations, command_lines):
+        variation_from_command_line = config.copy()
+        variation_from_command_line._merge(config._get_command_line_dict(command_line))
+        assert variation_from_command_line == variation
+    assert config.save_command_line_arguments(tmp_file_name, command="python main.py") == 6
+    with open(tmp_file_name) as f:
+        assert f.read().splitlines()[4] == "python main.py --p1 '0.2' !float --p2 '2.0' !float"
+
+
+def test_variation_fingerprints(capsys):
+    variations = make_variations_config().create_variations()
+    assert variations[0].fingerprint() == variations[2].fingerprint() != variations[1].fingerprint()
+    assert make_config({"a": 1, "b": {"c": [2.0]}}).fingerprint() == \
+        make_config({"b": {"c": [2]}, "a": 1.0}).fingerprint()
+    merkle = make_config({"a": 1, "b.c": [2.0], "b.d.e": True}, do_not_merge_command_line=True)
+    fingerprint, sub_fingerprint = merkle.fingerprint(), merkle.b.d._fingerprint
+    merkle.merge({"b.c": [3.0]})
+    assert merkle.b._fingerprint is None and merkle.b.d._fingerprint == sub_fingerprint  # only b was modified
+    assert merkle.fingerprint() != fingerprint
+    merkle.merge({"b.c": [2], "b.d.e": 1})
+    assert merkle.fingerprint() == fingerprint
+
+
+def test_variation_hashes(capsys):
+    # Different fingerprints only imply different configs when no value was changed by post-processing
+    post_processed = [make_config({"a": [i]}, post_processing_dict={"a": len}) for i in range(2)]
+    assert post_processed[0] == post_processed[1] and len(set(post_processed)) == 1
+    assert len({make_config({"a": 1, "b": [2.0]}), make_config({"b": [2], "a": True})}) == 1
+
+
+def test_duplicate_variations(capsys):
+    config = make_variations_config()
+    assert [v.get_variation_name() for v in config.create_variations(drop_duplicates=True)] == \
+        ["var1_0", "var1_1", "var2_1", "var2_2"]
+    assert config.get_variation_aliases() == {"var1_0": ["var2_0"], "var1_1": [], "var2_1": [], "var2_2": []}
+
+
+def test_registered_again_variations(capsys):
+    config = make_config({"p1": 0.1, "p2": 1.0, "var1": [{"p1": 0.1}, {"p1": 0.2}],
+                          "var2": [{"p2": 1.0}, {"p2": 2.0}, {"p2": 3.0}], "grid": ["var1", "var2"]},
+                         config_class=VariationsConfiguration, do_not_merge_command_line=True)
+    assert config.count_variations() == 6
+    config.merge({"grid": ["var2"]})  # replaces the former grid instead of adding a second one
+    assert config.variation_names() == ["var2_0", "var2_1", "var2_2", "var1_0", "var1_1"]
+    config.merge({"var1": {"low": {"p1": 0.0}, "high": {"p1": 1.0}, "max": {"p1": 2.0}}})
+    assert config.variation_names()[3:] == ["var1_low", "var1_high", "var1_max"]  # names are replaced too
+    config.merge({"grid": None, "var2": None})
+    assert config.variation_names() == ["var1_low", "var1_high", "var1_max"]
+
+
+def test_derived_variations(capsys):
+    config = make_config({"p1": 0.1, "p2": [1, 2], "sub.p3": 3, "sub.p2": [5],
+                          "var1": [{"p2": [3]}, {"p1": 0.2}], "var2": [{"sub.p3": 4}, {"sub": {"p2": [6, 7]}}],
+                          "grid": ["var1", "var2"]},
+                         variations_suffix="var*", grids_suffix="grid",
+                         post_processing_dict={"*p2": tuple, "sub.p3": lambda x: 2 * x},
+                         do_not_merge_command_line=True)
+    rebuilt, derived = config.create_variations(), config.create_variations(derive_from_base=True)
+    assert len(derived) == 4 and derived[1].sub.p2 == (6, 7) and derived[2].p2 == (1, 2) and derived[2].sub.p3 == 8
+    for variation, derived_variation in zip(rebuilt, derived):
+        assert variation == derived_variation
+        assert variation.get_variation_name() == derived_variation.get_variation_name()
+        assert variation._pre_postprocessing_values == derived_variation._pre_postprocessing_values
+        assert variation.get_command_line_argument() == derived_variation.get_command_line_argument()
+        assert variation.config_metadata["config_hierarchy"] == derived_variation.config_metadata["config_hierarchy"]
+    assert config.get_variation(1, derive_from_base=True) == rebuilt[1]
+    assert derived[0]._configuration_variations is config._configuration_variations  # shared until registered again
+    derived[0].merge({"grid": None, "var2": None})
+    assert derived[0].variation_names() == ["var1_0", "var1_1"] and config.count_variations() == 4
+
+
+def test_parallel_variations(capsys):
+    config = make_config({"p1": 0.1, "p2": 1.0, "var1": [{"p1": 0.2}, {"p1": 0.3}], "var2": [{"p2": 2.0}, {"p3": 3.0}],
+                          "grid": None},
+                         config_class=VariationsConfiguration, do_not_merge_command_line=True)
+    with pytest.raises(VariationBuildError) as error:
+        config.create_variations(workers=2)
+    assert [name for name, _ in error.value.errors] == ["var2_1"] and isinstance(error.value.errors[0][1], AttributeError)
+    assert [v.get_variation_name() for v in error.value.configs] == ["var1_0", "var1_1", "var2_0"]
+    config.merge({"var2": [{"p2": 2.0}, {"p2": 3.0}], "grid": ["var1", "var2"]})
+    for derive_from_base in [False, True]:
+        variations = list(config.iter_variations(derive_from_base, workers=3))
+        assert variations == config.create_variations()
+        assert [(v.get_variation_name(), v.p1, v.p2) for v in variations] == \
+            [(f"var1_{i}*var2_{j}", p1, p2) for i, p1 in enumerate([0.2, 0.3]) for j, p2 in enumerate([2.0, 3.0])]
+    with pytest.raises(TypeError, match="picklable"):
+        make_config({"p1": 0.1, "var1": [{"p1": 0.2}]}, variations_suffix="var*",
+                    do_not_merge_command_line=True).create_variations(workers=2)
+
+
+def test_constrained_variations(capsys):
+    config = make_config({"model": "linear", "degree": 1, "p": 0,
+                          "var1": {"lin": {"model": "linear"}, "poly": {"model": "poly"}},
+                          "var2": [{"degree": 1}, {"degree": 2}, {"degree": 3}], "var3": [{"p": 0}, {"p": 1}],
+                          "grid": ["var1", "var2", "var3"], "constraints": {"var1": "lin", "var2": [1, 2]}},
+                         variations_suffix="var*", grids_suffix="grid", constraints_suffix="constraints",
+                         do_not_merge_command_line=True)
+    names = [f"var1_{m}*var2_{d}*var3_{p}" for m in ["lin", "poly"] for d in range(3) for p in range(2)
+             if m == "poly" or d == 0]
+    assert config.count_variations() == 8 and config.variation_names() == names
+    assert [v.get_variation_name() for v in config.create_variations()] == names
+    assert [config.get_variation(i).get_variation_name() for i in range(-8, 8)] == names + names
+    assert config.get_variation_by_name("var1_poly*var2_1*var3_1") == config.get_variation(5)
+    with pytest.raises(ValueError):
+        config.get_variation_by_name("var1_lin*var2_1*var3_0")
+    for seed in range(5):
+        assert set(config.variation_names(sampling="latin_hypercube", sample_size=4, seed=seed)).issubset(names)
+    config.merge({"constraints": [{"var1": "poly"}, {"var2": "0", "var3": "0"}]})
+    assert config.variation_names() == [f"var1_lin*var2_{d}*var3_{p}" for d in range(3) for p in range(2) if d or p]
+    config.merge({"constraints": {"var2": "3"}})
+    with pytest.raises(ValueError, match="unknown variation names"):
+        config.count_variations()
+
+
+def test_deferred_side_effects(capsys, tmp_file_name):
+    folder = os.path.join(os.path.dirname(tmp_file_name), "log")
+    config = make_config({"path": os.path.join(folder, "exp"), "p": 0, "var": [{"p": 1}, {"p": 2}]},
+                         pre_processing_dict={"path": Configuration.register_as_experiment_path},
+                         variations_suffix="var*", do_not_merge_command_line=True)
+    assert glob(os.path.join(folder, "*")) == [os.path.join(folder, "exp_0")]
+    for derive_from_base in [False, True]:
+        variations = config.create_variations(derive_from_base=derive_from_base, defer_side_effects=True)
+        assert len(glob(os.path.join(folder, "*"))) == 1 + 2 * derive_from_base
+        assert variations[1].get_command_line_argument()[0] == f"--path '{os.path.join(folder, 'exp')}' !str"
+        variations[1].activate()
+        assert variations[1].path == os.path.join(folder, f"exp_{1 + 2 * derive_from_base}")
+        variations[0].activate()
+        assert variations[0].path == os.path.join(folder, f"exp_{2 + 2 * derive_from_base}")
+        assert variations[0].p == 1 and variations[1].p == 2
+    assert config.path == os.path.join(folder, "exp_0")
+
+    def build_while_deferring(deferring, built):
+        with Configuration._deferring_side_effects():
+            deferring.set()
+            built.wait(5)
+
+    deferring, built = threading.Event(), threading.Event()
+    with ThreadPoolExecutor(1) as executor:
+        executor.submit(build_while_deferring, deferring, built)
+        deferring.wait(5)
+        other = make_config({"path": os.path.join(folder + "_other", "exp")},
+                            pre_processing_dict={"path": Configuration.register_as_experiment_path},
+                            do_not_merge_command_line=True)
+        built.set()
+    # The deferral of the other thread does not apply while building the config
+    assert glob(os.path.join(folder + "_other", "*")) == [os.path.join(folder + "_other", "exp_0")]
+    assert other.path == os.path.join(folder + "_other", "exp_0")
+    saved_path = os.path.join(os.path.dirname(tmp_file_name), "saved.yaml")
+    config.save(saved_path, store=os.path.join(os.path.dirname(tmp_file_name), "store"))
+    assert len(glob(os.path.join(folder, "*"))) == 5  # the default values are stored without side effects
+    assert make_config(saved_path, do_not_merge_command_line=True).path == os.path.join(folder, "exp_0")
+    # Without defer_side_effects, the variations are processed as soon as they are built
+    assert [variation.path for variation in config.iter_variations()] == [os.path.join(folder, "exp_5"),
+                                                                          os.path.join(folder, "exp_6")]
+    assert config.get_variation_by_name("var_1").path == os.path.join(folder, "exp_7")
+
+
+def test_indexed_folders(tmp_file_name):
+    folder = os.path.join(os.path.dirname(tmp_file_name), "log")
+    os.makedirs(os.path.join(folder, "exp_4"))
+    os.makedirs(os.path.join(folder, "exp_other_9"))
+    with ThreadPoolExecutor(16) as executor:
+        paths = list(executor.map(lambda _: create_indexed_folder(folder, "exp"), range(64)))
+    assert sorted(paths) == sorted(os.path.join(folder, f"exp_{i}") for i in range(5, 69))
+    os.makedirs(os.path.join(folder, "exp_69"))  # created without updating the counter
+    assert create_indexed_folder(folder, "exp") == os.path.join(folder, "exp_70")
+
+
+def test_sweep_executor(capsys, tmp_file_name):
+    folder = os.path.join(os.path.dirname(tmp_file_name), "sweep")
+    config = make_config({"p1": 0.1, "var1": [{"p1": 0.2}, {"p1": 0.3}, {"p1": 0.15}]}, variations_suffix="var*",
+                         do_not_merge_command_line=True)
+    results = SweepExecutor(run_sweep_variation, folder, workers=2, retries=1, poll_interval=0.01).run(config)
+    assert [(r.name, r.status, r.attempts) for r in results] == \
+        [("var1_0", "succeeded", 1), ("var1_1", "failed", 2), ("var1_2", "succeeded", 1)]
+    with open(os.path.join(folder, "var1_1", "run.log")) as f:
+        log = f.read()
+    assert log.count("p1 = 0.3") == 2 and "ValueError: p1 is too large" in log
+    with open(os.path.join(folder, "var1_2", "run_status.yaml")) as f:
+        assert yaml.safe_load(f)["exit_code"] == 0
+    assert load_config(os.path.join(folder, "var1_2", "config.yaml"), default_config=config.get_dict()).p1 == 0.15
+    command = f"{sys.executable} -c \"import sys; print(sys.argv[1:]); sys.exit('0.3' in sys.argv)\" {{args}}"
+    results = SweepExecutor(command, folder, timeout=5, poll_interval=0.01).run(config)
+    assert [r.exit_code for r in results] == [0, 1, 0]
+    with open(os.path.join(folder, "var1_0", "run.log")) as f:
+        assert "['--p1', '0.2', '!float']" in f.read()
+    results = SweepExecutor(exit_sweep_variation, folder, poll_interval=0.01).run(config)
+    assert [(r.status, r.exit_code) for r in results] == [("failed", 2), ("failed", 3), ("succeeded", 0)]
+    results = SweepExecutor("sleep 10", folder, timeout=0.2, poll_interval=0.01).run(config, [config])
+    assert results[0].status == "timeout" and results[0].folder == os.path.join(folder, "main")
+    executor = SweepExecutor("true", folder)
+    assert len({executor.get_run_folder(name) for name in ["a*b", "a-b", "a/b", "a%2Fb"]}) == 4
+    assert os.path.dirname(executor.get_run_folder("../a/b")) == folder
+
+
+def test_successive_halving(capsys, tmp_file_name):
+    folder = os.path.join(os.path.dirname(tmp_file_name), "halving")
+    with open(tmp_file_name, "w") as f:
+        f.write(f"lr: 0.1\ntrain: !train\n  epochs: 100\nlr_var: {[{'lr': lr} for lr in range(1, 10)]}")
+    config = make_config(str(tmp_file_name), variations_suffix="*_var", do_not_merge_command_line=True)
+    scheduler = SuccessiveHalving(train_sweep_variation, folder, "train.epochs", 1, 9, ("loss", read_losses),
+                                  poll_interval=0.01)
+    assert scheduler.get_budgets() == [1, 3, 9]
+    rungs = scheduler.run(config)
+    assert [len(rung.results) for rung in rungs] == [9, 3, 1]
+    assert rungs[0].promoted == ["lr_var_0", "lr_var_1", "lr_var_2"] and rungs[-1].promoted == ["lr_var_0"]
+    assert rungs[1].metrics[0] == pytest.approx(0.7 / 3) and config.train.epochs == 100
+    with open(os.path.join(folder, "rungs.yaml")) as f:
+        assert yaml.safe_load(f)[2]["runs"] == {"lr_var_0": {"status": "succeeded", "loss": pytest.approx(0.7 / 9)}}
+    with pytest.raises(ValueError, match="eta must be an integer greater than 1"):
+        SuccessiveHalving(train_sweep_variation, folder, "train.epochs", 1, 9, ("loss", read_losses), eta=1)
+    scheduler = SuccessiveHalving(train_sweep_variation_failing, folder + "_failing", "train.epochs", 1, 9,
+                                  ("loss", read_losses), poll_interval=0.01)
+    rungs = scheduler.run(config)
+    assert rungs[0].metrics[0] is None and rungs[0].results[0].status == "failed"
+    assert rungs[0].promoted == ["lr_var_1", "lr_var_2", "lr_var_3"] and rungs[-1].promoted == ["lr_var_1"]
+
+
+def test_work_queue(capsys, tmp_file_name):
+    folder = os.path.join(os.path.dirname(tmp_file_name), "queue")
+    config = make_config({"a": 0, "b": 0, "var_a": [{"a": 1}, {"a": 2}], "var_b": [{"b": 1}, {"b": 2}]},
+                         variations_suffix="var*", do_not_merge_command_line=True)
+    queue = WorkQueue(folder, lease_timeout=60)
+    assert queue.populate(config) == 4 and queue.populate(config) == 0
+    assert queue.status() == {"queued": 4, "running": 0, "expired": 0, "done": 0}
+    first, second = queue.claim(), WorkQueue(folder, lease_timeout=60).claim()
+    assert first.name != second.name
+    first.complete()
+    os.utime(second.path, (0, 0))  # simulates a worker that crashed without releasing its lease
+    assert queue.status() == {"queued": 2, "running": 0, "expired": 1, "done": 1}
+    loaded_config = make_config(queue.get_config_path(), variations_suffix="var*", do_not_merge_command_line=True)
+    values = [(variation.a, variation.b) for variation in WorkQueue(folder).iter_variations(loaded_config)]
+    assert (first.name, values) == ("var_a_0", [(2, 0), (0, 1), (0, 2)])
+    assert queue.status() == {"queued": 0, "running": 0, "expired": 0, "done": 4} and queue.claim() is None
+    queue = WorkQueue(os.path.join(folder, "fenced"), lease_timeout=60, worker_id="first")
+    assert queue.populate(config, names=["var_a_0", "var*a/0", "var-a-0"]) == 3
+    first = queue.claim()
+    os.utime(first.path, (0, 0))
+    second = WorkQueue(queue.folder, lease_timeout=60, worker_id="second").claim()
+    assert second.name == first.name and not first.is_held() and second.is_held()
+    first.heartbeat()
+    first.complete()  # the expired lease was claimed again : the task is left to the second worker
+    assert queue.status() == {"queued": 2, "running": 1, "expired": 0, "done": 0}
+    second.complete()
+    assert queue.status() == {"queued": 2, "running": 0, "expired": 0, "done": 1}
+
+
+def test_experiment_cache(capsys, tmp_file_name):
+    folder = os.path.dirname(tmp_file_name)
+    config = make_config({"p1": 0.1, "path": "a", "var1": [{"p1": 0.2}, {"p1": 0.3}]}, variations_suffix="var*",
+                         do_not_merge_command_line=True)
+    cache = ExperimentCache(os.path.join(folder, "cache", "index.yaml"), volatile_keys=["path"])
+    variations = config.create_variations()
+    for index in range(2):
+        os.makedirs(os.path.join(folder, f"run_{index}"))
+    cache.mark_completed(variations[0], os.path.join(folder, "run_0"))
+    cache.add(variations[1], os.path.join(folder, "run_1"))
+    cache = ExperimentCache(os.path.join(folder, "cache", "index.yaml"), volatile_keys=["path"])
+    relaunched = variations[0].copy()
+    relaunched.merge({"path": "b"})
+    assert len(cache) == 2 and relaunched in cache and config not in cache
+    assert cache.get_completed_folder(relaunched) == os.path.join(folder, "run_0")
+    assert cache.get_folder(variations[1]) == os.path.join(folder, "run_1") and not cache.is_completed(variations[1])
+    assert [v.get_variation_name() for v in config.iter_variations(cache=cache)] == ["var1_1"]
+    with pytest.raises(ValueError):
+        cache.mark_completed(config)
+    if hasattr(os, "fork"):
+        index_path = os.path.join(folder, "concurrent", "index.yaml")
+        with multiprocessing.get_context("fork").Pool(4) as pool:
+            pool.starmap(add_to_experiment_cache, [(index_path, worker) for worker in range(4)])
+        assert len(ExperimentCache(index_path)) == 40
+
+
 def test_pre_processing(capsys, tmp_file_name, yaml_no_file_call_processing_while_loading, yaml_default,
                         yaml_no_file_call_processing_while_loading_nested, yaml_default_preproc_default_dot_param,
                         yaml_experiment):
@@ -371,6 +807,28 @@ def test_post_processing(capsys, yaml_default, yaml_experiment, tmp_file_name,
     assert make_config(dico).a == 10
 
 
+def test_post_processing_snapshots(capsys, tmp_file_name):
+    def append_in_place(x):
+        x.append(4)
+        return x
+    postprocessing = {"in_place": append_in_place, "untouched": lambda x: x, "converted": tuple}
+    config = make_config({"in_place": [1, 2, 3], "untouched": [[1], {"a": [2]}], "converted": [5, [6]]},
+                         post_processing_dict=postprocessing, do_not_merge_command_line=True)
+    assert config.in_place == [1, 2, 3, 4]
+    assert config.converted == (5, [6])
+    assert "untouched" not in config._pre_postprocessing_values
+    assert config._pre_postprocessing_values["in_place"] == [1, 2, 3]
+    snapshot = config._pre_postprocessing_values["in_place"]
+    assert freeze_value(snapshot) is snapshot
+    config.save(str(tmp_file_name))
+    config2 = make_config(str(tmp_file_name), do_not_merge_command_line=True)
+    assert config2.in_place == [1, 2, 3]
+    assert config2.untouched == [[1], {"a": [2]}]
+    assert config2.converted == [5, [6]]
+    config.converted[1].append(7)
+    assert config._get_value_before_post_processing("converted") == [5, [6]]
+
+
 def test_save_reload(capsys, tmp_file_name, yaml_default, yaml_experiment):
     config = load_config(yaml_experiment, default_config=yaml_default)
     captured = capsys.readouterr()
@@ -386,6 +844,66 @@ def test_save_reload(capsys, tmp_file_name, yaml_default, yaml_experiment):
     assert config == config2 == config3
 
 
+def test_save_reload_fsync(capsys, tmp_file_name, yaml_default, yaml_experiment):
+    config = load_config(yaml_experiment, default_config=yaml_default)
+    capsys.readouterr()
+    config.save(str(tmp_file_name), fsync=True, verbose=False)
+    assert "saved" not in capsys.readouterr().out
+    assert not glob(os.path.join(os.path.dirname(tmp_file_name), ".*"))  # no temporary file left behind
+    assert load_config(str(tmp_file_name), default_config=yaml_default) == config
+
+
+def test_save_reload_archive(capsys, tmp_file_name, yaml_default, yaml_experiment):
+    archive_path = os.path.join(os.path.dirname(tmp_file_name), "sweep.zip")
+    config = load_config(yaml_experiment, default_config=yaml_default)
+    for run in range(3):
+        config.save(os.path.join(archive_path, f"run_{run}", "config.yaml"))
+    config.save()  # overwrites the last save, inside the archive
+    archive = ConfigArchive(archive_path)
+    assert ConfigHistory.find_saved_configs(archive_path) == \
+        [os.path.join(archive_path, f"run_{run}", "config.yaml") for run in range(3)]
+    assert len(archive.get_members()) == 6 and "run_2/config_hierarchy.yaml" in archive
+    config.save(os.path.join(archive_path, "run_0", "config.yaml"), compression="lzma")
+    with zipfile.ZipFile(archive_path) as f:
+        assert len(f.namelist()) == 6 and f.getinfo("run_0/config.yaml").compress_type == zipfile.ZIP_LZMA
+    with pytest.raises(TypeError):
+        archive.write("run_3/config.yaml", 0)  # interrupted while writing the new archive
+    assert len(archive.get_members()) == 6
+    assert not glob(os.path.join(os.path.dirname(tmp_file_name), ".sweep.zip.*.tmp"))
+    assert load_config(os.path.join(archive_path, "run_1", "config.yaml"), default_config=yaml_default) == config
+    assert not glob(os.path.join(os.path.dirname(tmp_file_name), "run_*"))
+    with pytest.raises(FileNotFoundError, match="path not found"):
+        load_config(os.path.join(archive_path, "run_3", "config.yaml"), default_config=yaml_default)
+    with pytest.raises(ValueError, match="Unknown compression 'gzip'"):
+        ConfigArchive(archive_path, compression="gzip")
+
+
+def test_save_reload_store(capsys, tmp_file_name, yaml_default, yaml_experiment):
+    folder = os.path.dirname(tmp_file_name)
+    store = ConfigStore(os.path.join(folder, "store"))
+    config = load_config(yaml_experiment, default_config=yaml_default)
+    for run in range(3):
+        config.merge({"param1": float(run)})
+        config.save(os.path.join(folder, f"run_{run}.yaml"), store=store.folder)
+        assert make_config(os.path.join(folder, f"run_{run}.yaml"), do_not_merge_command_line=True) == config
+        assert load_config(os.path.join(folder, f"run_{run}.yaml"), default_config=yaml_default) == config
+    with open(os.path.join(folder, "run_2.yaml")) as f:
+        saved = yaml.safe_load(f)
+    assert saved["config_default_reference"]["store"] == "store"
+    assert saved["param1"] == 2.0 and saved["subconfig1.param2"] == 2.0
+    assert "subconfig2.subconfig3.param4" not in saved  # only differences with the default are saved
+    with open(os.path.join(folder, "run_0.yaml")) as f:
+        assert "config_default_reference" in yaml.safe_load(f)  # auto-saved in the store on merge
+    fragments = sorted(glob(os.path.join(store.folder, "*", "*.yaml")))
+    assert len(fragments) == 6  # default values, 2 config files and 3 merged dicts
+    config.save(os.path.join(folder, "run_3.yaml"), store=store.folder)
+    assert sorted(glob(os.path.join(store.folder, "*", "*.yaml"))) == fragments  # fragments are stored once
+    hierarchy = store.read_hierarchy(os.path.join(folder, "run_2_hierarchy.yaml"))
+    with open(yaml_default) as f:
+        assert hierarchy[0] == f.read()
+    assert hierarchy[-1] == {"param1": 2.0}
+
+
 def test_save_reload_method_param(capsys, tmp_file_name):
     config = make_config({"save": 1}, do_not_merge_command_line=True)
     captured = capsys.readouterr()
@@ -475,6 +993,40 @@ def test_pattern_matching():
     assert not compare_string_pattern("abcdefgh0123", "*3*3*3")
 
 
+def test_adapt_to_type_random_values():
+    rng = random.Random(0)
+
+    def generate(depth):
+        # Returns a random value and the way a user would type it in the command line
+        kind = rng.choice(["int", "float", "str", "list", "dict"] if depth < 3 else ["int", "float", "str"])
+        spaces = " " * rng.randint(0, 2)
+        if kind == "list":
+            items = [generate(depth + 1) for _ in range(rng.randint(1, 4))]
+            return [i[0] for i in items], f"[{','.join(spaces + i[1] for i in items)}]!list"
+        if kind == "dict":
+            items = {f"key{i}": generate(depth + 1) for i in range(rng.randint(1, 3))}
+            return {k: v[0] for k, v in items.items()}, \
+                "{" + ",".join(f"{spaces}{k}:{v[1]}" for k, v in items.items()) + "}!dict"
+        if kind == "int":
+            value = rng.randint(-1000, 1000)
+        elif kind == "float":
+            value = rng.uniform(-1000, 1000)
+        else:
+            value = "".join(rng.choice("abc_-.") for _ in range(rng.randint(1, 8)))
+            if depth == 1 and rng.random() < 0.3:
+                return value + ",a b", f"{value}\\,a\\ b{spaces}!str"
+        return value, f"{value}{spaces}!{kind}"
+
+    for _ in range(500):
+        items = [generate(1) for _ in range(rng.randint(0, 4))]
+        string = f"[{', '.join(i[1] for i in items)}]"
+        assert adapt_to_type([None], string, None, "param") == [i[0] for i in items]
+    long_list = [float(i) for i in range(10000)]
+    assert adapt_to_type([0.5], str(long_list), None, "param") == long_list
+    assert adapt_to_type({"a": [1]}, "{a:[1, \\ 2\\ , 3 ] , b : x y !str}", None, "param") == \
+        {"a": [1, 2, 3], "b": "x y"}
+
+
 def test_warnings(capsys, tmp_file_name, yaml_default):
     # config = ConfigForTests(config_path_or_dictionary={"param": None, "lparam": [], "dparam": {"param2": 1}})
     # config.merge_from_command_line("--param=1 --lparam=[1] --dparam={param2:2,param3:3}")
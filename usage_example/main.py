@@ -27,7 +27,7 @@ def perform_experiment(config_path):
     config = ProjectSpecificConfiguration.load_config(config_path)
 
     for _ in range(config.number_of_repeats):
-        for variation in config.create_variations() if config.create_variations() else [config]:
+        for variation in config.iter_variations() if config.count_variations() else [config]:
             train, test = create_data(variation.data)
             model = create_and_train_model(variation.model, train)
             computed_metrics = test_model_and_return_metrics(model, test, variation.metrics)
@@ -20,6 +20,7 @@ import json
 import os
 import scipy.stats as stats
 import numpy as np
+from rr.ml.config.config_utils import create_indexed_folder
 
 
 class Metrics:
@@ -57,10 +58,6 @@ def test_model_and_return_metrics(model, test_samples, metrics):
 
 
 def log_experiment(config, metrics):
-    exp_dir = os.path.join("log", config.name)
-    if not os.path.exists(exp_dir):
-        os.makedirs(exp_dir)
-    run_dir = os.path.join(exp_dir, f"run_{len(os.listdir(exp_dir))}")
-    os.makedirs(run_dir)
+    run_dir = create_indexed_folder(os.path.join("log", config.name), "run")
     config.save(os.path.join(run_dir, "config_save.yaml"))
     json.dump(metrics, open(os.path.join(run_dir, "metrics.json"), 'w'))